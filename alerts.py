@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Price and P&L alerts for the Stock Portfolio Tracker
+
+Rules live in the alert_rules table. A rule is one of:
+- a price threshold on a symbol ('above' or 'below' a price)
+- a percent move on a symbol ('move_up' or 'move_down' by threshold percent from a
+  reference price; without a reference, the previous close in price_history)
+- a P&L limit on one account, or on all of them ('pnl_above' or 'pnl_below')
+
+AlertEngine keeps each symbol's price rules as two sorted lists of trigger
+levels, one for rules that fire on the way up and one for rules that fire
+on the way down. A new price is compared with the symbol's last one and
+only the levels between the two are visited (found by bisection), so a
+tick costs the same with ten rules or tens of thousands.
+
+A rule fires once when its level is crossed and is then disarmed until
+the price moves back past the level by REARM_MARGIN, so a price hovering
+around a threshold doesn't raise an alert on every tick. The armed state
+is saved with the rule, so restarting the app doesn't repeat alerts.
+Every alert is appended to an alert log as JSON lines.
+"""
+
+import bisect
+import json
+import threading
+from collections import namedtuple
+from datetime import date, datetime
+
+import metrics
+from engine import value_accounts
+from symbols import normalize_symbol
+
+LOG_PATH = 'alerts.log.jsonl'
+REARM_MARGIN = 0.01  # a fired rule re-arms once the price is back 1% on the other side of its level
+PRICE_KINDS = ('above', 'below')
+MOVE_KINDS = ('move_up', 'move_down')
+PNL_KINDS = ('pnl_above', 'pnl_below')
+KINDS = PRICE_KINDS + MOVE_KINDS + PNL_KINDS
+RISING = ('above', 'move_up', 'pnl_above')  # kinds that fire when the value rises through their level
+
+Rule = namedtuple('Rule', ['id', 'kind', 'symbol', 'account_id', 'threshold', 'reference', 'armed',
+                           'triggered_at', 'note'])
+Alert = namedtuple('Alert', ['rule_id', 'kind', 'symbol', 'account_id', 'threshold', 'value', 'triggered_at',
+                             'message'])
+
+
+def add_rule(conn, kind, threshold, symbol=None, account_id=None, reference=None, note=None):
+    """Validate and save a rule; returns its id. Raises ValueError with a message fit to show the user."""
+    if kind not in KINDS:
+        raise ValueError(f"Unknown alert kind {kind!r}; use one of {', '.join(KINDS)}")
+    try:
+        threshold = float(threshold)
+        reference = float(reference) if reference not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError("Threshold and reference must be numbers")
+
+    if kind in PNL_KINDS:
+        symbol = None
+    else:
+        symbol = normalize_symbol(symbol or '')
+        if not symbol:
+            raise ValueError("Price and move alerts need a symbol")
+        if threshold <= 0:
+            raise ValueError("Price and percent thresholds must be positive")
+        if kind == 'move_down' and threshold >= 100:
+            raise ValueError("A fall must be less than 100%")
+        if reference is not None and reference <= 0:
+            raise ValueError("The reference price must be positive")
+
+    with conn:
+        if account_id is not None and conn.execute("SELECT 1 FROM accounts WHERE id = ?",
+                                                   (account_id,)).fetchone() is None:
+            raise ValueError(f"No account with id {account_id}")
+        return conn.execute("""
+            INSERT INTO alert_rules (kind, symbol, account_id, threshold, reference, note)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (kind, symbol, account_id, threshold, reference, note)).lastrowid
+
+
+def delete_rule(conn, rule_id):
+    """Remove a rule; returns True if it existed"""
+    with conn:
+        return conn.execute("DELETE FROM alert_rules WHERE id = ?", (rule_id,)).rowcount > 0
+
+
+def list_rules(conn, symbol=None):
+    """Return every Rule (or one symbol's), in creation order"""
+    sql = "SELECT id, kind, symbol, account_id, threshold, reference, armed, triggered_at, note FROM alert_rules"
+    if symbol is not None:
+        return [Rule(*row) for row in conn.execute(sql + " WHERE symbol = ? ORDER BY id", (symbol,))]
+    return [Rule(*row) for row in conn.execute(sql + " ORDER BY id")]
+
+
+def previous_closes(conn, symbols, today=None):
+    """Return {symbol: price} from each symbol's newest price_history row before today"""
+    today = (today or date.today()).isoformat()
+    return {symbol: price for symbol, price in conn.execute("""
+        SELECT value, price FROM json_each(?)
+        JOIN price_history ON price_history.id = (
+            SELECT id FROM price_history WHERE symbol = value AND date < ? ORDER BY date DESC LIMIT 1
+        )
+    """, (json.dumps(list(symbols)), today))}
+
+
+def write_state(conn, changes):
+    """Save (rule_id, armed, triggered_at) changes from AlertEngine.take_changes(); does not commit"""
+    conn.executemany("UPDATE alert_rules SET armed = ?, triggered_at = COALESCE(?, triggered_at) WHERE id = ?",
+                     [(int(armed), triggered_at, rule_id) for rule_id, armed, triggered_at in changes])
+
+
+def append_log(alerts, path=LOG_PATH):
+    """Append alerts to the alert log as JSON lines; the file is only ever appended to"""
+    if not alerts:
+        return
+    with open(path, 'a', encoding='utf-8') as f:
+        for alert in alerts:
+            f.write(json.dumps(alert._asdict()) + '\n')
+
+
+def read_log(path=LOG_PATH, limit=None):
+    """Return the newest limit alerts from the alert log (all of them if limit is None), oldest first"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+    if limit is not None:
+        lines = lines[-limit:] if limit else []
+    return [Alert(**json.loads(line)) for line in lines if line.strip()]
+
+
+class Levels:
+    """Trigger levels sorted ascending, with the rule id for each"""
+
+    def __init__(self):
+        self.levels = []
+        self.rule_ids = []
+        self.pending = []  # (level, rule id) added since the last lookup, merged in by sort()
+
+    def add(self, level, rule_id):
+        self.pending.append((level, rule_id))
+
+    def sort(self):
+        pairs = sorted(list(zip(self.levels, self.rule_ids)) + self.pending)
+        self.levels = [level for level, _ in pairs]
+        self.rule_ids = [rule_id for _, rule_id in pairs]
+        self.pending = []
+
+    def between(self, low, high, right=True):
+        """Rule ids whose level is in (low, high] (right=True) or [low, high) (right=False); None is unbounded"""
+        if self.pending:
+            self.sort()
+        find = bisect.bisect_right if right else bisect.bisect_left
+        start = 0 if low is None else find(self.levels, low)
+        stop = len(self.levels) if high is None else find(self.levels, high)
+        return self.rule_ids[start:stop]
+
+    def __len__(self):
+        return len(self.levels) + len(self.pending)
+
+
+class AlertEngine:
+    """Evaluates the alert rules against incoming prices. Not thread-safe: feed it from one thread."""
+
+    def __init__(self, margin=REARM_MARGIN, clock=None):
+        self.margin = margin
+        self.clock = clock or (lambda: datetime.now().isoformat(timespec='seconds'))
+        self.lock = threading.Lock()  # guards changes, which the UI may take from another thread
+        self.loaded_day = None  # the day move rules' previous closes were read for
+        self.clear()
+
+    def clear(self):
+        self.rules = {}  # rule id -> Rule
+        self.levels = {}  # rule id -> trigger price (or P&L) level
+        self.armed = {}  # rule id -> bool
+        self.rising = {}  # symbol -> Levels of rules that fire on the way up
+        self.falling = {}  # symbol -> Levels of rules that fire on the way down
+        self.unresolved = {}  # symbol -> move rules waiting for a first price to measure from
+        self.last = {}  # symbol -> last price seen
+        self.pnl_rules = []
+        self.positions = []  # (account_id, symbol, quantity, avg_cost) for P&L rules
+        self.position_symbols = set()
+        self.changes = {}
+
+    def load(self, conn, positions=None, today=None):
+        """Load every rule from the database; positions (from storage.load_account_holdings) feed P&L rules.
+
+        Rules already loaded keep their armed state, which may not have been saved yet. The next
+        price for each symbol is checked against all of its rules, so a new rule whose condition
+        already holds fires straight away. Move rules measure from the last close before today
+        (a date, the local date by default); reload once loaded_day is no longer today.
+        """
+        armed, changes = self.armed, self.changes
+        self.clear()
+        self.changes = changes
+        self.loaded_day = today or date.today()
+        rules = list_rules(conn)
+        moves = {rule.symbol for rule in rules if rule.kind in MOVE_KINDS and rule.reference is None}
+        closes = previous_closes(conn, moves, self.loaded_day) if moves else {}
+        for rule in rules:
+            self.add(rule, closes.get(rule.symbol), armed.get(rule.id, rule.armed))
+        if self.pnl_rules:
+            self.load_positions(conn if positions is None else positions)
+        return len(rules)
+
+    def load_positions(self, source):
+        """Replace the positions P&L rules are measured on, from a connection or a list of rows"""
+        if hasattr(source, 'execute'):
+            import storage
+            source = storage.load_account_holdings(source)
+        self.positions = list(source)
+        self.position_symbols = {symbol for _, symbol, _, _ in self.positions}
+
+    def add(self, rule, previous_close=None, armed=None):
+        self.rules[rule.id] = rule
+        self.armed[rule.id] = bool(rule.armed if armed is None else armed)
+        if rule.kind in PNL_KINDS:
+            self.levels[rule.id] = rule.threshold
+            self.pnl_rules.append(rule)
+            return
+        reference = rule.reference if rule.reference is not None else previous_close
+        if rule.kind in MOVE_KINDS and reference is None:
+            self.unresolved.setdefault(rule.symbol, []).append(rule)
+            return
+        self.place(rule, reference)
+
+    def place(self, rule, reference=None):
+        """Index a price or move rule under its symbol at its trigger price"""
+        if rule.kind == 'move_up':
+            level = reference * (1 + rule.threshold / 100)
+        elif rule.kind == 'move_down':
+            level = reference * (1 - rule.threshold / 100)
+        else:
+            level = rule.threshold
+        self.levels[rule.id] = level
+        index = self.rising if rule.kind in RISING else self.falling
+        index.setdefault(rule.symbol, Levels()).add(level, rule.id)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def update(self, prices):
+        """Check {symbol: price or None} against the rules; returns the Alerts raised, in rule order"""
+        fired = []
+        for symbol, price in prices.items():
+            if price is None or price != price:  # missing or NaN
+                continue
+            pending = self.unresolved.pop(symbol, None)
+            if pending:
+                for rule in pending:
+                    self.place(rule, price)
+            previous = self.last.get(symbol)
+            self.last[symbol] = price
+            if price == previous:
+                continue
+            rising = self.rising.get(symbol)
+            if rising:
+                self.check_rising(rising, symbol, previous, price, fired)
+            falling = self.falling.get(symbol)
+            if falling:
+                self.check_falling(falling, symbol, previous, price, fired)
+
+        if self.pnl_rules and not self.position_symbols.isdisjoint(prices):
+            self.check_pnl(fired)
+        fired.sort(key=lambda alert: alert.rule_id)
+        return fired
+
+    def check_rising(self, levels, symbol, previous, price, fired):
+        """Fire rules whose level the price rose to or through; re-arm those it fell well below"""
+        if previous is None:
+            for rule_id in levels.between(None, price):
+                self.fire(rule_id, symbol, price, fired)
+            self.rearm_all(levels, lambda level: price <= level * (1 - self.margin))
+        elif price > previous:
+            for rule_id in levels.between(previous, price):
+                self.fire(rule_id, symbol, price, fired)
+        else:
+            for rule_id in levels.between(price / (1 - self.margin), previous / (1 - self.margin), right=False):
+                self.rearm(rule_id)
+
+    def check_falling(self, levels, symbol, previous, price, fired):
+        """Fire rules whose level the price fell to or through; re-arm those it rose well above"""
+        if previous is None:
+            for rule_id in levels.between(price, None, right=False):
+                self.fire(rule_id, symbol, price, fired)
+            self.rearm_all(levels, lambda level: price >= level * (1 + self.margin))
+        elif price < previous:
+            for rule_id in levels.between(price, previous, right=False):
+                self.fire(rule_id, symbol, price, fired)
+        else:
+            for rule_id in levels.between(previous / (1 + self.margin), price / (1 + self.margin)):
+                self.rearm(rule_id)
+
+    def rearm_all(self, levels, condition):
+        """On a symbol's first price, re-arm the disarmed rules it has moved back past"""
+        for rule_id in levels.between(None, None):
+            if not self.armed[rule_id] and condition(self.levels[rule_id]):
+                self.rearm(rule_id)
+
+    def check_pnl(self, fired):
+        """Value the accounts with P&L rules at the latest prices and check their limits"""
+        totals = value_accounts(self.positions, self.last)
+        pnl = {account.account_id: account.total_gain_loss for account in totals}
+        pnl[None] = sum(pnl.values())
+        for rule in self.pnl_rules:
+            value = pnl.get(rule.account_id)
+            if value is None:
+                continue
+            margin = abs(rule.threshold) * self.margin
+            if rule.kind == 'pnl_above':
+                hit, clear = value >= rule.threshold, value <= rule.threshold - margin
+            else:
+                hit, clear = value <= rule.threshold, value >= rule.threshold + margin
+            if hit:
+                self.fire(rule.id, None, value, fired)
+            elif clear:
+                self.rearm(rule.id)
+
+    def fire(self, rule_id, symbol, value, fired):
+        if not self.armed[rule_id]:
+            return
+        rule = self.rules[rule_id]
+        now = self.clock()
+        self.armed[rule_id] = False
+        with self.lock:
+            self.changes[rule_id] = (False, now)
+        alert = Alert(rule_id, rule.kind, symbol, rule.account_id, rule.threshold, value, now,
+                      describe(rule, value, self.levels[rule_id]))
+        fired.append(alert)
+        metrics.count('alerts_total', kind=rule.kind)
+        metrics.log('info', 'alert', alert.message, rule_id=rule_id, symbol=symbol, value=value)
+
+    def rearm(self, rule_id):
+        if self.armed[rule_id]:
+            return
+        self.armed[rule_id] = True
+        with self.lock:
+            self.changes[rule_id] = (True, None)
+
+    def take_changes(self):
+        """Return and forget the (rule_id, armed, triggered_at) changes since the last call, for write_state()"""
+        with self.lock:
+            changes, self.changes = self.changes, {}
+        return [(rule_id, armed, triggered_at) for rule_id, (armed, triggered_at) in changes.items()]
+
+
+def describe(rule, value, level):
+    """A one-line description of a rule that has just fired"""
+    if rule.kind == 'above':
+        return f"🔔 {rule.symbol} rose to ₹{value:,.2f} (above ₹{rule.threshold:,.2f})"
+    if rule.kind == 'below':
+        return f"🔔 {rule.symbol} fell to ₹{value:,.2f} (below ₹{rule.threshold:,.2f})"
+    if rule.kind in MOVE_KINDS:
+        direction = 'up' if rule.kind == 'move_up' else 'down'
+        return f"🔔 {rule.symbol} is {direction} {rule.threshold:g}% at ₹{value:,.2f} (crossed ₹{level:,.2f})"
+    scope = f"Account {rule.account_id}" if rule.account_id is not None else "All accounts"
+    limit = 'above' if rule.kind == 'pnl_above' else 'below'
+    return f"🔔 {scope} gain/loss is ₹{value:,.2f} ({limit} ₹{rule.threshold:,.2f})"
+
+
+def describe_rule(rule):
+    """A short label for a rule, as listed in the Alerts window"""
+    labels = {'above': "above ₹{:,.2f}", 'below': "below ₹{:,.2f}", 'move_up': "up {:g}%",
+              'move_down': "down {:g}%", 'pnl_above': "gain/loss above ₹{:,.2f}", 'pnl_below': "gain/loss below ₹{:,.2f}"}
+    target = rule.symbol or (f"Account {rule.account_id}" if rule.account_id is not None else "All accounts")
+    text = f"{target} {labels[rule.kind].format(rule.threshold)}"
+    if rule.kind in MOVE_KINDS:
+        text += f" from ₹{rule.reference:,.2f}" if rule.reference is not None else " from previous close"
+    return text
+
+
+def main():
+    import argparse
+
+    import storage
+
+    parser = argparse.ArgumentParser(description="Manage price and P&L alerts")
+    parser.add_argument('--db', default=storage.DB_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help="add a rule")
+    add.add_argument('kind', choices=KINDS)
+    add.add_argument('threshold', type=float, help="price, percent move or P&L in ₹")
+    add.add_argument('--symbol')
+    add.add_argument('--account', type=int, help="account for P&L limits (default: all accounts)")
+    add.add_argument('--reference', type=float, help="price percent moves are measured from (default: previous close)")
+    add.add_argument('--note')
+    remove = sub.add_parser('remove', help="remove a rule")
+    remove.add_argument('rule_id', type=int)
+    sub.add_parser('list', help="list the rules")
+    log = sub.add_parser('log', help="show recent alerts")
+    log.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == 'log':
+        for alert in read_log(limit=args.limit):
+            print(f"{alert.triggered_at} {alert.message}")
+        return
+
+    conn = storage.connect(args.db)
+    try:
+        if args.command == 'add':
+            rule_id = add_rule(conn, args.kind, args.threshold, args.symbol, args.account, args.reference, args.note)
+            print(f"✅ Added alert {rule_id}")
+        elif args.command == 'remove':
+            print("✅ Removed" if delete_rule(conn, args.rule_id) else f"❌ No alert with id {args.rule_id}")
+        else:
+            for rule in list_rules(conn):
+                state = 'armed' if rule.armed else f"fired {rule.triggered_at}"
+                print(f"{rule.id:>6}  {describe_rule(rule):<50} {state}")
+    except ValueError as e:
+        print(f"❌ {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+Portfolio analytics for the Stock Portfolio Tracker
+
+PortfolioAnalytics lays the book out as date x symbol matrices (prices,
+positions) plus per-date vectors (portfolio value, external cash flows)
+and derives every statistic from them with NumPy. The matrices are kept
+between calls: add_lot() and update_prices() update them in place, and only
+the cheap per-date statistics are recomputed afterwards.
+
+Prices come from price_history (INR). A HistoryStore can fill in the days
+price_history is missing; its closes are in each symbol's quote currency,
+so pass fx_rates {symbol: rate into INR}, e.g. from history_rates();
+a symbol without a rate has no usable closes. price_history
+prices and lot quantities are put in today's share basis using the
+recorded splits and bonus issues, so a split doesn't show up as a crash in
+the price; HistoryStore closes only need the actions after they were
+fetched, Yahoo having applied the earlier ones.
+"""
+
+import numpy as np
+
+from corporate_actions import Adjustments
+
+TRADING_DAYS = 252
+BENCHMARK = '^NSEI'
+
+
+def forward_fill(prices):
+    """Carry each column's last known price over the gaps after it; leading gaps stay NaN"""
+    prices = np.array(prices, dtype=float)
+    if not prices.size:
+        return prices
+    rows = np.arange(len(prices))[:, None]
+    last_valid = np.maximum.accumulate(np.where(np.isnan(prices), 0, rows), axis=0)
+    return np.take_along_axis(prices, last_valid, axis=0)
+
+
+def fill_prices(prices, fallback=None):
+    """Forward-fill each column, then fill leading gaps with the first known price (or fallback[j])"""
+    filled = forward_fill(prices)
+    if not filled.size:
+        return filled
+    for j in np.flatnonzero(np.isnan(filled).any(axis=0)):
+        known = filled[~np.isnan(filled[:, j]), j]
+        if len(known):
+            filled[np.isnan(filled[:, j]), j] = known[0]
+        elif fallback is not None:
+            filled[:, j] = fallback[j]
+    return filled
+
+
+def load_prices(conn, symbols, store=None, fx_rates=None, start=None, end=None):
+    """Return (dates, matrix) of INR prices for symbols in today's share basis, NaN where unknown.
+
+    price_history wins over the HistoryStore where both have a day. Its
+    prices are as quoted on the day, so they are adjusted for the splits and
+    bonuses after it; HistoryStore closes are split-adjusted by Yahoo as of
+    the day they were fetched, so only the actions after that day are
+    applied to them. start and end (YYYY-MM-DD, inclusive) limit the dates
+    read.
+    """
+    fx_rates = fx_rates or {}
+    rows = []
+    if symbols:
+        placeholders = ','.join('?' * len(symbols))
+        sql = f"SELECT symbol, date, price FROM price_history WHERE symbol IN ({placeholders})"
+        args = list(symbols)
+        for clause, value in (("date >= ?", start), ("date <= ?", end)):
+            if value is not None:
+                sql += f" AND {clause}"
+                args.append(value)
+        rows = conn.execute(sql, args).fetchall()
+    dates = np.unique(np.array([row[1] for row in rows], dtype='datetime64[D]'))
+
+    adjustments = Adjustments.load(conn, symbols) if symbols else Adjustments()
+    store_dates = closes = None
+    if store is not None and symbols:
+        store_dates, closes = store.matrix(symbols, start, end)
+        dates = np.union1d(dates, store_dates)
+        if any(symbol in adjustments for symbol in symbols):
+            _, fetched = store.matrix(symbols, start, end, field='fetched')
+            for j, symbol in enumerate(symbols):
+                known = ~np.isnan(fetched[:, j])
+                if symbol in adjustments and known.any():
+                    days = fetched[known, j].astype(np.int64).astype('datetime64[D]')
+                    closes[known, j] /= adjustments.factors_for(symbol, days)
+
+    matrix = np.full((len(dates), len(symbols)), np.nan)
+    if store_dates is not None and len(store_dates):
+        rates = np.array([fx_rates.get(symbol, np.nan) for symbol in symbols])
+        matrix[np.searchsorted(dates, store_dates)] = closes * rates
+    if rows:
+        col = {symbol: j for j, symbol in enumerate(symbols)}
+        row_symbols, row_dates, row_prices = zip(*rows)
+        if adjustments:
+            row_prices = adjustments.adjust_prices(row_symbols, row_dates, row_prices)
+        matrix[np.searchsorted(dates, np.array(row_dates, dtype='datetime64[D]')),
+               np.array([col[symbol] for symbol in row_symbols])] = row_prices
+    return dates, matrix
+
+
+def load_lots(conn, account_id=None, portfolio_id=None):
+    """(symbol, quantity, price, date) trades of every lot (or one portfolio's or account's) by date, in today's share basis.
+
+    A sale doesn't rewrite the past: the shares it took from each lot are
+    counted as bought on the lot's purchase date, and the sale itself is a
+    trade of negative quantity at the sale price on its sale date.
+    """
+    if portfolio_id is not None:
+        where, args = "WHERE {}portfolio_id = ?", (portfolio_id,)
+    elif account_id is not None:
+        where, args = "WHERE {}account_id = ?", (account_id,)
+    else:
+        where, args = "", ()
+    # Each row carries the day whose share basis its quantity and price are in
+    rows = conn.execute(f"""
+        SELECT symbol, quantity, purchase_price, purchase_date, purchase_date FROM portfolio {where.format('')}
+        UNION ALL
+        SELECT s.symbol, m.quantity, m.purchase_price, m.purchase_date, s.sale_date
+        FROM lot_matches m JOIN sales s ON s.id = m.sale_id {where.format('s.')}
+        UNION ALL
+        SELECT symbol, -quantity, price, sale_date, sale_date FROM sales {where.format('')}
+        ORDER BY 4
+    """, args * 3 if args else ()).fetchall()
+    if not rows:
+        return []
+    symbols, quantities, prices, dates, basis = zip(*rows)
+    adjustments = Adjustments.load(conn, set(symbols))
+    if not adjustments:
+        return [row[:4] for row in rows]
+    factors = adjustments.column(symbols, basis)
+    return list(zip(symbols, (np.array(quantities) * factors).tolist(), (np.array(prices) / factors).tolist(), dates))
+
+
+def price_column_loader(conn, store=None, fx_rates=None):
+    """A column_loader for PortfolioAnalytics that reads a symbol's prices with load_prices() over conn"""
+    def column_loader(symbol, grid):
+        symbol_dates, column = load_prices(conn, [symbol], store, fx_rates)
+        out = np.full(len(grid), np.nan)
+        inside = np.isin(symbol_dates, grid)
+        out[np.searchsorted(grid, symbol_dates[inside])] = column[inside, 0]
+        return out
+    return column_loader
+
+
+def backfill_benchmark(store, provider, benchmark=BENCHMARK):
+    """Bring the benchmark index's bars in the HistoryStore up to date, so beta can be computed"""
+    return store.backfill([benchmark], provider).get(benchmark, 0)
+
+
+def history_rates(conn, fx, account_id=None, portfolio_id=None):
+    """{symbol: rate into INR} for the HistoryStore closes of the scope's symbols, looked up through fx (FxRates)"""
+    return fx.fetch_symbol_rates(sorted({lot[0] for lot in load_lots(conn, account_id, portfolio_id)}))
+
+
+class PortfolioAnalytics:
+    def __init__(self, lots, dates, symbols, prices, benchmark=None, column_loader=None):
+        """Build the analytics state.
+
+        lots are (symbol, quantity, price, YYYY-MM-DD date) trades, sales
+        with a negative quantity, as load_lots() returns them; prices is a
+        len(dates) x len(symbols) matrix with NaN where unknown; benchmark is
+        an optional price vector aligned with dates. column_loader(symbol,
+        dates) returns a price column for a symbol first seen in add_lot().
+        """
+        lots = list(lots)
+        self.column_loader = column_loader
+        lot_dates = np.array([lot[3] for lot in lots], dtype='datetime64[D]')
+        self.dates = np.union1d(np.asarray(dates, dtype='datetime64[D]'), lot_dates)
+        self.symbols = list(symbols)
+        for symbol, _, _, _ in lots:
+            if symbol not in self.symbols:
+                self.symbols.append(symbol)
+        self.col = {symbol: j for j, symbol in enumerate(self.symbols)}
+
+        # Re-align the given prices onto the full date grid
+        raw = np.full((len(self.dates), len(self.symbols)), np.nan)
+        given = np.asarray(prices, dtype=float)
+        if given.size:
+            given = given.reshape(len(dates), -1)
+            raw[np.searchsorted(self.dates, np.asarray(dates, dtype='datetime64[D]')), :given.shape[1]] = given
+        self.benchmark = None
+        if benchmark is not None:
+            bench = np.full(len(self.dates), np.nan)
+            bench[np.searchsorted(self.dates, np.asarray(dates, dtype='datetime64[D]'))] = benchmark
+            self.benchmark = fill_prices(bench[:, None])[:, 0]
+
+        rows = np.searchsorted(self.dates, lot_dates)
+        cols = np.array([self.col[lot[0]] for lot in lots], dtype=np.intp)
+        quantities = np.array([lot[1] for lot in lots], dtype=float)
+        costs = quantities * np.array([lot[2] for lot in lots], dtype=float)
+
+        # Symbols with no recorded prices at all are valued at their average cost
+        bought = quantities > 0
+        cost_by_symbol = np.bincount(cols[bought], weights=costs[bought], minlength=len(self.symbols))
+        quantity_by_symbol = np.bincount(cols[bought], weights=quantities[bought], minlength=len(self.symbols))
+        average_cost = np.divide(cost_by_symbol, quantity_by_symbol,
+                                 out=np.zeros(len(self.symbols)), where=quantity_by_symbol > 0)
+        self.prices = fill_prices(raw, fallback=average_cost)
+
+        trades = np.zeros((len(self.dates), len(self.symbols)))
+        np.add.at(trades, (rows, cols), quantities)
+        self.positions = np.cumsum(trades, axis=0)
+        self.flows = np.bincount(rows, weights=costs, minlength=len(self.dates)).astype(float)
+        self.values = (self.positions * self.prices).sum(axis=1)
+        self.cache = {}
+
+    @classmethod
+    def from_db(cls, conn, store=None, benchmark=BENCHMARK, fx_rates=None, account_id=None, portfolio_id=None):
+        """Load lots (of one portfolio or account, or all) and prices from price_history, filling gaps from a HistoryStore"""
+        lots = load_lots(conn, account_id, portfolio_id)
+        symbols = sorted({lot[0] for lot in lots})
+        dates, prices = load_prices(conn, symbols, store, fx_rates)
+
+        bench = None
+        if store is not None and benchmark:
+            bench_dates, bench_prices = store.window(benchmark)
+            if len(bench_dates):
+                grid = np.union1d(dates, bench_dates)
+                aligned = np.full((len(grid), len(symbols)), np.nan)
+                aligned[np.searchsorted(grid, dates)] = prices
+                bench = np.full(len(grid), np.nan)
+                bench[np.searchsorted(grid, bench_dates)] = bench_prices
+                dates, prices = grid, aligned
+
+        return cls(lots, dates, symbols, prices, benchmark=bench,
+                   column_loader=price_column_loader(conn, store, fx_rates))
+
+    # Incremental updates
+
+    def add_lot(self, symbol, quantity, price, date):
+        """Record a new lot without rebuilding the matrices"""
+        date = np.datetime64(date, 'D')
+        if not len(self.dates) or date > self.dates[-1]:
+            self.append_day(date, {})
+        i = int(np.searchsorted(self.dates, date))
+        if i == len(self.dates) or self.dates[i] != date:
+            self.insert_day(i, date)
+
+        j = self.col.get(symbol)
+        if j is None:
+            column = self.column_loader(symbol, self.dates) if self.column_loader else np.full(len(self.dates), np.nan)
+            column = fill_prices(column[:, None], fallback=[price])[:, 0]
+            j = len(self.symbols)
+            self.symbols.append(symbol)
+            self.col[symbol] = j
+            self.prices = np.column_stack((self.prices, column))
+            self.positions = np.column_stack((self.positions, np.zeros(len(self.dates))))
+
+        self.positions[i:, j] += quantity
+        self.values[i:] += quantity * self.prices[i:, j]
+        self.flows[i] += quantity * price
+        self.cache.clear()
+
+    def append_day(self, date, prices, benchmark_price=None):
+        """Add a trading day; symbols missing from prices carry their last price forward"""
+        date = np.datetime64(date, 'D')
+        if len(self.dates) and date <= self.dates[-1]:
+            raise ValueError(f"{date} is not after the last day {self.dates[-1]}")
+        row = self.prices[-1].copy() if len(self.dates) else np.zeros(len(self.symbols))
+        for symbol, price in prices.items():
+            j = self.col.get(symbol)
+            if j is not None and price is not None:
+                row[j] = price
+        position = self.positions[-1] if len(self.dates) else np.zeros(len(self.symbols))
+
+        self.dates = np.append(self.dates, date)
+        self.prices = np.vstack((self.prices, row))
+        self.positions = np.vstack((self.positions, position))
+        self.flows = np.append(self.flows, 0.0)
+        self.values = np.append(self.values, float(position @ row))
+        if self.benchmark is not None:
+            self.benchmark = np.append(self.benchmark, self.benchmark[-1] if benchmark_price is None else benchmark_price)
+        self.cache.clear()
+
+    def update_prices(self, date, prices, benchmark_price=None):
+        """Apply one day's {symbol: price}: a new day is appended, the last day's prices are replaced in place"""
+        date = np.datetime64(date, 'D')
+        if not len(self.dates) or date > self.dates[-1]:
+            self.append_day(date, prices, benchmark_price)
+            return
+        if date != self.dates[-1]:
+            raise ValueError(f"{date} is before the last day {self.dates[-1]}")
+        for symbol, price in prices.items():
+            j = self.col.get(symbol)
+            if j is not None and price is not None:
+                self.prices[-1, j] = price
+        self.values[-1] = float(self.positions[-1] @ self.prices[-1])
+        if self.benchmark is not None and benchmark_price is not None:
+            self.benchmark[-1] = benchmark_price
+        self.cache.clear()
+
+    def insert_day(self, i, date):
+        """Insert a day inside the grid, copying the previous day's prices and positions"""
+        src = max(i - 1, 0)
+        self.dates = np.insert(self.dates, i, date)
+        self.prices = np.insert(self.prices, i, self.prices[src], axis=0)
+        self.positions = np.insert(self.positions, i, self.positions[src] if i else 0, axis=0)
+        self.flows = np.insert(self.flows, i, 0.0)
+        self.values = np.insert(self.values, i, self.values[src] if i else 0.0)
+        if self.benchmark is not None:
+            self.benchmark = np.insert(self.benchmark, i, self.benchmark[src])
+
+    # Statistics
+
+    def cached(self, key, compute):
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    def daily_returns(self):
+        """Time-weighted daily returns, net of that day's purchases and sales; 0 where nothing was held"""
+        def compute():
+            returns = np.zeros(len(self.values))
+            previous = self.values[:-1]
+            held = previous > 0
+            returns[1:][held] = (self.values[1:][held] - self.flows[1:][held]) / previous[held] - 1
+            return returns
+        return self.cached('returns', compute)
+
+    def time_weighted_return(self):
+        return float(np.prod(1 + self.daily_returns()) - 1)
+
+    def xirr(self):
+        """Money-weighted annual return of purchases and sale proceeds against today's value, or None if undefined"""
+        def compute():
+            traded = np.flatnonzero(self.flows)
+            if not len(traded) or (self.values[-1] <= 0 and not (self.flows < 0).any()):
+                return None
+            amounts = np.append(-self.flows[traded], self.values[-1])
+            days = np.append(self.dates[traded], self.dates[-1]).astype(np.int64)
+            years = (days - days[0]) / 365.0
+            if years[-1] <= 0:
+                return None
+
+            def npv(rate):
+                return float((amounts * (1 + rate) ** -years).sum())
+
+            rate = 0.1
+            for _ in range(50):
+                discount = (1 + rate) ** -years
+                slope = float((-years * amounts * discount / (1 + rate)).sum())
+                if slope == 0:
+                    break
+                step = float((amounts * discount).sum()) / slope
+                rate = max(rate - step, -0.9999)
+                if abs(step) < 1e-10:
+                    return rate
+
+            low, high = -0.9999, 100.0
+            if npv(low) * npv(high) > 0:
+                return None
+            for _ in range(200):
+                mid = (low + high) / 2
+                if npv(low) * npv(mid) <= 0:
+                    high = mid
+                else:
+                    low = mid
+            return (low + high) / 2
+        return self.cached('xirr', compute)
+
+    def rolling_volatility(self, window=21):
+        """Annualized volatility of daily returns over a trailing window, aligned with dates[window:]"""
+        def compute():
+            returns = self.daily_returns()[1:]
+            if len(returns) < window:
+                return np.empty(0)
+            sums = np.concatenate(([0.0], np.cumsum(returns)))
+            squares = np.concatenate(([0.0], np.cumsum(returns ** 2)))
+            total = sums[window:] - sums[:-window]
+            variance = (squares[window:] - squares[:-window] - total ** 2 / window) / (window - 1)
+            return np.sqrt(np.maximum(variance, 0) * TRADING_DAYS)
+        return self.cached(('volatility', window), compute)
+
+    def max_drawdown(self):
+        def compute():
+            wealth = np.cumprod(1 + self.daily_returns())
+            return float((wealth / np.maximum.accumulate(wealth) - 1).min()) if len(wealth) else 0.0
+        return self.cached('drawdown', compute)
+
+    def beta(self):
+        """Beta of daily returns against the benchmark index, or None without one"""
+        def compute():
+            if self.benchmark is None or len(self.dates) < 3:
+                return None
+            index_returns = np.diff(self.benchmark) / self.benchmark[:-1]
+            returns = self.daily_returns()[1:]
+            usable = (self.values[:-1] > 0) & np.isfinite(index_returns)
+            if usable.sum() < 2:
+                return None
+            variance = np.var(index_returns[usable], ddof=1)
+            if variance == 0:
+                return None
+            return float(np.cov(returns[usable], index_returns[usable])[0, 1] / variance)
+        return self.cached('beta', compute)
+
+    def contributions(self):
+        """{symbol: (gain/loss, contribution to the summed daily return)} over the whole period"""
+        def compute():
+            pnl = self.positions[:-1] * np.diff(self.prices, axis=0)
+            previous = self.values[:-1]
+            weights = np.divide(1.0, previous, out=np.zeros_like(previous), where=previous > 0)
+            contribution = (pnl * weights[:, None]).sum(axis=0)
+            return {symbol: (float(pnl[:, j].sum()), float(contribution[j])) for symbol, j in self.col.items()}
+        return self.cached('contributions', compute)
+
+    def summary(self):
+        volatility = self.rolling_volatility(min(63, max(len(self.dates) - 1, 2)))
+        return {
+            'start': str(self.dates[0]) if len(self.dates) else None,
+            'end': str(self.dates[-1]) if len(self.dates) else None,
+            'value': float(self.values[-1]) if len(self.values) else 0.0,
+            'invested': float(self.flows[self.flows > 0].sum()),
+            'time_weighted_return': self.time_weighted_return(),
+            'xirr': self.xirr(),
+            'volatility': float(volatility[-1]) if len(volatility) else None,
+            'max_drawdown': self.max_drawdown(),
+            'beta': self.beta(),
+        }
+
+
+def format_summary(summary):
+    def pct(value):
+        return "n/a" if value is None else f"{value * 100:.2f}%"
+
+    beta = "n/a" if summary['beta'] is None else f"{summary['beta']:.2f}"
+    return "\n".join([
+        f"Period: {summary['start']} to {summary['end']}",
+        f"Value: ₹{summary['value']:.2f} (invested ₹{summary['invested']:.2f})",
+        f"Time-weighted return: {pct(summary['time_weighted_return'])}",
+        f"XIRR: {pct(summary['xirr'])}",
+        f"Volatility (annualized): {pct(summary['volatility'])}",
+        f"Max drawdown: {pct(summary['max_drawdown'])}",
+        f"Beta vs {BENCHMARK}: {beta}",
+    ])
+
+
+def main():
+    import argparse
+
+    import storage
+    from fx import FxRates
+    from history_store import HistoryStore, HISTORY_DIR
+    from quotes import YFinanceProvider
+
+    parser = argparse.ArgumentParser(description="Portfolio performance analytics")
+    parser.add_argument('--db', default=storage.DB_PATH)
+    parser.add_argument('--history', default=HISTORY_DIR)
+    parser.add_argument('--account', type=int)
+    parser.add_argument('--portfolio', type=int)
+    args = parser.parse_args()
+
+    provider = YFinanceProvider()
+    store = HistoryStore(args.history)
+    backfill_benchmark(store, provider)
+    conn = storage.connect(args.db)
+    fx_rates = history_rates(conn, FxRates(provider), args.account, args.portfolio)
+    analytics = PortfolioAnalytics.from_db(conn, store, fx_rates=fx_rates,
+                                           account_id=args.account, portfolio_id=args.portfolio)
+    conn.close()
+    if not len(analytics.dates):
+        print("No portfolio history yet")
+        return
+    print(format_summary(analytics.summary()))
+    print("\nContribution by holding:")
+    for symbol, (pnl, contribution) in sorted(analytics.contributions().items(), key=lambda item: -item[1][1]):
+        print(f"  {symbol:<15} ₹{pnl:>12.2f}  {contribution * 100:>7.2f}%")
+
+
+if __name__ == "__main__":
+    main()
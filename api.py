@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+Local JSON API for the Stock Portfolio Tracker
+
+Serves accounts, holdings, lots, valuations and price history over HTTP so
+dashboards and scripts don't have to open portfolio.db themselves. Every
+GET response carries an ETag that changes whenever anything commits to the
+database, so pollers sending If-None-Match get a 304 without a query being
+run. Lots and history are paginated with an opaque cursor; history can
+also be streamed in full as JSON lines, and is adjusted for splits and
+bonus issues unless ?adjusted=0 is given. Lots are added through the same
+validation as the Add Stock form, and sales are matched against open lots
+as the Sell button does.
+
+Each request uses its own connection, and readers never take a write lock
+(the database is in WAL mode), so polling never holds up the app or the
+recorder writing prices.
+"""
+
+import base64
+import json
+import math
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import ledger
+import metrics
+import storage
+from corporate_actions import Adjustments, dividend_income
+from engine import PortfolioEngine, value_accounts
+from importer import parse_date
+from lots import parse_lot
+
+HOST = '127.0.0.1'
+PORT = 8765
+PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+STREAM_CHUNK = 5000
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def clean(value):
+    """NaN (an unknown price) is sent as null"""
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ApiError(400, "Invalid cursor")
+
+
+class PortfolioApi:
+    """The endpoints, independent of HTTP: each takes a connection and query parameters and returns a JSON-ready dict"""
+
+    def __init__(self, db_path=storage.DB_PATH):
+        self.db_path = db_path
+        self.boot = os.urandom(4).hex()  # ETags from an earlier run never match
+        self.lock = threading.Lock()
+        storage.connect(db_path).close()  # create or migrate the schema before serving
+        # PRAGMA data_version changes on this connection whenever any other connection commits
+        self.watcher = sqlite3.connect(db_path, check_same_thread=False)
+        self.data_version = None
+        self.generation = 0
+
+    def etag(self):
+        with self.lock:
+            version = self.watcher.execute("PRAGMA data_version").fetchone()[0]
+            if version != self.data_version:
+                self.data_version = version
+                self.generation += 1
+            return f'"{self.boot}-{self.generation}"'
+
+    def connect(self, readonly=True):
+        conn = storage.connect(self.db_path)
+        if readonly:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def close(self):
+        with self.lock:
+            self.watcher.close()
+
+    # Reads
+
+    def accounts(self, conn, params):
+        portfolios = storage.list_portfolios(conn)
+        return {'accounts': [
+            {'id': account_id, 'name': name,
+             'portfolios': [{'id': pid, 'name': title} for pid, owner, title in portfolios if owner == account_id]}
+            for account_id, name in storage.list_accounts(conn)
+        ]}
+
+    def priced_engine(self, conn, params):
+        """An engine loaded with the requested scope, valued at each symbol's last recorded price"""
+        engine = PortfolioEngine()
+        engine.load(storage.load_holdings(conn, int_param(params, 'account'), int_param(params, 'portfolio')))
+        latest = storage.latest_prices(conn, engine.symbols.tolist())
+        engine.set_prices({symbol: price for symbol, (price, _) in latest.items()})
+        return engine, latest
+
+    def holdings(self, conn, params):
+        engine, latest = self.priced_engine(conn, params)
+        v = engine.valuation()
+        columns = (v.symbols, v.quantities, v.avg_costs, v.prices, v.cost, v.value, v.gain_loss, v.weights)
+        names = ('symbol', 'quantity', 'avg_cost', 'price', 'cost', 'value', 'gain_loss', 'weight')
+        return {
+            'holdings': [dict(zip(names, map(clean, row)), price_date=latest.get(row[0], (None, None))[1])
+                         for row in zip(*(column.tolist() for column in columns))],
+        }
+
+    def valuation(self, conn, params):
+        engine, latest = self.priced_engine(conn, params)
+        v = engine.valuation()
+        result = {
+            'positions': len(engine),
+            'priced': len(latest),
+            'total_cost': v.total_cost,
+            'total_value': v.total_value,
+            'total_gain_loss': v.total_gain_loss,
+            'priced_at': max((day for _, day in latest.values()), default=None),
+        }
+        if int_param(params, 'account') is None and int_param(params, 'portfolio') is None:
+            positions = storage.load_account_holdings(conn)
+            prices = {symbol: price for symbol, (price, _) in latest.items()}
+            result['accounts'] = [t._asdict() for t in value_accounts(positions, prices)]
+        return result
+
+    def lots(self, conn, params):
+        """Lots by id, optionally scoped and filtered by symbol; paginated with ?limit= and ?cursor="""
+        where, args = [], []
+        for column, name in (('account_id', 'account'), ('portfolio_id', 'portfolio')):
+            value = int_param(params, name)
+            if value is not None:
+                where.append(f"{column} = ?")
+                args.append(value)
+        symbol = param(params, 'symbol')
+        if symbol:
+            where.append("symbol = ?")
+            args.append(symbol)
+        cursor = param(params, 'cursor')
+        if cursor:
+            after = decode_cursor(cursor)
+            if not isinstance(after, int):
+                raise ApiError(400, "Invalid cursor")
+            where.append("id > ?")
+            args.append(after)
+        limit = page_size(params)
+        rows = conn.execute(f"""
+            SELECT id, account_id, portfolio_id, symbol, quantity, purchase_price, purchase_date, import_key
+            FROM portfolio {'WHERE ' + ' AND '.join(where) if where else ''}
+            ORDER BY id LIMIT ?
+        """, args + [limit + 1]).fetchall()
+        names = ('id', 'account_id', 'portfolio_id', 'symbol', 'quantity', 'price', 'date', 'import_key')
+        return {
+            'lots': [dict(zip(names, row)) for row in rows[:limit]],
+            'next': encode_cursor(rows[limit - 1][0]) if len(rows) > limit else None,
+        }
+
+    def history_query(self, params):
+        """SQL and arguments for price_history rows matching ?symbol=&start=&end=, after ?cursor="""
+        where, args = [], []
+        symbols = [s for value in params.get('symbol', []) for s in value.split(',') if s]
+        if symbols:
+            where.append(f"symbol IN ({','.join('?' * len(symbols))})")
+            args.extend(symbols)
+        for name, op in (('start', '>='), ('end', '<=')):
+            value = param(params, name)
+            if value:
+                where.append(f"date {op} ?")
+                args.append(value)
+        cursor = param(params, 'cursor')
+        if cursor:
+            after = decode_cursor(cursor)
+            if not (isinstance(after, list) and len(after) == 2 and all(isinstance(v, str) for v in after)):
+                raise ApiError(400, "Invalid cursor")
+            where.append("(symbol, date) > (?, ?)")
+            args.extend(after)
+        sql = f"""
+            SELECT symbol, date, price FROM price_history {'WHERE ' + ' AND '.join(where) if where else ''}
+            ORDER BY symbol, date
+        """
+        return sql, args
+
+    def adjuster(self, conn, params):
+        """A function putting a page of (symbol, date, price) rows in today's share basis, unless ?adjusted=0"""
+        adjustments = Adjustments.load(conn)
+        if not adjustments or param(params, 'adjusted') in ('0', 'false', 'no'):
+            return lambda rows: rows
+        def adjust(rows):
+            if not rows:
+                return rows
+            symbols, days, prices = zip(*rows)
+            return list(zip(symbols, days, adjustments.adjust_prices(symbols, days, prices).tolist()))
+        return adjust
+
+    def history(self, conn, params):
+        sql, args = self.history_query(params)
+        limit = page_size(params)
+        rows = conn.execute(sql + " LIMIT ?", args + [limit + 1]).fetchall()
+        adjust = self.adjuster(conn, params)
+        return {
+            'history': [{'symbol': symbol, 'date': day, 'price': price}
+                        for symbol, day, price in adjust(rows[:limit])],
+            'next': encode_cursor(list(rows[limit - 1][:2])) if len(rows) > limit else None,
+        }
+
+    def history_stream(self, conn, params):
+        """Yield every matching price_history row as a JSON line, STREAM_CHUNK rows at a time"""
+        sql, args = self.history_query(params)
+        encode = json.JSONEncoder().encode
+        adjust = self.adjuster(conn, params)
+        cursor = conn.execute(sql, args)
+        while True:
+            rows = cursor.fetchmany(STREAM_CHUNK)
+            if not rows:
+                return
+            yield ''.join(encode({'symbol': symbol, 'date': day, 'price': price}) + '\n'
+                          for symbol, day, price in adjust(rows)).encode()
+
+    def pnl(self, conn, params):
+        """Realized P&L and dividends (optionally between ?start= and ?end=), and unrealized P&L at the last recorded prices"""
+        account_id, portfolio_id = int_param(params, 'account'), int_param(params, 'portfolio')
+        book = ledger.LotBook()
+        queues = book.load(conn, account_id, portfolio_id)
+        latest = storage.latest_prices(conn, {symbol for _, symbol in queues})
+        unrealized = book.unrealized(queues, {symbol: price for symbol, (price, _) in latest.items()},
+                                     adjustments=Adjustments.load(conn))
+        start, end = param(params, 'start'), param(params, 'end')
+        return {
+            'realized': [r._asdict() for r in ledger.realized(conn, account_id, portfolio_id, start, end)],
+            'unrealized': [u._asdict() for u in unrealized],
+            'dividends': [d._asdict() for d in dividend_income(conn, account_id, portfolio_id, start, end)],
+        }
+
+    # Writes
+
+    def add_lot(self, conn, body):
+        """Validate a lot like the Add Stock form and insert it; returns the new lot"""
+        if not isinstance(body, dict):
+            raise ApiError(400, "Expected a JSON object")
+        try:
+            symbol, quantity, price = parse_lot(body.get('symbol', ''), body.get('quantity', ''), body.get('price', ''))
+            purchase_date = parse_date(str(body['date'])) if body.get('date') else datetime.now().strftime('%Y-%m-%d')
+            portfolio_id = int(body.get('portfolio', storage.DEFAULT_PORTFOLIO))
+            with conn:
+                lot_id = storage.insert_lot(conn, symbol, quantity, price, purchase_date, portfolio_id)
+        except (TypeError, ValueError) as e:
+            raise ApiError(400, str(e))
+        return {'id': lot_id, 'portfolio_id': portfolio_id, 'symbol': symbol, 'quantity': quantity, 'price': price,
+                'date': purchase_date}
+
+    def add_sale(self, conn, body):
+        """Record a sale, matched FIFO or against body['lots'] in order; returns it with its lot matches"""
+        if not isinstance(body, dict):
+            raise ApiError(400, "Expected a JSON object")
+        try:
+            symbol, quantity, price = ledger.parse_sale(body.get('symbol', ''), body.get('quantity', ''),
+                                                        body.get('price', ''))
+            sale_date = parse_date(str(body['date'])) if body.get('date') else datetime.now().strftime('%Y-%m-%d')
+            portfolio_id = int(body.get('portfolio', storage.DEFAULT_PORTFOLIO))
+            lot_ids = [int(lot_id) for lot_id in body.get('lots') or ()]
+            sale = ledger.LotBook().sell(conn, symbol, quantity, price, sale_date, portfolio_id, lot_ids)
+        except (TypeError, ValueError) as e:
+            raise ApiError(400, str(e))
+        result = sale._asdict()
+        result['matches'] = [m._asdict() for m in sale.matches]
+        return result
+
+    def remove_lot(self, conn, lot_id):
+        with conn:
+            deleted = conn.execute("DELETE FROM portfolio WHERE id = ?", (lot_id,)).rowcount
+        if not deleted:
+            raise ApiError(404, f"No lot with id {lot_id}")
+        return {'deleted': lot_id}
+
+
+def param(params, name):
+    values = params.get(name)
+    return values[-1] if values else None
+
+
+def int_param(params, name):
+    value = param(params, name)
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer")
+
+
+def page_size(params):
+    limit = int_param(params, 'limit')
+    return PAGE_SIZE if limit is None else max(1, min(limit, MAX_PAGE_SIZE))
+
+
+READS = {
+    '/accounts': PortfolioApi.accounts,
+    '/holdings': PortfolioApi.holdings,
+    '/valuation': PortfolioApi.valuation,
+    '/lots': PortfolioApi.lots,
+    '/history': PortfolioApi.history,
+    '/pnl': PortfolioApi.pnl,
+}
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'PortfolioTracker'
+
+    @property
+    def api(self):
+        return self.server.api
+
+    def log_message(self, format, *args):
+        pass  # requests are counted in metrics rather than written to stderr
+
+    def send_json(self, status, payload, headers=()):
+        body = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self, method, handler):
+        path = urlsplit(self.path).path.rstrip('/') or '/'
+        with metrics.span('api', method=method):
+            try:
+                status = handler(path, parse_qs(urlsplit(self.path).query))
+            except ApiError as e:
+                status = e.status
+                self.send_json(e.status, {'error': str(e)})
+            except sqlite3.Error as e:
+                status = 503 if 'locked' in str(e) else 500
+                metrics.log('error', 'api', f"API database error: {e}", path=path)
+                self.send_json(status, {'error': str(e)})
+            except (BrokenPipeError, ConnectionResetError):
+                status = 499  # the client went away mid-response
+                self.close_connection = True
+        metrics.count('api_requests_total', method=method, status=status)
+
+    def do_GET(self):
+        self.handle_request('GET', self.get)
+
+    def do_POST(self):
+        self.handle_request('POST', self.post)
+
+    def do_DELETE(self):
+        self.handle_request('DELETE', self.delete)
+
+    def get(self, path, params):
+        endpoint = READS.get(path)
+        if endpoint is None:
+            raise ApiError(404, f"Unknown endpoint {path}; try {', '.join(READS)}")
+
+        etag = self.api.etag()
+        headers = [('ETag', etag), ('Cache-Control', 'no-cache')]
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            return 304
+
+        conn = self.api.connect()
+        try:
+            if path == '/history' and param(params, 'format') == 'ndjson':
+                self.stream(self.api.history_stream(conn, params), headers)
+            else:
+                self.send_json(200, endpoint(self.api, conn, params), headers)
+        finally:
+            conn.close()
+        return 200
+
+    def stream(self, chunks, headers):
+        """Send chunks with chunked transfer encoding, so large responses are never built in memory"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def read_json(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            raise ApiError(400, "Invalid Content-Length")
+        if length < 0:
+            raise ApiError(400, "Invalid Content-Length")
+        try:
+            return json.loads(self.rfile.read(length) or b'null')
+        except ValueError:
+            raise ApiError(400, "Body is not valid JSON")
+
+    def post(self, path, params):
+        if path not in ('/lots', '/sales'):
+            raise ApiError(404 if path not in READS else 405, f"Cannot POST to {path}")
+        body = self.read_json()
+        conn = self.api.connect(readonly=False)
+        try:
+            if path == '/sales':
+                self.send_json(201, self.api.add_sale(conn, body))
+                return 201
+            lot = self.api.add_lot(conn, body)
+        finally:
+            conn.close()
+        self.send_json(201, lot, [('Location', f"/lots/{lot['id']}")])
+        return 201
+
+    def delete(self, path, params):
+        parts = path.split('/')
+        if len(parts) != 3 or parts[1] != 'lots' or not parts[2].isdigit():
+            raise ApiError(404, "DELETE takes /lots/<id>")
+        conn = self.api.connect(readonly=False)
+        try:
+            result = self.api.remove_lot(conn, int(parts[2]))
+        finally:
+            conn.close()
+        self.send_json(200, result)
+        return 200
+
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, db_path=storage.DB_PATH, host=HOST, port=PORT):
+        self.api = PortfolioApi(db_path)
+        super().__init__((host, port), ApiHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.api.close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the portfolio as a local JSON API")
+    parser.add_argument('--db', default=storage.DB_PATH)
+    parser.add_argument('--host', default=HOST, help="address to listen on (keep it local: there is no authentication)")
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+
+    server = ApiServer(args.db, args.host, args.port)
+    print(f"🌐 Serving {args.db} on http://{args.host}:{server.server_address[1]} "
+          f"({', '.join(READS)}); Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("👋 Stopped")
+
+
+if __name__ == "__main__":
+    main()
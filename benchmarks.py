@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the Stock Portfolio Tracker
+
+Times the app's hot paths on generated portfolios of several sizes: loading
+and drawing the portfolio, a full price refresh against the offline stub
+provider, price_history writes, Add Stock inserts, loading the symbol list
+and exporting holdings. Results are written as JSON; given a saved baseline,
+any case whose median time grew by more than the threshold is reported as a
+regression and the run exits non-zero.
+"""
+
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import storage
+
+DEFAULT_SIZES = (1000, 10000, 100000)  # lots in the generated portfolio
+REPEAT = 5
+THRESHOLD = 0.25  # a median this much slower than the baseline is a regression
+MIN_DELTA = 0.002  # seconds; smaller slowdowns are treated as noise
+ADD_STOCK_INSERTS = 200  # lots added one commit at a time per run
+VISIBLE_ROWS = 15  # the Treeview's height, drawn when the list is virtualized
+RESULTS_VERSION = 1
+
+Fixture = namedtuple('Fixture', ['workdir', 'db_path', 'size', 'symbols'])
+Regression = namedtuple('Regression', ['case', 'size', 'baseline', 'current', 'change'])
+
+
+def symbol_count(size):
+    """Distinct symbols in a generated portfolio of size lots"""
+    return min(size, max(100, size // 10))
+
+
+def headless_render(valuation):
+    """Format and diff the rows the Treeview would draw for valuation, without Tk"""
+    from portfolio_tracker import format_row
+    from tree_view import VIRTUAL_THRESHOLD, diff_rows
+
+    keys = valuation.symbols.tolist()
+    stop = len(keys) if len(keys) <= VIRTUAL_THRESHOLD else VISIBLE_ROWS
+    rows = [format_row(valuation, i) for i in range(stop)]
+    return diff_rows({}, keys[:stop], rows)
+
+
+def case_load(fixture):
+    """refresh_portfolio: read holdings, apply cached prices and draw"""
+    from engine import PortfolioEngine
+    from fx import FxRates
+    from portfolio_tracker import QUOTE_TTL, cached_prices
+    from quote_cache import QuoteCache
+    from quotes import StubProvider
+
+    provider = StubProvider()
+    cache = QuoteCache(provider, ttl=QUOTE_TTL)
+    conn = storage.connect(fixture.db_path)
+    engine = PortfolioEngine()
+    engine.load(storage.load_holdings(conn))
+    symbols = engine.symbols.tolist()
+    cache.store(provider.get_quotes(symbols))
+    fx = FxRates(provider)
+
+    def run():
+        engine.load(storage.load_holdings(conn))
+        engine.set_prices(cached_prices(engine.symbols.tolist(), cache, fx))
+        headless_render(engine.valuation())
+
+    return run, len(symbols), conn.close
+
+
+def case_refresh(fixture):
+    """refresh_job: price every holding through a cold quote cache on the refresh thread, chunk by chunk"""
+    import threading
+
+    from engine import PortfolioEngine
+    from fx import FxRates
+    from portfolio_tracker import QUOTE_TTL, fetch_chunks
+    from quote_cache import QuoteCache
+    from quotes import StubProvider
+    from workers import RefreshController
+
+    conn = storage.connect(fixture.db_path)
+    engine = PortfolioEngine()
+    engine.load(storage.load_holdings(conn))
+    conn.close()
+    provider = StubProvider()
+    fx = FxRates(provider)
+    symbols = engine.symbols.tolist()
+
+    def run():
+        cache = QuoteCache(provider, ttl=QUOTE_TTL)
+        done = threading.Event()
+        errors = []
+
+        def job(cancelled):
+            try:
+                for prices in fetch_chunks(symbols, cache, fx, cancelled):
+                    engine.set_prices(prices)
+                headless_render(engine.valuation())
+            except Exception as e:
+                errors.append(e)
+            finally:
+                done.set()
+
+        RefreshController(job).request()
+        done.wait()
+        if errors:
+            raise errors[0]
+
+    return run, len(symbols), None
+
+
+def case_history(fixture):
+    """save_price_history: upsert size price_history rows, one day per pass over the symbols"""
+    from loadgen import base_price
+
+    conn = storage.connect(fixture.db_path)
+    symbols = [symbol for symbol, _, _ in storage.load_holdings(conn)]
+    prices = [base_price(symbol) for symbol in symbols]
+    days = -(-fixture.size // len(symbols))
+    first = [date(2000, 1, 3)]
+
+    def run():
+        rows = ((symbol, price, (first[0] + timedelta(days=day)).isoformat())
+                for day in range(days) for symbol, price in zip(symbols, prices))
+        storage.save_prices(conn, rows)
+        first[0] += timedelta(days=days)  # later runs insert new rows rather than update these
+
+    return run, days * len(symbols), conn.close
+
+
+def case_add_stock(fixture):
+    """add_stock: validate and insert one lot per commit"""
+    from lots import parse_lot
+
+    conn = storage.connect(fixture.db_path)
+    symbols = [symbol for symbol, _, _ in storage.load_holdings(conn)]
+    today = datetime.now().strftime('%Y-%m-%d')
+
+    def run():
+        for i in range(ADD_STOCK_INSERTS):
+            symbol, quantity, price = parse_lot(symbols[i % len(symbols)], str(1 + i % 50), '123.45')
+            storage.insert_lot(conn, symbol, quantity, price, today)
+            conn.commit()
+
+    return run, ADD_STOCK_INSERTS, conn.close
+
+
+def write_symbol_list(fixture):
+    """Write an exchange symbol list with as many entries as the portfolio has symbols"""
+    import csv
+
+    from loadgen import synthetic_symbols
+    from symbols import load_symbols
+
+    names = dict(load_symbols())
+    path = os.path.join(fixture.workdir, 'symbols.csv')
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Symbol', 'Name'])
+        for i, symbol in enumerate(synthetic_symbols(fixture.symbols)):
+            writer.writerow([symbol, names.get(symbol) or f"Synthetic Industries {i} Limited"])
+    return path
+
+
+def case_symbols(fixture):
+    """Build the symbol search index from the CSV, as on first start"""
+    from symbol_index import SymbolIndex
+
+    path = write_symbol_list(fixture)
+    cache_path = path + '.idx'
+
+    def run():
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        SymbolIndex.load(path, cache_path)
+
+    return run, fixture.symbols, None
+
+
+def case_symbols_cached(fixture):
+    """Load the symbol search index from its cache, as on every later start"""
+    from symbol_index import SymbolIndex
+
+    path = write_symbol_list(fixture)
+    cache_path = path + '.idx'
+    SymbolIndex.load(path, cache_path)
+
+    def run():
+        SymbolIndex.load(path, cache_path)
+
+    return run, fixture.symbols, None
+
+
+def case_export(fixture):
+    """export_data: write the priced holdings to CSV"""
+    import exporter
+    from engine import PortfolioEngine
+    from quotes import StubProvider
+
+    conn = storage.connect(fixture.db_path)
+    engine = PortfolioEngine()
+    engine.load(storage.load_holdings(conn))
+    conn.close()
+    symbols = engine.symbols.tolist()
+    engine.set_prices({symbol: quote.price for symbol, quote in StubProvider().get_quotes(symbols).items()})
+    path = os.path.join(fixture.workdir, 'export.csv')
+
+    def run():
+        exporter.export_valuation(engine.valuation(), path)
+
+    return run, len(symbols), None
+
+
+# Cases that write to the database run last, so they don't change what the others measure
+CASES = {
+    'load': case_load,
+    'refresh': case_refresh,
+    'export': case_export,
+    'symbols': case_symbols,
+    'symbols_cached': case_symbols_cached,
+    'history': case_history,
+    'add_stock': case_add_stock,
+}
+
+
+def time_case(setup, fixture, repeat=REPEAT):
+    """Run a case repeat times after one warm-up; returns (durations, items)"""
+    run, items, teardown = setup(fixture)
+    try:
+        run()
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            durations.append(time.perf_counter() - start)
+    finally:
+        if teardown:
+            teardown()
+    return durations, items
+
+
+def run(sizes=DEFAULT_SIZES, cases=None, repeat=REPEAT, progress=None):
+    """Run the cases at each portfolio size; returns a results dict ready for write_results()"""
+    from loadgen import populate
+
+    results = []
+    for size in sizes:
+        workdir = tempfile.mkdtemp()
+        try:
+            fixture = Fixture(workdir, os.path.join(workdir, 'bench.db'), size, symbol_count(size))
+            populate(fixture.db_path, size, fixture.symbols)
+            for name in cases or CASES:
+                durations, items = time_case(CASES[name], fixture, repeat)
+                median = statistics.median(durations)
+                result = {
+                    'case': name,
+                    'size': size,
+                    'items': items,
+                    'median_s': median,
+                    'min_s': min(durations),
+                    'per_second': items / median if median else None,
+                }
+                results.append(result)
+                if progress:
+                    progress(result)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def write_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+
+
+def load_results(path):
+    with open(path) as f:
+        results = json.load(f)
+    if results.get('version') != RESULTS_VERSION:
+        raise ValueError(f"{path} is not a version {RESULTS_VERSION} benchmark results file")
+    return results
+
+
+def compare(baseline, current, threshold=THRESHOLD, min_delta=MIN_DELTA):
+    """Return a Regression for every case/size whose median grew by more than threshold (and min_delta seconds)"""
+    before = {(r['case'], r['size']): r['median_s'] for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        old = before.get((result['case'], result['size']))
+        new = result['median_s']
+        if old is None or new - old <= min_delta:
+            continue
+        change = (new - old) / old if old else float('inf')
+        if change > threshold:
+            regressions.append(Regression(result['case'], result['size'], old, new, change))
+    return regressions
+
+
+def format_result(result):
+    rate = f"{result['per_second']:,.0f}/s" if result['per_second'] else "-"
+    return (f"{result['case']:<15} {result['size']:>8,} lots  {result['median_s'] * 1000:>10.2f} ms"
+            f"  ({result['items']:,} items, {rate})")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the tracker's hot paths at several portfolio sizes")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="portfolio sizes in lots")
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), help="cases to run (default: all)")
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare against a saved results file and fail on regressions")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help="allowed slowdown, e.g. 0.25 for 25%%")
+    parser.add_argument('--input', help="compare an existing results file instead of running the benchmarks")
+    args = parser.parse_args()
+
+    try:
+        baseline = load_results(args.baseline) if args.baseline else None
+        if args.input:
+            current = load_results(args.input)
+        else:
+            print(f"🏁 Benchmarking {', '.join(f'{size:,}' for size in args.sizes)} lots, median of {args.repeat}")
+            current = run(args.sizes, args.cases, args.repeat, progress=lambda result: print(format_result(result)))
+    except (OSError, ValueError) as e:
+        print(f"❌ Benchmark failed: {e}")
+        sys.exit(1)
+
+    if args.output:
+        write_results(current, args.output)
+        print(f"💾 Results written to {args.output}")
+
+    if baseline is None:
+        return
+    regressions = compare(baseline, current, args.threshold)
+    for r in regressions:
+        print(f"❌ {r.case} at {r.size:,} lots: {r.baseline * 1000:.2f} ms -> {r.current * 1000:.2f} ms "
+              f"(+{r.change:.0%})")
+    if regressions:
+        sys.exit(1)
+    print(f"✅ No regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Portfolio value and price charts for the Stock Portfolio Tracker
+
+The chart is drawn on a plain Tk Canvas. Its time axis is cut into tiles:
+at zoom level z the visible span is the whole history divided by 2**z and
+each tile covers one span, so the screen always shows parts of at most two
+tiles. A tile is read from price_history (and the HistoryStore) for its
+dates only, valued, and downsampled with Largest-Triangle-Three-Buckets to
+the chart's pixel width before it is cached, so panning reuses the tiles of
+the current zoom level and a redraw only maps a few thousand points to
+pixels, however long the history. Tiles are fetched on a background thread
+with its own connection; the chart redraws when they arrive.
+"""
+
+import json
+import threading
+import tkinter as tk
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+import metrics
+import storage
+from analytics import forward_fill, load_lots, load_prices
+
+FRAME_MS = 16  # coalesce redraw requests into one pass per frame
+TILE_CACHE = 32  # downsampled tiles kept, across zoom levels
+MIN_SPAN_DAYS = 30  # the deepest zoom level shows about a month
+LOOKBACK_DAYS = 14  # read this far before a tile to carry prices over its first days
+WIDTH_STEP = 100  # tiles are downsampled to the plot width rounded up to this, so small resizes reuse them
+POINT_BUDGET = 40000  # holding-price points per tile, shared between the holdings
+MIN_SERIES_POINTS = 50
+MARGIN = (70, 30, 20, 30)  # left, top, right, bottom, in pixels
+COLORS = ('#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f',
+          '#bcbd22', '#17becf')
+
+Tile = namedtuple('Tile', ['value_x', 'value_y', 'price_x', 'price_y'])
+
+
+def lttb_columns(x, matrix, threshold):
+    """Indices of the points Largest-Triangle-Three-Buckets keeps in each column of matrix.
+
+    x is increasing and shared by the columns. Returns a (threshold, columns)
+    array (all indices if there are no more than threshold points). Buckets
+    are walked once for all columns together; NaNs are never preferred.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    n, columns = matrix.shape
+    if threshold >= n or threshold < 3:
+        return np.repeat(np.arange(n)[:, None], columns, axis=1)
+    x = np.asarray(x, dtype=np.float64)
+    edges = (np.arange(threshold - 1) * ((n - 2) / (threshold - 2))).astype(np.int64) + 1
+    edges[-1] = n - 1
+    edges = np.append(edges, n)
+    out = np.empty((threshold, columns), dtype=np.int64)
+    out[0] = 0
+    out[-1] = n - 1
+    cols = np.arange(columns)
+    known = ~np.isnan(matrix)
+    zeroed = np.where(known, matrix, 0.0)
+    previous = np.zeros(columns, dtype=np.int64)
+    for i in range(threshold - 2):
+        lo, hi, next_hi = edges[i], edges[i + 1], edges[i + 2]
+        # The third corner is the average of the next bucket
+        count = known[hi:next_hi].sum(axis=0)
+        avg_y = zeroed[hi:next_hi].sum(axis=0) / np.maximum(count, 1)
+        avg_x = x[hi:next_hi].mean()
+        px, py = x[previous], matrix[previous, cols]
+        area = np.abs((px - avg_x) * (matrix[lo:hi] - py) - (px - x[lo:hi, None]) * (avg_y - py))
+        chosen = np.argmax(np.where(np.isnan(area), -1.0, area), axis=0) + lo
+        out[i + 1] = chosen
+        previous = chosen
+    return out
+
+
+def lttb(x, y, threshold):
+    """Indices of the points LTTB keeps in one series"""
+    return lttb_columns(x, np.asarray(y, dtype=np.float64)[:, None], threshold)[:, 0]
+
+
+def series_points(width, series):
+    """Points each of series holding prices is downsampled to, for a plot width pixels wide"""
+    return min(width, max(MIN_SERIES_POINTS, POINT_BUDGET // max(series, 1)))
+
+
+class ChartData:
+    """Lots and date range of a scope, with its tiles of downsampled value and prices cached per zoom level"""
+
+    def __init__(self, lots, first, last, store=None, fx_rates=None, cache_size=TILE_CACHE):
+        """lots are load_lots() trades (sales negative) in today's share basis; first and last are days"""
+        self.symbols = sorted({lot[0] for lot in lots})
+        col = {symbol: j for j, symbol in enumerate(self.symbols)}
+        self.lot_days = np.array([lot[3] for lot in lots], dtype='datetime64[D]')
+        self.lot_cols = np.array([col[lot[0]] for lot in lots], dtype=np.int64)
+        self.lot_quantities = np.array([lot[1] for lot in lots], dtype=np.float64)
+        self.first = first
+        self.last = last
+        self.store = store
+        self.fx_rates = fx_rates
+        self.cache_size = cache_size
+        self.tiles = OrderedDict()  # (level, index, width) -> Tile, least recently used first
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, conn, store=None, fx_rates=None, account_id=None, portfolio_id=None):
+        """Read the lots of one portfolio or account (or all) and the range of their price history"""
+        lots = load_lots(conn, account_id, portfolio_id)
+        symbols = sorted({lot[0] for lot in lots})
+        bounds = []
+        if symbols:
+            row = conn.execute("""
+                SELECT MIN(date), MAX(date) FROM price_history WHERE symbol IN (SELECT value FROM json_each(?))
+            """, (json.dumps(symbols),)).fetchone()
+            if row[0]:
+                bounds.extend(np.array(row, dtype='datetime64[D]'))
+        if store is not None:
+            for symbol in symbols:
+                dates = store.column(symbol, 'date')
+                if len(dates):
+                    bounds.extend(np.array([dates[0], dates[-1]]).astype('datetime64[D]'))
+        if lots:
+            bounds.append(np.datetime64(lots[0][3], 'D'))
+        if not bounds:
+            today = np.datetime64('today', 'D')
+            bounds = [today, today]
+        return cls(lots, min(bounds), max(bounds), store, fx_rates)
+
+    @property
+    def days(self):
+        return int((self.last - self.first).astype(np.int64)) + 1
+
+    def levels(self):
+        """Number of zoom levels, level 0 showing the whole history"""
+        levels = 1
+        while self.days / 2 ** levels >= MIN_SPAN_DAYS:
+            levels += 1
+        return levels
+
+    def span(self, level):
+        """Days shown at a zoom level, which is also the length of its tiles"""
+        return -(-self.days // 2 ** level)
+
+    def tile_range(self, level, index):
+        start = self.first + np.timedelta64(index * self.span(level), 'D')
+        return start, start + np.timedelta64(self.span(level), 'D')
+
+    def cached(self, level, index, width):
+        """The tile if it is cached, else None"""
+        key = (level, index, width)
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+            return tile
+
+    def tile(self, conn, level, index, width):
+        """The tile, read and downsampled with conn if it isn't cached"""
+        tile = self.cached(level, index, width)
+        if tile is not None:
+            return tile
+        with metrics.span('chart_tile'):
+            tile = self.build(conn, level, index, width)
+        with self.lock:
+            self.tiles[(level, index, width)] = tile
+            while len(self.tiles) > self.cache_size:
+                self.tiles.popitem(last=False)
+        return tile
+
+    def build(self, conn, level, index, width):
+        start, end = self.tile_range(level, index)
+        dates, prices = load_prices(conn, self.symbols, self.store, self.fx_rates,
+                                    str(start - np.timedelta64(LOOKBACK_DAYS, 'D')), str(end - np.timedelta64(1, 'D')))
+        prices = forward_fill(prices)
+        keep = dates >= start
+        dates, prices = dates[keep], prices[keep]
+        if not len(dates):
+            empty = np.empty(0)
+            return Tile(empty, empty, np.empty((0, len(self.symbols))), np.empty((0, len(self.symbols))))
+
+        # Holdings on each day: trades made by then, those before the tile counted from its first day
+        trades = np.zeros((len(dates) + 1, len(self.symbols)))
+        np.add.at(trades, (np.searchsorted(dates, self.lot_days), self.lot_cols), self.lot_quantities)
+        positions = np.cumsum(trades, axis=0)[:len(dates)]
+        values = np.where(positions > 0, positions * np.nan_to_num(prices), 0.0).sum(axis=1)
+
+        x = dates.astype(np.int64)
+        kept = lttb(x, values, width)
+        columns = lttb_columns(x, prices, series_points(width, len(self.symbols)))
+        return Tile(x[kept], values[kept], x[columns], np.take_along_axis(prices, columns, axis=0))
+
+
+class ChartView:
+    """A Canvas showing portfolio value above the prices of some holdings, with wheel zoom and drag pan.
+
+    Prices are in ₹ for one holding and rebased to 100 at the left edge for
+    several. Missing tiles are fetched on a background thread through
+    db_path, and post(callback, *args) hands the result back to the Tk loop.
+    """
+
+    def __init__(self, parent, data, db_path, post, symbols=None):
+        self.data = data
+        self.db_path = db_path
+        self.post = post
+        self.columns = [data.symbols.index(s) for s in symbols or data.symbols if s in data.symbols]
+        self.level = 0
+        self.start = 0  # first visible day, counted from data.first
+        self.pending = None
+        self.loading = False
+        self.error = None  # a failed fetch is not retried, so a broken database can't loop
+        self.drag = None
+        self.value_item = None
+        self.price_items = []
+        self.labels = []
+
+        self.canvas = tk.Canvas(parent, background='white', highlightthickness=0)
+        self.canvas.bind('<Configure>', lambda event: self.schedule())
+        self.canvas.bind('<MouseWheel>', self.on_wheel)
+        self.canvas.bind('<Button-4>', self.on_wheel)
+        self.canvas.bind('<Button-5>', self.on_wheel)
+        self.canvas.bind('<ButtonPress-1>', self.on_press)
+        self.canvas.bind('<B1-Motion>', self.on_drag)
+        self.canvas.bind('<Double-Button-1>', self.on_reset)
+
+    def schedule(self):
+        if self.pending is None:
+            self.pending = self.canvas.after(FRAME_MS, self.flush)
+
+    def flush(self):
+        with metrics.span('chart_draw'):
+            self.draw()
+
+    def plot_box(self):
+        left, top, right, bottom = MARGIN
+        return left, top, max(self.canvas.winfo_width() - left - right, 1), \
+            max(self.canvas.winfo_height() - top - bottom, 1)
+
+    def tile_width(self, plot_width):
+        return -(-plot_width // WIDTH_STEP) * WIDTH_STEP
+
+    def visible_tiles(self, width):
+        """[(level, index, width)] of the tiles under the visible span"""
+        span = self.data.span(self.level)
+        first = self.start // span
+        last = min((self.start + span - 1) // span, 2 ** self.level - 1)
+        return [(self.level, index, width) for index in range(first, last + 1)]
+
+    def draw(self):
+        self.pending = None
+        left, top, plot_width, plot_height = self.plot_box()
+        keys = self.visible_tiles(self.tile_width(plot_width))
+        tiles = [self.data.cached(*key) for key in keys]
+        missing = [key for key, tile in zip(keys, tiles) if tile is None]
+        if missing:
+            self.fetch(missing)
+        tiles = [tile for tile in tiles if tile is not None]
+
+        span = self.data.span(self.level)
+        lo = self.data.first.astype(np.int64) + self.start
+        hi = lo + span
+        value_height = int(plot_height * 0.6)
+        price_top = top + value_height + 10
+        price_height = max(plot_height - value_height - 10, 1)
+
+        def to_x(days):
+            return left + (days - lo) * (plot_width / span)
+
+        def to_y(y, low, high, offset, height):
+            return offset + (high - y) * (height / ((high - low) or 1.0))
+
+        def visible(days):
+            within = (days >= lo) & (days < hi)
+            # One point either side so lines run to the edges
+            inside = within.copy()
+            inside[1:] |= within[:-1]
+            inside[:-1] |= within[1:]
+            return inside
+
+        labels = []
+        coords = None
+        if tiles:
+            value_x = np.concatenate([tile.value_x for tile in tiles])
+            value_y = np.concatenate([tile.value_y for tile in tiles])
+            shown = visible(value_x)
+            value_x, value_y = value_x[shown], value_y[shown]
+            if len(value_x) >= 2:
+                low, high = float(value_y.min()), float(value_y.max())
+                coords = np.column_stack((to_x(value_x), to_y(value_y, low, high, top, value_height)))
+                labels += [(left - 5, top, f"₹{high:,.0f}"), (left - 5, top + value_height, f"₹{low:,.0f}")]
+        self.value_item = self.set_line(self.value_item, coords, 'black', 2)
+
+        lines = []
+        if tiles and self.columns:
+            price_x = np.concatenate([tile.price_x[:, self.columns] for tile in tiles])
+            price_y = np.concatenate([tile.price_y[:, self.columns] for tile in tiles])
+            rebase = len(self.columns) > 1
+            if rebase:
+                # 100 at each holding's first price on screen
+                in_view = (price_x >= lo) & ~np.isnan(price_y)
+                first = np.argmax(in_view, axis=0)
+                base = price_y[first, np.arange(price_y.shape[1])]
+                base[~in_view.any(axis=0)] = np.nan
+                with np.errstate(invalid='ignore'):
+                    price_y = price_y / base * 100
+            shown = np.isfinite(price_y) & visible(price_x)
+            if shown.any():
+                low, high = float(price_y[shown].min()), float(price_y[shown].max())
+                for j in range(price_y.shape[1]):
+                    keep = shown[:, j]
+                    lines.append(np.column_stack((to_x(price_x[keep, j]),
+                                                  to_y(price_y[keep, j], low, high, price_top, price_height))))
+                unit = "" if rebase else "₹"
+                labels += [(left - 5, price_top, f"{unit}{high:,.0f}"),
+                           (left - 5, price_top + price_height, f"{unit}{low:,.0f}")]
+
+        while len(self.price_items) > len(lines):
+            item = self.price_items.pop()
+            if item is not None:
+                self.canvas.delete(item)
+        self.price_items += [None] * (len(lines) - len(self.price_items))
+        for j, line in enumerate(lines):
+            self.price_items[j] = self.set_line(self.price_items[j], line, COLORS[j % len(COLORS)], 1)
+
+        start = self.data.first + np.timedelta64(self.start, 'D')
+        labels += [(left, top + plot_height + 15, str(start)),
+                   (left + plot_width, top + plot_height + 15, str(start + np.timedelta64(span - 1, 'D')))]
+        caption = "Value" + (f" (failed: {self.error})" if self.error else " (loading...)" if missing else "")
+        if len(self.columns) > 1:
+            caption += f" · {len(self.columns)} holdings rebased to 100"
+        elif self.columns:
+            caption += f" · {self.data.symbols[self.columns[0]]}"
+        labels.append((left + plot_width // 2, 12, caption))
+        self.set_labels(labels, left, plot_width)
+
+    def set_line(self, item, coords, color, width):
+        """Move (or create) a line item to coords, an (n, 2) array; hidden if there are fewer than two points"""
+        if coords is None or len(coords) < 2:
+            if item is not None:
+                self.canvas.itemconfigure(item, state='hidden')
+            return item
+        flat = coords.ravel().tolist()
+        if item is None:
+            return self.canvas.create_line(*flat, fill=color, width=width)
+        self.canvas.coords(item, flat)
+        self.canvas.itemconfigure(item, state='normal')
+        return item
+
+    def set_labels(self, labels, left, plot_width):
+        for item in self.labels:
+            self.canvas.delete(item)
+        anchors = {left: tk.W, left + plot_width: tk.E, left + plot_width // 2: tk.CENTER}
+        self.labels = [self.canvas.create_text(x, y, text=text, anchor=anchors.get(x, tk.E), font=('Arial', 9))
+                       for x, y, text in labels]
+
+    def fetch(self, keys):
+        """Build the missing tiles on a background thread, one batch at a time"""
+        if self.loading or self.error:
+            return
+        self.loading = True
+
+        def run():
+            error = None
+            try:
+                conn = storage.connect(self.db_path)
+                try:
+                    for key in keys:
+                        self.data.tile(conn, *key)
+                finally:
+                    conn.close()
+            except Exception as e:
+                error = str(e)
+                metrics.log('error', 'chart_tile_failed', error)
+            self.post(self.on_fetched, error)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def on_fetched(self, error=None):
+        self.loading = False
+        self.error = error
+        if self.canvas.winfo_exists():
+            self.schedule()
+
+    def clamp(self):
+        span = self.data.span(self.level)
+        self.start = int(min(max(self.start, 0), max(self.data.days - span, 0)))
+
+    def on_wheel(self, event):
+        zoom_in = event.num == 4 or getattr(event, 'delta', 0) > 0
+        level = self.level + (1 if zoom_in else -1)
+        if not 0 <= level < self.data.levels():
+            return
+        left, _, plot_width, _ = self.plot_box()
+        fraction = min(max((event.x - left) / plot_width, 0.0), 1.0)
+        # Keep the day under the cursor where it is
+        cursor = self.start + fraction * self.data.span(self.level)
+        self.level = level
+        self.start = int(cursor - fraction * self.data.span(level))
+        self.clamp()
+        self.schedule()
+
+    def on_press(self, event):
+        self.drag = (event.x, self.start)
+
+    def on_drag(self, event):
+        if self.drag is None:
+            return
+        _, _, plot_width, _ = self.plot_box()
+        x, start = self.drag
+        self.start = int(start - (event.x - x) * self.data.span(self.level) / plot_width)
+        self.clamp()
+        self.schedule()
+
+    def on_reset(self, event=None):
+        self.level = 0
+        self.start = 0
+        self.schedule()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Corporate actions for the Stock Portfolio Tracker
+
+Splits, bonus issues and dividends are recorded in the corporate_actions
+table; lots and price_history rows are never rewritten. Each split or bonus
+has a ratio (shares held after it per share held before), and every row
+stores the cumulative product of the ratios of its symbol's actions on or
+after its ex-date. The factor that brings a quantity or price from day d to
+today's share basis is therefore the cumulative value of the first action
+after d (1 if there is none), found by binary search over the symbol's
+ex-dates: quantities are multiplied by it and prices divided by it.
+
+Adjustments loads those per-symbol arrays once and applies them to whole
+columns of lots or prices with NumPy, so valuation and history queries
+adjust on the fly. Fractional entitlements are paid in cash on NSE, so
+adjusted holdings are rounded down to whole shares.
+"""
+
+import json
+import sqlite3
+from collections import namedtuple
+from datetime import date
+
+import numpy as np
+
+from symbols import normalize_symbol
+
+KINDS = ('split', 'bonus', 'dividend')
+
+Action = namedtuple('Action', ['id', 'symbol', 'kind', 'ex_date', 'ratio', 'amount', 'cumulative', 'note'])
+Dividend = namedtuple('Dividend', ['symbol', 'ex_date', 'amount', 'shares', 'income'])
+
+
+def parse_ratio(kind, text):
+    """Shares after the action per share before, from an NSE-style ratio.
+
+    A split 'a:b' turns a shares into b (1:5 for face value 10 to 2); a bonus
+    'a:b' gives a new shares for every b held (1:1 doubles a holding). A plain
+    number is taken as the ratio itself.
+    """
+    text = str(text).strip()
+    try:
+        if ':' in text:
+            a, b = (float(part) for part in text.split(':', 1))
+            ratio = b / a if kind == 'split' else (a + b) / b
+        else:
+            ratio = float(text)
+    except (ValueError, ZeroDivisionError):
+        raise ValueError(f"Invalid ratio {text!r}; use a:b, e.g. 1:5")
+    if not ratio > 0 or ratio == 1:
+        raise ValueError(f"Invalid ratio {text!r}")
+    return ratio
+
+
+def add_action(conn, symbol, kind, ex_date, ratio=None, amount=None, note=None):
+    """Record a corporate action and recompute the symbol's cumulative factors; returns its id.
+
+    ratio is an a:b string or a number for splits and bonuses; amount is the
+    dividend per share. Raises ValueError with a message fit to show the user.
+    """
+    symbol = normalize_symbol(symbol or '')
+    if not symbol:
+        raise ValueError("A corporate action needs a symbol")
+    if kind not in KINDS:
+        raise ValueError(f"Unknown action {kind!r}; use one of {', '.join(KINDS)}")
+    try:
+        ex_date = date.fromisoformat(str(ex_date).strip()).isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid ex-date {ex_date!r}; use YYYY-MM-DD")
+    if kind == 'dividend':
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            raise ValueError("A dividend needs an amount per share")
+        if amount <= 0:
+            raise ValueError("The dividend must be positive")
+        ratio = 1.0
+    else:
+        if ratio is None:
+            raise ValueError(f"A {kind} needs a ratio, e.g. 1:5")
+        ratio = parse_ratio(kind, ratio)
+        amount = 0.0
+
+    try:
+        with conn:
+            action_id = conn.execute("""
+                INSERT INTO corporate_actions (symbol, kind, ex_date, ratio, amount, note)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (symbol, kind, ex_date, ratio, amount, note)).lastrowid
+            recompute(conn, symbol)
+    except sqlite3.IntegrityError:
+        raise ValueError(f"{symbol} already has a {kind} on {ex_date}")
+    return action_id
+
+
+def delete_action(conn, action_id):
+    """Remove an action and recompute its symbol's factors; returns True if it existed"""
+    with conn:
+        row = conn.execute("SELECT symbol FROM corporate_actions WHERE id = ?", (action_id,)).fetchone()
+        if row is None:
+            return False
+        conn.execute("DELETE FROM corporate_actions WHERE id = ?", (action_id,))
+        recompute(conn, row[0])
+    return True
+
+
+def recompute(conn, symbol):
+    """Rewrite the cumulative factors of one symbol's actions, newest first; does not commit"""
+    rows = conn.execute("SELECT id, ratio FROM corporate_actions WHERE symbol = ? ORDER BY ex_date DESC",
+                        (symbol,)).fetchall()
+    cumulative = 1.0
+    updates = []
+    for action_id, ratio in rows:
+        cumulative *= ratio
+        updates.append((cumulative, action_id))
+    conn.executemany("UPDATE corporate_actions SET cumulative = ? WHERE id = ?", updates)
+
+
+def list_actions(conn, symbol=None):
+    """Return every Action (or one symbol's), by symbol and ex-date"""
+    sql = "SELECT id, symbol, kind, ex_date, ratio, amount, cumulative, note FROM corporate_actions"
+    if symbol is not None:
+        return [Action(*row) for row in conn.execute(sql + " WHERE symbol = ? ORDER BY ex_date", (symbol,))]
+    return [Action(*row) for row in conn.execute(sql + " ORDER BY symbol, ex_date")]
+
+
+def adjusted_symbols(conn):
+    """Symbols with at least one split or bonus"""
+    return {row[0] for row in conn.execute("SELECT DISTINCT symbol FROM corporate_actions WHERE kind != 'dividend'")}
+
+
+def to_days(days):
+    return np.asarray(days, dtype='datetime64[D]')
+
+
+class Adjustments:
+    """Cumulative split/bonus factors per symbol: sorted ex-dates, and the factor in force before each"""
+
+    def __init__(self, rows=()):
+        """rows are (symbol, ex_date, cumulative) in symbol then ex-date order"""
+        grouped = {}
+        for symbol, ex_date, cumulative in rows:
+            grouped.setdefault(symbol, ([], []))
+            grouped[symbol][0].append(ex_date)
+            grouped[symbol][1].append(cumulative)
+        # factors[symbol][i] applies to days before ex_dates[symbol][i] and on or after the one before it
+        self.ex_dates = {symbol: to_days(days) for symbol, (days, _) in grouped.items()}
+        self.factors = {symbol: np.append(np.array(values, dtype=np.float64), 1.0)
+                        for symbol, (_, values) in grouped.items()}
+
+    @classmethod
+    def load(cls, conn, symbols=None):
+        """Load the factors of every adjusted symbol, or of the given ones"""
+        sql = "SELECT symbol, ex_date, cumulative FROM corporate_actions WHERE kind != 'dividend'"
+        if symbols is None:
+            return cls(conn.execute(sql + " ORDER BY symbol, ex_date"))
+        return cls(conn.execute(sql + " AND symbol IN (SELECT value FROM json_each(?)) ORDER BY symbol, ex_date",
+                                (json_list(symbols),)))
+
+    def __contains__(self, symbol):
+        return symbol in self.ex_dates
+
+    def __bool__(self):
+        return bool(self.ex_dates)
+
+    def factor(self, symbol, day, through=False):
+        """The factor from day's share basis to today's; through=True also counts actions on day itself"""
+        ex_dates = self.ex_dates.get(symbol)
+        if ex_dates is None:
+            return 1.0
+        i = np.searchsorted(ex_dates, np.datetime64(day, 'D'), side='left' if through else 'right')
+        return float(self.factors[symbol][i])
+
+    def factors_for(self, symbol, days, through=False):
+        """factor() for an array of days of one symbol"""
+        days = to_days(days)
+        ex_dates = self.ex_dates.get(symbol)
+        if ex_dates is None:
+            return np.ones(len(days))
+        return self.factors[symbol][np.searchsorted(ex_dates, days, side='left' if through else 'right')]
+
+    def column(self, symbols, days, through=False):
+        """factor() for parallel arrays of symbols and days, one searchsorted per adjusted symbol"""
+        symbols = np.asarray(symbols, dtype=object)
+        days = to_days(days)
+        out = np.ones(len(days))
+        if not self.ex_dates or not len(days):
+            return out
+        names, inverse = np.unique(symbols, return_inverse=True)
+        for k, symbol in enumerate(names.tolist()):
+            if symbol in self.ex_dates:
+                mask = inverse == k
+                out[mask] = self.factors_for(symbol, days[mask], through)
+        return out
+
+    def adjust_prices(self, symbols, days, prices):
+        """Prices recorded on days, in today's share basis"""
+        return np.asarray(prices, dtype=np.float64) / self.column(symbols, days)
+
+    def adjust_quantities(self, symbols, days, quantities):
+        """Quantities bought on days, in today's share basis"""
+        return np.asarray(quantities, dtype=np.float64) * self.column(symbols, days)
+
+
+def json_list(values):
+    return json.dumps(list(values))
+
+
+def adjust_positions(conn, rows, key_columns=1, where="", args=()):
+    """Re-count (key..., symbol, quantity, avg_cost) rows in today's share basis.
+
+    Only symbols with a split or bonus are touched: their lots matching where
+    are re-read, adjusted with Adjustments and summed per key, rounding down
+    to whole shares. Total cost is unchanged, so the average cost falls.
+    """
+    adjusted = adjusted_symbols(conn)
+    if not adjusted or not any(row[key_columns - 1] in adjusted for row in rows):
+        return rows
+    held = sorted({row[key_columns - 1] for row in rows} & adjusted)
+    keys = ', '.join(['account_id'] * (key_columns - 1) + ['symbol'])
+    lots = conn.execute(f"""
+        SELECT {keys}, quantity, purchase_date FROM portfolio
+        WHERE symbol IN (SELECT value FROM json_each(?)) {'AND ' + where if where else ''}
+    """, (json_list(held),) + tuple(args)).fetchall()
+    if not lots:
+        return rows
+    adjustments = Adjustments.load(conn, held)
+    columns = list(zip(*lots))
+    quantities = adjustments.adjust_quantities(columns[key_columns - 1], columns[-1], columns[-2])
+    totals = {}
+    for key, quantity in zip(zip(*columns[:key_columns]), quantities.tolist()):
+        totals[key] = totals.get(key, 0.0) + quantity
+
+    result = []
+    for row in rows:
+        key = tuple(row[:key_columns])
+        if key in totals:
+            quantity = int(np.floor(totals[key] + 1e-9))
+            cost = row[key_columns] * row[key_columns + 1]
+            row = key + (quantity, cost / quantity if quantity else row[key_columns + 1])
+        result.append(row)
+    return result
+
+
+def dividend_income(conn, account_id=None, portfolio_id=None, start=None, end=None):
+    """Dividends earned, from the shares held (open or since sold) the day before each ex-date"""
+    where, args = [], []
+    for clause, value in (("ex_date >= ?", start), ("ex_date <= ?", end)):
+        if value is not None:
+            where.append(clause)
+            args.append(value)
+    dividends = conn.execute(f"""
+        SELECT symbol, ex_date, amount FROM corporate_actions
+        WHERE kind = 'dividend' {'AND ' + ' AND '.join(where) if where else ''}
+        ORDER BY ex_date, symbol
+    """, args).fetchall()
+    if not dividends:
+        return []
+    symbols = sorted({symbol for symbol, _, _ in dividends})
+    scope, scope_args = "", ()
+    if portfolio_id is not None:
+        scope, scope_args = "AND portfolio_id = ?", (portfolio_id,)
+    elif account_id is not None:
+        scope, scope_args = "AND account_id = ?", (account_id,)
+    open_lots = conn.execute(f"""
+        SELECT symbol, quantity, purchase_date FROM portfolio
+        WHERE symbol IN (SELECT value FROM json_each(?)) {scope}
+    """, (json_list(symbols),) + scope_args).fetchall()
+    sold = conn.execute(f"""
+        SELECT s.symbol, m.quantity, m.purchase_date, s.sale_date FROM sales s JOIN lot_matches m ON m.sale_id = s.id
+        WHERE s.symbol IN (SELECT value FROM json_each(?)) {scope.replace('AND ', 'AND s.')}
+    """, (json_list(symbols),) + scope_args).fetchall()
+    adjustments = Adjustments.load(conn, symbols)
+
+    by_symbol = {}  # symbol -> ([shares in today's basis], [bought], [sold or far future])
+    for symbol, quantity, bought in open_lots:
+        entry = by_symbol.setdefault(symbol, ([], [], []))
+        # Open lots are in purchase-day shares
+        entry[0].append(quantity * adjustments.factor(symbol, bought))
+        entry[1].append(bought)
+        entry[2].append('9999-12-31')
+    for symbol, quantity, bought, sold_on in sold:
+        entry = by_symbol.setdefault(symbol, ([], [], []))
+        # Matches are recorded in sale-day shares
+        entry[0].append(quantity * adjustments.factor(symbol, sold_on))
+        entry[1].append(bought)
+        entry[2].append(sold_on)
+
+    result = []
+    for symbol, ex_date, amount in dividends:
+        entry = by_symbol.get(symbol)
+        if not entry:
+            continue
+        today_shares = np.array(entry[0], dtype=np.float64)
+        held = (to_days(entry[1]) < np.datetime64(ex_date)) & (to_days(entry[2]) >= np.datetime64(ex_date))
+        # Shares in today's basis back to the basis the dividend was declared in
+        shares = float(today_shares[held].sum()) / adjustments.factor(symbol, ex_date, through=True)
+        if shares > 0:
+            result.append(Dividend(symbol, ex_date, amount, shares, shares * amount))
+    return result
+
+
+def main():
+    import argparse
+
+    import storage
+
+    parser = argparse.ArgumentParser(description="Record splits, bonus issues and dividends")
+    parser.add_argument('--db', default=storage.DB_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help="record an action")
+    add.add_argument('kind', choices=KINDS)
+    add.add_argument('symbol')
+    add.add_argument('ex_date', help="YYYY-MM-DD")
+    add.add_argument('value', help="ratio a:b for splits and bonuses, amount per share for dividends")
+    add.add_argument('--note')
+    remove = sub.add_parser('remove', help="remove an action")
+    remove.add_argument('action_id', type=int)
+    listing = sub.add_parser('list', help="list actions")
+    listing.add_argument('symbol', nargs='?')
+    dividends = sub.add_parser('dividends', help="dividend income")
+    dividends.add_argument('--account', type=int)
+    dividends.add_argument('--portfolio', type=int)
+    args = parser.parse_args()
+
+    conn = storage.connect(args.db)
+    try:
+        if args.command == 'add':
+            if args.kind == 'dividend':
+                action_id = add_action(conn, args.symbol, args.kind, args.ex_date, amount=args.value, note=args.note)
+            else:
+                action_id = add_action(conn, args.symbol, args.kind, args.ex_date, ratio=args.value, note=args.note)
+            print(f"✅ Recorded action {action_id}")
+        elif args.command == 'remove':
+            print("✅ Removed" if delete_action(conn, args.action_id) else f"❌ No action with id {args.action_id}")
+        elif args.command == 'list':
+            for a in list_actions(conn, normalize_symbol(args.symbol) if args.symbol else None):
+                detail = f"₹{a.amount:,.2f}/share" if a.kind == 'dividend' else f"x{a.ratio:g} (cumulative x{a.cumulative:g})"
+                print(f"{a.id:>6}  {a.ex_date}  {a.symbol:<15} {a.kind:<9} {detail}")
+        else:
+            rows = dividend_income(conn, args.account, args.portfolio)
+            for d in rows:
+                print(f"{d.ex_date}  {d.symbol:<15} {d.shares:>10,.2f} x ₹{d.amount:,.2f} = ₹{d.income:,.2f}")
+            print(f"Total: ₹{sum(d.income for d in rows):,.2f}")
+    except ValueError as e:
+        print(f"❌ {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
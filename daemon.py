@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Headless price recorder for the Stock Portfolio Tracker
+
+Runs without Tk and prices every holding on a schedule, writing the prices
+to price_history and a valuation snapshot to the same database the app
+uses, so values keep being recorded while nobody has the window open.
+Polling is frequent during NSE trading hours and slow (or off) outside
+them. Cycles where most quotes fail back off exponentially and run with
+fewer concurrent requests until the provider recovers; requests made while
+a cycle is still running are coalesced into one follow-up cycle.
+"""
+
+import random
+import signal
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+
+import alerts
+import metrics
+import storage
+from engine import PortfolioEngine
+from fx import FxRates
+from quotes import YFinanceProvider
+from workers import RefreshController
+
+IST = timezone(timedelta(hours=5, minutes=30), 'IST')
+MARKET_OPEN = (9, 15)
+MARKET_CLOSE = (15, 30)
+MARKET_INTERVAL = 60  # seconds between cycles while the market is open
+OFF_HOURS_INTERVAL = 3600  # seconds between cycles while it is closed; 0 sleeps until the next open
+MAX_BACKOFF = 1800
+ERROR_THRESHOLD = 0.5  # share of failed quotes that counts a cycle as failed
+MAX_SLEEP = 300  # wake at least this often, so a suspended machine catches up on resume
+CHUNK = 50
+
+CycleResult = namedtuple('CycleResult', ['symbols', 'priced', 'seconds'])
+
+
+def log(message):
+    print(f"{datetime.now(IST):%Y-%m-%d %H:%M:%S} {message}", flush=True)
+
+
+class MarketSchedule:
+    """NSE trading sessions (weekdays, 09:15-15:30 IST, minus holidays) and the polling interval for a moment"""
+
+    def __init__(self, market_interval=MARKET_INTERVAL, off_hours_interval=OFF_HOURS_INTERVAL, holidays=()):
+        self.market_interval = market_interval
+        self.off_hours_interval = off_hours_interval
+        self.holidays = {date.fromisoformat(str(day)) for day in holidays}
+
+    def session(self, day):
+        """Return (open, close) datetimes for day, or None if the market is shut all day"""
+        if day.weekday() >= 5 or day in self.holidays:
+            return None
+        start = datetime(day.year, day.month, day.day, *MARKET_OPEN, tzinfo=IST)
+        end = datetime(day.year, day.month, day.day, *MARKET_CLOSE, tzinfo=IST)
+        return start, end
+
+    def is_open(self, now):
+        session = self.session(now.astimezone(IST).date())
+        return session is not None and session[0] <= now < session[1]
+
+    def next_open(self, now):
+        now = now.astimezone(IST)
+        for offset in range(30):
+            session = self.session(now.date() + timedelta(days=offset))
+            if session is not None and session[0] > now:
+                return session[0]
+        return now + timedelta(days=1)
+
+    def delay(self, now):
+        """Seconds from now until the next cycle; a cycle always falls on the close, to record closing prices"""
+        now = now.astimezone(IST)
+        session = self.session(now.date())
+        if session is not None and session[0] <= now < session[1]:
+            return max(1.0, min(self.market_interval, (session[1] - now).total_seconds()))
+        until_open = (self.next_open(now) - now).total_seconds()
+        if not self.off_hours_interval:
+            return until_open
+        return max(1.0, min(self.off_hours_interval, until_open))
+
+
+class PriceDaemon:
+    def __init__(self, db_path=storage.DB_PATH, provider=None, schedule=None, max_backoff=MAX_BACKOFF, clock=None,
+                 metrics_path=None, alert_log=alerts.LOG_PATH):
+        self.db_path = db_path
+        self.metrics_path = metrics_path  # Prometheus text file rewritten after every cycle
+        self.alert_log = alert_log  # fired alerts are appended here
+        self.alert_engine = alerts.AlertEngine()
+        self.rules_seen = None  # (count, max id) of alert_rules when they were last loaded
+        self.provider = provider or YFinanceProvider()
+        self.fx = FxRates(self.provider)
+        self.schedule = schedule or MarketSchedule()
+        self.max_backoff = max_backoff
+        self.clock = clock or (lambda: datetime.now(IST))
+        self.max_workers = self.provider.max_workers
+        self.engine = PortfolioEngine()  # keeps each symbol's last good price across cycles
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.controller = RefreshController(self.run_cycle)
+        self.stopped = threading.Event()
+        self.wake = threading.Event()
+
+    def cycle(self, cancelled):
+        """Price every holding and write a snapshot, and price_history once the day's session has opened.
+
+        Returns a CycleResult, or None if cancelled.
+        """
+        start = time.monotonic()
+        conn = storage.connect(self.db_path)
+        try:
+            self.engine.load(storage.load_holdings(conn))
+            symbols = self.engine.symbols.tolist()
+            priced = {}
+            for offset in range(0, len(symbols), CHUNK):
+                if cancelled.is_set():
+                    return None
+                chunk = symbols[offset:offset + CHUNK]
+                quotes = self.provider.get_quotes(chunk)
+                prices = self.fx.convert_quotes({symbol: quotes.get(symbol) for symbol in chunk})
+                priced.update((symbol, price) for symbol, price in prices.items() if price is not None)
+
+            if priced:
+                self.engine.set_prices(priced)
+                now = self.clock().astimezone(IST)
+                day = now.date().isoformat()
+                fired = self.check_alerts(conn, priced, now.date())
+                session = self.schedule.session(now.date())
+                with metrics.span('db_transaction'), conn:
+                    # Off-hours quotes are the last session's close; only a day that traded gets a price_history row
+                    if session is not None and now >= session[0]:
+                        conn.executemany(storage.UPSERT_PRICE,
+                                         [(symbol, price, day) for symbol, price in priced.items()])
+                    storage.write_snapshot(conn, self.engine.valuation(), now.isoformat(timespec='seconds'))
+                    alerts.write_state(conn, self.alert_engine.take_changes())
+                for alert in fired:
+                    log(alert.message)
+                alerts.append_log(fired, self.alert_log)
+        finally:
+            conn.close()
+        return CycleResult(len(symbols), len(priced), time.monotonic() - start)
+
+    def check_alerts(self, conn, priced, today):
+        """Check any alert rules against this cycle's prices.
+
+        Rules are reloaded if any were added or removed, and on a new day, so
+        move rules measure from the latest previous close.
+        """
+        seen = conn.execute("SELECT COUNT(*), MAX(id) FROM alert_rules").fetchone()
+        if seen != self.rules_seen or today != self.alert_engine.loaded_day:
+            self.alert_engine.load(conn, today=today)
+            self.rules_seen = seen
+        elif self.alert_engine.pnl_rules:
+            self.alert_engine.load_positions(conn)
+        if not seen[0]:
+            return []
+        return self.alert_engine.update(priced)
+
+    def run_cycle(self, cancelled):
+        """Run one cycle, log it and update the backoff state; returns the CycleResult"""
+        try:
+            result = self.cycle(cancelled)
+        except (sqlite3.Error, OSError) as e:
+            log(f"❌ Cycle failed: {e}")
+            metrics.log('error', 'refresh', error=str(e))
+            metrics.count('refreshes_total', result='failed')
+            self.record(False)
+            self.write_metrics()
+            return None
+        if result is None:
+            metrics.count('refreshes_total', result='cancelled')
+            return None
+        ok = not result.symbols or result.priced >= (1 - ERROR_THRESHOLD) * result.symbols
+        self.record(ok)
+        metrics.observe('refresh_seconds', result.seconds)
+        metrics.count('refreshes_total', result='done' if ok else 'degraded')
+        metrics.log('info', 'refresh', result='done' if ok else 'degraded', seconds=round(result.seconds, 4),
+                    symbols=result.symbols, failed=result.symbols - result.priced, workers=self.provider.max_workers)
+        self.write_metrics()
+        log(f"{'✅' if ok else '⚠️'} Priced {result.priced} of {result.symbols} holdings in {result.seconds:.1f}s"
+            + ("" if ok else f"; backing off with {self.provider.max_workers} workers"))
+        return result
+
+    def write_metrics(self):
+        if self.metrics_path:
+            try:
+                metrics.REGISTRY.write_prometheus(self.metrics_path)
+            except OSError as e:
+                log(f"Error writing metrics: {e}")
+
+    def record(self, ok):
+        """Reset after a good cycle; after a bad one, count it and halve the fetch concurrency"""
+        with self.lock:
+            if ok:
+                self.failures = 0
+                self.provider.max_workers = min(self.max_workers, self.provider.max_workers + 1)
+            else:
+                self.failures += 1
+                self.provider.max_workers = max(1, self.provider.max_workers // 2)
+
+    def next_delay(self, now):
+        """The schedule's delay, stretched exponentially (with jitter) after consecutive failed cycles"""
+        delay = self.schedule.delay(now)
+        with self.lock:
+            failures = self.failures
+        if failures:
+            backoff = min(self.max_backoff, self.schedule.market_interval * 2 ** failures)
+            delay = max(delay, backoff * random.uniform(0.8, 1.0))
+        return delay
+
+    def request(self):
+        """Start a cycle now, or queue one behind the cycle in flight"""
+        self.controller.request()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+        self.controller.cancel()
+
+    def serve(self):
+        log(f"📡 Recording prices to {self.db_path} (market {'open' if self.schedule.is_open(self.clock()) else 'closed'})")
+        due = self.clock()
+        while not self.stopped.is_set():
+            if self.clock() >= due:
+                self.request()
+                delay = self.next_delay(self.clock())
+                due = self.clock() + timedelta(seconds=delay)
+                log(f"Next cycle at {due.astimezone(IST):%Y-%m-%d %H:%M:%S}")
+            remaining = (due - self.clock()).total_seconds()
+            if self.wake.wait(max(0.0, min(remaining, MAX_SLEEP))):
+                self.wake.clear()
+                if not self.stopped.is_set():
+                    due = self.clock()
+        log("👋 Stopped")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record portfolio prices in the background, without the GUI")
+    parser.add_argument('--db', default=storage.DB_PATH)
+    parser.add_argument('--market-interval', type=float, default=MARKET_INTERVAL, help="seconds between cycles in market hours")
+    parser.add_argument('--off-hours-interval', type=float, default=OFF_HOURS_INTERVAL,
+                        help="seconds between cycles outside market hours (0 waits for the next open)")
+    parser.add_argument('--max-backoff', type=float, default=MAX_BACKOFF)
+    parser.add_argument('--holidays', help="file of YYYY-MM-DD market holidays, one per line")
+    parser.add_argument('--once', action='store_true', help="run a single cycle and exit")
+    parser.add_argument('--metrics', help="rewrite this Prometheus text file after every cycle")
+    parser.add_argument('--log', help="append a structured JSON log to this file")
+    parser.add_argument('--alerts', default=alerts.LOG_PATH,
+                        help=f"append fired alerts to this file (default {alerts.LOG_PATH})")
+    args = parser.parse_args()
+
+    if args.log:
+        metrics.REGISTRY.open_log(args.log)
+
+    holidays = []
+    if args.holidays:
+        with open(args.holidays) as f:
+            holidays = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    daemon = PriceDaemon(args.db, schedule=MarketSchedule(args.market_interval, args.off_hours_interval, holidays),
+                         max_backoff=args.max_backoff, metrics_path=args.metrics, alert_log=args.alerts)
+
+    if args.once:
+        daemon.run_cycle(threading.Event())
+        sys.exit(0 if daemon.failures == 0 else 1)
+
+    signal.signal(signal.SIGINT, lambda *_: daemon.stop())
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    if hasattr(signal, 'SIGUSR1'):
+        # kill -USR1 <pid> runs a cycle straight away
+        signal.signal(signal.SIGUSR1, lambda *_: daemon.wake.set())
+    daemon.serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Headless valuation engine for the Stock Portfolio Tracker
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+Valuation = namedtuple('Valuation', [
+    'symbols', 'quantities', 'avg_costs', 'prices',
+    'cost', 'value', 'gain_loss', 'weights',
+    'total_cost', 'total_value', 'total_gain_loss',
+])
+
+
+class PortfolioEngine:
+    """Holds positions as parallel NumPy columns and values the whole book at once.
+
+    Prices are NaN until known; positions without a price are left out of the
+    totals and get a zero weight.
+    """
+
+    def __init__(self):
+        self.symbols = np.empty(0, dtype=object)
+        self.quantities = np.empty(0, dtype=np.int64)
+        self.avg_costs = np.empty(0, dtype=np.float64)
+        self.prices = np.empty(0, dtype=np.float64)
+        self.index = {}
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def load(self, positions):
+        """Replace the book with (symbol, quantity, avg_cost) rows, keeping known prices"""
+        positions = list(positions)
+        old_prices = dict(zip(self.symbols.tolist(), self.prices.tolist()))
+        self.symbols = np.array([p[0] for p in positions], dtype=object)
+        self.quantities = np.array([p[1] for p in positions], dtype=np.int64)
+        self.avg_costs = np.array([p[2] for p in positions], dtype=np.float64)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols.tolist())}
+        self.prices = np.array([old_prices.get(s, np.nan) for s in self.symbols.tolist()], dtype=np.float64)
+
+    def set_prices(self, prices):
+        """Set last prices from a {symbol: price or None} mapping; unknown symbols are ignored"""
+        rows = []
+        values = []
+        for symbol, price in prices.items():
+            i = self.index.get(symbol)
+            if i is not None:
+                rows.append(i)
+                values.append(np.nan if price is None else price)
+        if rows:
+            self.prices[np.array(rows, dtype=np.intp)] = np.array(values, dtype=np.float64)
+
+    def valuation(self):
+        quantities = self.quantities.astype(np.float64)
+        cost = quantities * self.avg_costs
+        value = quantities * self.prices
+        gain_loss = value - cost
+        priced = ~np.isnan(value)
+        total_value = float(value[priced].sum())
+        weights = np.where(priced, value, 0.0) / total_value if total_value else np.zeros_like(value)
+        return Valuation(
+            symbols=self.symbols,
+            quantities=self.quantities,
+            avg_costs=self.avg_costs,
+            prices=self.prices.copy(),
+            cost=cost,
+            value=value,
+            gain_loss=gain_loss,
+            weights=weights,
+            total_cost=float(cost[priced].sum()),
+            total_value=total_value,
+            total_gain_loss=float(gain_loss[priced].sum()),
+        )
+
+
+AccountTotals = namedtuple('AccountTotals', ['account_id', 'positions', 'total_cost', 'total_value', 'total_gain_loss'])
+
+
+def value_accounts(positions, prices):
+    """Value every account from (account_id, symbol, quantity, avg_cost) rows and one {symbol: price} mapping.
+
+    Each distinct symbol is looked up once however many accounts hold it;
+    positions without a price are left out of the totals, as in valuation().
+    Returns AccountTotals in account order.
+    """
+    positions = list(positions)
+    if not positions:
+        return []
+    accounts, symbols, quantities, avg_costs = zip(*positions)
+    names, by_symbol = np.unique(np.array(symbols, dtype=object), return_inverse=True)
+    table = np.array([np.nan if prices.get(name) is None else prices[name] for name in names.tolist()],
+                     dtype=np.float64)
+    ids, by_account = np.unique(np.array(accounts, dtype=np.int64), return_inverse=True)
+
+    quantities = np.array(quantities, dtype=np.float64)
+    cost = quantities * np.array(avg_costs, dtype=np.float64)
+    value = quantities * table[by_symbol]
+    priced = ~np.isnan(value)
+    counts = np.bincount(by_account, minlength=len(ids))
+    total_cost = np.bincount(by_account[priced], weights=cost[priced], minlength=len(ids))
+    total_value = np.bincount(by_account[priced], weights=value[priced], minlength=len(ids))
+    return [AccountTotals(int(account), int(count), float(c), float(v), float(v - c))
+            for account, count, c, v in zip(ids.tolist(), counts.tolist(), total_cost.tolist(), total_value.tolist())]
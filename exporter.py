@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Streaming export of portfolio data for the Stock Portfolio Tracker
+
+Holdings, lots and price history are written as numbers (not the ₹-formatted
+display strings) to CSV, JSON Lines or Parquet. Rows are read from the
+database with fetchmany() and written one chunk at a time, so memory use
+does not grow with the size of the export. Parquet needs the optional
+pyarrow package.
+"""
+
+import csv
+import json
+import math
+import os
+import sys
+import time
+
+import storage
+from engine import PortfolioEngine
+
+CHUNK_SIZE = 50000
+FORMATS = ('csv', 'jsonl', 'parquet')
+EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.parquet': 'parquet'}
+
+# (column, type) per dataset; types are 'text', 'int' or 'float'
+DATASETS = {
+    'holdings': [('symbol', 'text'), ('quantity', 'int'), ('avg_cost', 'float'), ('price', 'float'),
+                 ('cost', 'float'), ('value', 'float'), ('gain_loss', 'float'), ('weight', 'float')],
+    # a lot partly sold after a split keeps a fractional remainder in its purchase-day shares
+    'lots': [('id', 'int'), ('account_id', 'int'), ('portfolio_id', 'int'), ('symbol', 'text'),
+             ('quantity', 'float'), ('purchase_price', 'float'), ('purchase_date', 'text'), ('import_key', 'text')],
+    'prices': [('symbol', 'text'), ('date', 'text'), ('price', 'float')],
+    'ohlcv': [('symbol', 'text'), ('date', 'text'), ('open', 'float'), ('high', 'float'), ('low', 'float'),
+              ('close', 'float'), ('volume', 'float')],
+}
+
+
+def detect_format(path):
+    """Pick the export format from a file name's extension, defaulting to CSV"""
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'csv')
+
+
+def clean(value):
+    """NaN (an unknown price) is written as an empty/null value"""
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def valuation_chunks(valuation, chunk_size=CHUNK_SIZE):
+    """Yield holdings rows from an engine Valuation, chunk_size at a time"""
+    columns = (valuation.symbols, valuation.quantities, valuation.avg_costs, valuation.prices,
+               valuation.cost, valuation.value, valuation.gain_loss, valuation.weights)
+    for start in range(0, len(valuation.symbols), chunk_size):
+        chunk = [column[start:start + chunk_size].tolist() for column in columns]
+        yield [tuple(clean(value) for value in row) for row in zip(*chunk)]
+
+
+def query_chunks(conn, sql, params=(), chunk_size=CHUNK_SIZE):
+    cursor = conn.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def holdings_chunks(conn, chunk_size=CHUNK_SIZE):
+    """Holdings valued at each symbol's last price in price_history"""
+    engine = PortfolioEngine()
+    engine.load(storage.load_holdings(conn))
+    engine.set_prices({symbol: price for symbol, price, _ in conn.execute(
+        "SELECT symbol, price, MAX(date) FROM price_history GROUP BY symbol")})
+    return valuation_chunks(engine.valuation(), chunk_size)
+
+
+def ohlcv_chunks(store, symbols=None, chunk_size=CHUNK_SIZE):
+    """Yield rows from the columnar history store, one symbol's window at a time"""
+    from history_store import PRICE_FIELDS, from_days
+
+    for symbol in symbols or store.symbols():
+        dates = store.column(symbol, 'date')
+        for start in range(0, len(dates), chunk_size):
+            days = from_days(dates[start:start + chunk_size]).astype(str).tolist()
+            fields = [store.column(symbol, field)[start:start + chunk_size].tolist() for field in PRICE_FIELDS]
+            yield [(symbol, day) + tuple(clean(value) for value in row) for day, *row in zip(days, *fields)]
+
+
+def dataset_chunks(conn, dataset, chunk_size=CHUNK_SIZE, store=None, symbols=None):
+    """Yield row chunks of one of DATASETS, read straight from the database or history store"""
+    if dataset == 'holdings':
+        return holdings_chunks(conn, chunk_size)
+    if dataset == 'lots':
+        return query_chunks(conn, """
+            SELECT id, account_id, portfolio_id, symbol, quantity, purchase_price, purchase_date, import_key
+            FROM portfolio ORDER BY id
+        """, chunk_size=chunk_size)
+    if dataset == 'prices':
+        if symbols:
+            placeholders = ','.join('?' * len(symbols))
+            return query_chunks(conn, f"""
+                SELECT symbol, date, price FROM price_history WHERE symbol IN ({placeholders}) ORDER BY symbol, date
+            """, list(symbols), chunk_size)
+        return query_chunks(conn, "SELECT symbol, date, price FROM price_history ORDER BY symbol, date",
+                            chunk_size=chunk_size)
+    if dataset == 'ohlcv':
+        if store is None:
+            from history_store import HistoryStore
+            store = HistoryStore()
+        return ohlcv_chunks(store, symbols, chunk_size)
+    raise ValueError(f"Unknown dataset {dataset!r}; choose from {', '.join(DATASETS)}")
+
+
+def write_csv(path, columns, chunks):
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, _ in columns])
+        for rows in chunks:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def write_jsonl(path, columns, chunks):
+    names = [name for name, _ in columns]
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for rows in chunks:
+            f.write(''.join(encode(dict(zip(names, row))) + '\n' for row in rows))
+            count += len(rows)
+    return count
+
+
+def write_parquet(path, columns, chunks):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet export needs pyarrow: pip install pyarrow")
+
+    types = {'text': pa.string(), 'int': pa.int64(), 'float': pa.float64()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in chunks:
+            arrays = [pa.array(list(values), type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(rows)
+    return count
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'parquet': write_parquet}
+
+
+def write_rows(path, columns, chunks, fmt=None):
+    """Write row chunks to path in fmt (from the extension if None); returns the number of rows"""
+    fmt = fmt or detect_format(path)
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown format {fmt!r}; choose from {', '.join(FORMATS)}")
+    return WRITERS[fmt](path, columns, chunks)
+
+
+def export(conn, dataset, path, fmt=None, chunk_size=CHUNK_SIZE, store=None, symbols=None):
+    """Export a dataset from the database (or history store) to path; returns the number of rows"""
+    chunks = dataset_chunks(conn, dataset, chunk_size, store, symbols)
+    return write_rows(path, DATASETS[dataset], chunks, fmt)
+
+
+def export_valuation(valuation, path, fmt=None, chunk_size=CHUNK_SIZE):
+    """Export the engine's current holdings, priced as shown in the app"""
+    return write_rows(path, DATASETS['holdings'], valuation_chunks(valuation, chunk_size), fmt)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export portfolio data to CSV, JSON Lines or Parquet")
+    parser.add_argument('dataset', choices=list(DATASETS))
+    parser.add_argument('output', help="output file; the format follows the extension unless --format is given")
+    parser.add_argument('symbols', nargs='*', help="limit prices/ohlcv to these symbols")
+    parser.add_argument('--format', choices=FORMATS)
+    parser.add_argument('--db', default=storage.DB_PATH)
+    parser.add_argument('--history', default=None, help="history store directory for ohlcv")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_intermixed_args()
+
+    store = None
+    if args.history:
+        from history_store import HistoryStore
+        store = HistoryStore(args.history)
+
+    start = time.perf_counter()
+    conn = storage.connect(args.db)
+    try:
+        count = export(conn, args.dataset, args.output, args.format, args.chunk_size, store, args.symbols)
+    except (OSError, ValueError) as e:
+        print(f"❌ Export failed: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+    print(f"📤 Exported {count:,} {args.dataset} rows to {args.output} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Currency conversion for the Stock Portfolio Tracker
+"""
+
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+# Yahoo quotes some exchanges in minor units (pence, cents)
+MINOR_UNITS = {
+    'GBp': ('GBP', 0.01),
+    'GBX': ('GBP', 0.01),
+    'ZAc': ('ZAR', 0.01),
+    'ILA': ('ILS', 0.01),
+}
+
+
+class FxRates:
+    """Caches conversion rates into the base currency, fetching each pair once per TTL"""
+
+    def __init__(self, provider, base='INR', ttl=300.0):
+        self.provider = provider
+        self.base = base
+        self.ttl = ttl
+        self.rates = {}  # currency -> (rate, fetched_at)
+        self.lock = threading.Lock()
+
+    def pair_symbol(self, currency):
+        return f"{currency}{self.base}=X"
+
+    def get_rates(self, currencies, fetch=True):
+        """Return {currency: rate into base}, None where no rate is available.
+
+        With fetch=False only cached rates are used, so the call never blocks on the network.
+        """
+        now = time.monotonic()
+        wanted = {}
+        for currency in set(currencies):
+            major, factor = MINOR_UNITS.get(currency, (currency, 1.0))
+            wanted[currency] = (major, factor)
+
+        with self.lock:
+            stale = {major for major, _ in wanted.values()
+                     if major != self.base and (major not in self.rates or now - self.rates[major][1] > self.ttl)}
+
+        if stale and fetch:
+            pairs = {self.pair_symbol(currency): currency for currency in stale}
+            quotes = self.provider.get_quotes(list(pairs))
+            with self.lock:
+                for pair, currency in pairs.items():
+                    quote = quotes.get(pair)
+                    if quote is not None and quote.price:
+                        self.rates[currency] = (quote.price, now)
+                    else:
+                        metrics.log('warning', 'fx_rate', f"⚠️ Unable to fetch {currency} to {self.base} rate",
+                                    currency=currency)
+
+        rates = {}
+        with self.lock:
+            for currency, (major, factor) in wanted.items():
+                if major == self.base:
+                    rates[currency] = factor
+                elif major in self.rates:
+                    rates[currency] = self.rates[major][0] * factor
+                else:
+                    rates[currency] = None
+        return rates
+
+    def convert(self, prices, currencies, fetch=True):
+        """Convert parallel sequences of prices and currency codes into the base currency.
+
+        Returns a float array; entries with no price or no rate are NaN.
+        """
+        prices = np.array([np.nan if p is None else p for p in prices], dtype=float)
+        if not len(prices):
+            return prices
+        codes, inverse = np.unique(np.asarray(currencies, dtype=object).astype(str), return_inverse=True)
+        rates = self.get_rates(codes.tolist(), fetch=fetch)
+        table = np.array([np.nan if rates[code] is None else rates[code] for code in codes], dtype=float)
+        return np.round(prices * table[inverse], 2)
+
+    def symbol_rates(self, quotes, fetch=False):
+        """{symbol: rate into base} from each Quote's currency, e.g. for HistoryStore closes; NaN if no rate yet.
+
+        Symbols without a quote are left out.
+        """
+        quotes = {symbol: quote for symbol, quote in quotes.items() if quote is not None}
+        rates = self.get_rates({quote.currency for quote in quotes.values()}, fetch=fetch)
+        return {symbol: np.nan if rates[quote.currency] is None else rates[quote.currency]
+                for symbol, quote in quotes.items()}
+
+    def fetch_symbol_rates(self, symbols):
+        """symbol_rates() from freshly fetched quotes, NaN where the quote or rate can't be had.
+
+        Cached quotes won't do: those warmed from price_history carry INR
+        prices, not the symbol's own currency.
+        """
+        quotes = self.provider.get_quotes(list(symbols))
+        rates = self.symbol_rates(quotes, fetch=True)
+        return {symbol: rates.get(symbol, np.nan) for symbol in symbols}
+
+    def convert_quotes(self, quotes, fetch=True):
+        """Convert a {symbol: Quote or None} mapping to {symbol: base price or None}"""
+        symbols = list(quotes)
+        prices = [quotes[s].price if quotes[s] is not None else None for s in symbols]
+        currencies = [quotes[s].currency if quotes[s] is not None else self.base for s in symbols]
+        with metrics.span('fx'):
+            converted = self.convert(prices, currencies, fetch=fetch)
+        return {symbol: (None if np.isnan(price) else float(price)) for symbol, price in zip(symbols, converted)}
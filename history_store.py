@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Columnar daily OHLCV store for the Stock Portfolio Tracker
+
+Each symbol gets a directory holding one append-only binary file per
+column (dates as int32 days since 1970-01-01, prices and volume as
+float64). Reads memory-map the files, so a date range of one column is a
+zero-copy view found by binary search, and an N-symbol close matrix costs
+only the size of the result, not a scan of the whole history. The date
+column is written last on every append, so its length is the number of
+complete rows even if a write was interrupted.
+
+Prices are stored in each symbol's quote currency. Yahoo split-adjusts a
+symbol's whole history as of the day it is fetched, so a fetched column
+records that day for every bar: a split or bonus recorded later still has
+to be applied to the bars fetched before it.
+"""
+
+import os
+import threading
+from datetime import date
+
+import numpy as np
+
+HISTORY_DIR = 'history'
+PRICE_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+FIELDS = ('date',) + PRICE_FIELDS + ('fetched',)
+DTYPES = {'date': np.dtype('<i4'), 'fetched': np.dtype('<i4'), **{field: np.dtype('<f8') for field in PRICE_FIELDS}}
+
+
+def to_days(dates):
+    """Convert dates (strings or datetime64) to int32 days since the epoch"""
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64).astype(np.int32)
+
+
+def from_days(days):
+    return np.asarray(days).astype('datetime64[D]')
+
+
+class HistoryStore:
+    def __init__(self, root=HISTORY_DIR):
+        self.root = root
+        self.maps = {}  # (symbol, field) -> (rows, memmap)
+        self.lock = threading.Lock()
+
+    def path(self, symbol, field):
+        return os.path.join(self.root, symbol.replace(os.sep, '_'), f"{field}.bin")
+
+    def symbols(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def __len__(self):
+        return len(self.symbols())
+
+    def rows(self, symbol):
+        """Number of complete rows stored for symbol"""
+        try:
+            return os.path.getsize(self.path(symbol, 'date')) // DTYPES['date'].itemsize
+        except OSError:
+            return 0
+
+    def column(self, symbol, field='close'):
+        """Return the whole column as a read-only memory-mapped array (empty if nothing is stored)"""
+        rows = self.rows(symbol)
+        if rows == 0:
+            return np.empty(0, dtype=DTYPES[field])
+        if field == 'fetched' and self.fetched_rows(symbol) < rows:
+            return self.legacy_fetched(symbol, rows)
+        key = (symbol, field)
+        with self.lock:
+            cached = self.maps.get(key)
+            if cached is None or cached[0] != rows:
+                cached = (rows, np.memmap(self.path(symbol, field), dtype=DTYPES[field], mode='r', shape=(rows,)))
+                self.maps[key] = cached
+        return cached[1]
+
+    def fetched_rows(self, symbol):
+        try:
+            return os.path.getsize(self.path(symbol, 'fetched')) // DTYPES['fetched'].itemsize
+        except OSError:
+            return 0
+
+    def legacy_fetched(self, symbol, rows):
+        """Fetch days for a store written before they were recorded: its last date, the earliest they could be"""
+        last = np.fromfile(self.path(symbol, 'date'), dtype=DTYPES['date'], count=1,
+                           offset=(rows - 1) * DTYPES['date'].itemsize)[0]
+        fetched = np.full(rows, last, dtype=DTYPES['fetched'])
+        known = min(self.fetched_rows(symbol), rows)
+        if known:
+            fetched[:known] = np.fromfile(self.path(symbol, 'fetched'), dtype=DTYPES['fetched'], count=known)
+        return fetched
+
+    def last_date(self, symbol):
+        dates = self.column(symbol, 'date')
+        return from_days(dates[-1]) if len(dates) else None
+
+    def window(self, symbol, start=None, end=None, field='close'):
+        """Return (dates, values) views for start <= date <= end, located by binary search"""
+        dates = self.column(symbol, 'date')
+        lo = np.searchsorted(dates, to_days(start)) if start is not None else 0
+        hi = np.searchsorted(dates, to_days(end), side='right') if end is not None else len(dates)
+        return from_days(dates[lo:hi]), self.column(symbol, field)[lo:hi]
+
+    def matrix(self, symbols, start=None, end=None, field='close'):
+        """Return (dates, values) where values[i, j] is symbols[j]'s field on dates[i].
+
+        Dates are the union of the symbols' trading days in the range; days a
+        symbol did not trade are NaN.
+        """
+        windows = []
+        for symbol in symbols:
+            dates = self.column(symbol, 'date')
+            lo = np.searchsorted(dates, to_days(start)) if start is not None else 0
+            hi = np.searchsorted(dates, to_days(end), side='right') if end is not None else len(dates)
+            windows.append((dates[lo:hi], self.column(symbol, field)[lo:hi]))
+
+        days = np.unique(np.concatenate([dates for dates, _ in windows])) if windows else np.empty(0, np.int32)
+        values = np.full((len(days), len(windows)), np.nan)
+        for j, (dates, column) in enumerate(windows):
+            if len(dates) == len(days):
+                values[:, j] = column
+            elif len(dates):
+                values[np.searchsorted(days, dates), j] = column
+        return from_days(days), values
+
+    def append(self, symbol, history, fetched=None):
+        """Append a History's bars newer than the last stored date.
+
+        A bar for the last stored date replaces it (today's bar updates until
+        the close). fetched is the day the bars were fetched, today by
+        default. Returns the number of rows added.
+        """
+        days = to_days(history.dates)
+        if not len(days):
+            return 0
+        order = np.argsort(days, kind='stable')
+        days = days[order]
+        columns = {field: np.asarray(getattr(history, field), dtype=DTYPES[field])[order] for field in PRICE_FIELDS}
+        columns['fetched'] = np.full(len(days), to_days(fetched or date.today().isoformat()), dtype=DTYPES['fetched'])
+        fields = PRICE_FIELDS + ('fetched',)
+
+        os.makedirs(os.path.dirname(self.path(symbol, 'date')), exist_ok=True)
+        with self.lock:
+            existing = self.rows(symbol)
+            if existing and self.fetched_rows(symbol) < existing:
+                with open(self.path(symbol, 'fetched'), 'wb') as f:
+                    f.write(self.legacy_fetched(symbol, existing).tobytes())
+            last = None
+            if existing:
+                with open(self.path(symbol, 'date'), 'rb') as f:
+                    f.seek((existing - 1) * DTYPES['date'].itemsize)
+                    last = int(np.frombuffer(f.read(DTYPES['date'].itemsize), dtype=DTYPES['date'])[0])
+
+            if last is not None:
+                same = np.flatnonzero(days == last)
+                if len(same):
+                    # Overwrite the last row in place; the date itself is unchanged
+                    i = same[-1]
+                    for field in fields:
+                        with open(self.path(symbol, field), 'r+b') as f:
+                            f.seek((existing - 1) * DTYPES[field].itemsize)
+                            f.write(columns[field][i:i + 1].tobytes())
+                newer = days > last
+            else:
+                newer = np.ones(len(days), dtype=bool)
+
+            # Drop duplicate dates within the new bars, keeping the last one of each
+            keep = newer & np.append(days[1:] != days[:-1], True)
+            if not keep.any():
+                return 0
+
+            for field in fields:
+                with open(self.path(symbol, field), 'ab') as f:
+                    f.truncate(existing * DTYPES[field].itemsize)
+                    f.write(columns[field][keep].tobytes())
+            with open(self.path(symbol, 'date'), 'ab') as f:
+                f.write(days[keep].tobytes())
+            return int(keep.sum())
+
+    def backfill(self, symbols, provider, progress=None):
+        """Fetch and append missing daily bars for each symbol, from its last stored date onwards.
+
+        Symbols with no history are fetched in full. Returns {symbol: rows added}.
+        """
+        starts = {}
+        for symbol in symbols:
+            last = self.last_date(symbol)
+            starts[symbol] = str(last) if last is not None else None
+        added = {}
+        for symbol, history in provider.get_histories(starts).items():
+            added[symbol] = self.append(symbol, history) if history is not None and len(history.dates) else 0
+            if progress:
+                progress(symbol, added[symbol])
+        return added
+
+
+def main():
+    import argparse
+
+    import storage
+
+    parser = argparse.ArgumentParser(description="Backfill and query the daily OHLCV history store")
+    parser.add_argument('command', choices=['backfill', 'info'])
+    parser.add_argument('symbols', nargs='*', help="defaults to every held symbol")
+    parser.add_argument('--db', default=storage.DB_PATH)
+    parser.add_argument('--dir', default=HISTORY_DIR)
+    args = parser.parse_args()
+
+    store = HistoryStore(args.dir)
+    symbols = args.symbols
+    if not symbols:
+        conn = storage.connect(args.db)
+        symbols = [symbol for symbol, _, _ in storage.load_holdings(conn)]
+        conn.close()
+
+    if args.command == 'backfill':
+        from quotes import YFinanceProvider
+
+        print(f"📈 Backfilling {len(symbols)} symbols into {args.dir}/...")
+        added = store.backfill(symbols, YFinanceProvider(),
+                               progress=lambda symbol, rows: print(f"   {symbol}: +{rows} days"))
+        print(f"✅ Added {sum(added.values())} daily bars")
+    else:
+        for symbol in symbols:
+            dates = store.column(symbol, 'date')
+            if len(dates):
+                print(f"{symbol}: {len(dates)} days, {from_days(dates[0])} to {from_days(dates[-1])}")
+            else:
+                print(f"{symbol}: no history")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Bulk import of trades from broker CSV exports into the Stock Portfolio Tracker
+
+Files are streamed row by row and buys are written in large batched
+transactions, so memory use stays flat however big the file is. Sells are
+held back until every buy is in, then recorded in date order through
+LotBook.sell(), matched FIFO. Each imported lot and sale gets an import_key
+(the broker's trade id, or the row's contents and how many identical rows
+came before it in the file), which makes re-importing the same file, or an
+overlapping or re-sorted export of it, a no-op.
+"""
+
+import csv
+import itertools
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+
+import storage
+from ledger import LotBook
+from lots import parse_amounts
+from symbols import load_symbols, normalize_symbol
+
+BATCH_SIZE = 50000
+MAX_ERRORS = 20
+
+# Accepted header names per field, after lower-casing and replacing spaces with underscores
+COLUMN_ALIASES = {
+    'symbol': ('symbol', 'tradingsymbol', 'trading_symbol', 'scrip', 'scrip_name', 'ticker', 'stock'),
+    'quantity': ('quantity', 'qty', 'shares', 'trade_quantity'),
+    'price': ('price', 'trade_price', 'rate', 'purchase_price', 'avg_price', 'average_price'),
+    'date': ('date', 'trade_date', 'purchase_date', 'order_execution_time', 'execution_time'),
+    'trade_id': ('trade_id', 'tradeid', 'trade_no', 'trade_number'),
+    'side': ('trade_type', 'side', 'type', 'buy_sell', 'buy/sell', 'transaction_type'),
+}
+REQUIRED = ('symbol', 'quantity', 'price', 'date')
+DATE_FORMATS = ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y', '%Y/%m/%d', '%d-%b-%Y', '%d %b %Y', '%d-%b-%y')
+
+ImportResult = namedtuple('ImportResult', ['rows', 'imported', 'sold', 'duplicates', 'invalid', 'seconds', 'errors'])
+
+
+def find_columns(header):
+    """Map each field to its column index in header, raising ValueError if a required one is missing"""
+    names = [name.strip().lower().replace(' ', '_') for name in header]
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in names:
+                columns[field] = names.index(alias)
+                break
+    missing = [field for field in REQUIRED if field not in columns]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+    return columns
+
+
+@lru_cache(maxsize=10000)
+def parse_date(value):
+    """Parse a trade date into YYYY-MM-DD, accepting common broker formats and trailing times"""
+    value = value.strip()
+    parsed = None
+    for candidate in (value, value[:10], value.split(' ')[0]):
+        for fmt in DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(candidate, fmt).strftime('%Y-%m-%d')
+                break
+            except ValueError:
+                continue
+        if parsed:
+            break
+    if parsed is None:
+        raise ValueError(f"Unrecognised date {value!r}")
+    return parsed
+
+
+def record_error(counts, errors, line_no, error):
+    counts['invalid'] += 1
+    if len(errors) < MAX_ERRORS:
+        errors.append(f"line {line_no}: {error}")
+
+
+def iter_lots(reader, columns, universe, counts, errors, sells):
+    """Yield portfolio rows from buy rows, counting and recording the ones rejected.
+
+    Sell rows are appended to sells as (date, line, symbol, quantity, price, import_key).
+    """
+    symbol_col = columns['symbol']
+    quantity_col = columns['quantity']
+    price_col = columns['price']
+    date_col = columns['date']
+    trade_id_col = columns.get('trade_id')
+    side_col = columns.get('side')
+    symbols = {}  # raw symbol -> normalized symbol, or None if rejected
+    seen = {}  # contents of rows without a trade id -> how many times they have occurred
+
+    for line_no, row in enumerate(reader, start=2):
+        if not row:
+            continue
+        counts['rows'] += 1
+        try:
+            sell = side_col is not None and row[side_col].strip().lower() in ('sell', 's')
+            raw_symbol = row[symbol_col]
+            if raw_symbol not in symbols:
+                symbol = normalize_symbol(raw_symbol)
+                symbols[raw_symbol] = symbol if symbol and (universe is None or symbol in universe) else None
+            symbol = symbols[raw_symbol]
+            if symbol is None:
+                raise ValueError(f"Unknown symbol {raw_symbol!r}")
+            quantity, price = parse_amounts(row[quantity_col], row[price_col])
+            date = parse_date(row[date_col])
+            trade_id = row[trade_id_col].strip() if trade_id_col is not None else ''
+            if trade_id:
+                key = f"trade:{trade_id}"
+            else:
+                # The n-th identical trade in a file, not its position, so shifted rows keep their key
+                contents = f"{'sell|' if sell else ''}{symbol}|{date}|{quantity}|{price}"
+                seen[contents] = occurrence = seen.get(contents, 0) + 1
+                key = f"row:{contents}|{occurrence}"
+        except (ValueError, IndexError) as e:
+            record_error(counts, errors, line_no, e)
+            continue
+        if sell:
+            sells.append((date, line_no, symbol, quantity, price, key))
+            continue
+        yield symbol, quantity, price, date, key
+
+
+def record_sales(conn, sells, portfolio_id, counts, errors):
+    """Record sells in date order, skipping those already imported; returns how many were recorded"""
+    book = LotBook()
+    sold = 0
+    for date, line_no, symbol, quantity, price, key in sorted(sells):
+        if conn.execute("SELECT 1 FROM sales WHERE portfolio_id = ? AND import_key = ?",
+                        (portfolio_id, key)).fetchone():
+            continue
+        try:
+            book.sell(conn, symbol, quantity, price, date, portfolio_id, import_key=key)
+        except ValueError as e:
+            record_error(counts, errors, line_no, e)
+            continue
+        sold += 1
+    return sold
+
+
+def import_trades(path, db_path=storage.DB_PATH, validate=True, batch_size=BATCH_SIZE, progress=None,
+                  portfolio_id=storage.DEFAULT_PORTFOLIO):
+    """Import buy and sell trades from a CSV file into a portfolio.
+
+    Symbols are normalized like the Add Stock form and, with validate=True,
+    must appear in the exchange symbol list. A sell of more shares than the
+    portfolio held on its date is rejected like an invalid row.
+    progress(rows_read) is called after every batch. Returns an ImportResult.
+    """
+    start = time.perf_counter()
+    universe = {symbol for symbol, _ in load_symbols()} if validate else None
+    counts = {'rows': 0, 'invalid': 0}
+    errors = []
+    sells = []
+    imported = 0
+
+    conn = storage.connect(db_path)
+    try:
+        with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            columns = find_columns(next(reader, []))
+            lots = iter_lots(reader, columns, universe, counts, errors, sells)
+            while True:
+                batch = list(itertools.islice(lots, batch_size))
+                if not batch:
+                    break
+                imported += storage.bulk_insert_lots(conn, batch, portfolio_id)
+                if progress:
+                    progress(counts['rows'])
+        sold = record_sales(conn, sells, portfolio_id, counts, errors)
+    finally:
+        conn.close()
+
+    valid = counts['rows'] - counts['invalid']
+    return ImportResult(
+        rows=counts['rows'],
+        imported=imported,
+        sold=sold,
+        duplicates=valid - imported - sold,
+        invalid=counts['invalid'],
+        seconds=time.perf_counter() - start,
+        errors=errors,
+    )
+
+
+def format_result(result):
+    rate = result.rows / result.seconds if result.seconds else 0
+    return (f"Imported {result.imported} buys and {result.sold} sells of {result.rows} rows in {result.seconds:.2f}s "
+            f"({rate:,.0f} rows/s); {result.duplicates} duplicates, {result.invalid} invalid")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import trades from broker CSV exports")
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--db', default=storage.DB_PATH)
+    parser.add_argument('--no-validate', action='store_true', help="accept symbols missing from nse_symbols.csv")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--portfolio', type=int, default=storage.DEFAULT_PORTFOLIO, help="portfolio id to import into")
+    args = parser.parse_args()
+
+    ok = True
+    for path in args.files:
+        print(f"📥 Importing {path}...")
+        try:
+            result = import_trades(path, args.db, validate=not args.no_validate, batch_size=args.batch_size,
+                                   portfolio_id=args.portfolio,
+                                   progress=lambda rows: print(f"   {rows:,} rows read", end='\r'))
+        except (OSError, ValueError) as e:
+            print(f"❌ {path}: {e}")
+            ok = False
+            continue
+        print(f"✅ {format_result(result)}")
+        for error in result.errors:
+            print(f"   ⚠️ {error}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Buy and sell lot matching for the Stock Portfolio Tracker
+
+Lots in the portfolio table are the open part of each buy. A sale is
+matched against a portfolio's open lots of the symbol, oldest first (FIFO)
+or against lots picked by id, and each match is recorded in lot_matches
+with its cost and holding period. Lots are then reduced, or removed once
+fully sold, so holdings keep showing open positions only. Realized P&L is
+summed from the matches; unrealized P&L comes from the open lots, split
+into short and long term by purchase date.
+
+LotBook keeps each (portfolio, symbol) queue of open lots in memory, loaded
+on first use and updated in place as trades are recorded, so a sale or a
+revaluation never replays the trade history. A queue is checked against
+the holdings row (maintained by triggers) before every sale and reloaded
+if lots were changed elsewhere, e.g. by an import or the API.
+
+Lots keep the quantity and price they were bought at. For a symbol that
+has since split or issued bonus shares, a sale is matched in the share
+basis of its sale date: each lot is scaled by the ratio of its cumulative
+factor (see corporate_actions) to the sale date's, the matches are stored
+in sale-date shares, and a partly sold lot keeps the remainder in its own
+purchase-day shares, which can then be fractional.
+"""
+
+import bisect
+import sqlite3
+from collections import namedtuple
+from datetime import date, timedelta
+
+import numpy as np
+
+import storage
+from corporate_actions import Adjustments, dividend_income, to_days
+from lots import parse_amounts
+from symbols import normalize_symbol
+
+LONG_TERM_DAYS = 365  # listed shares held for more than 12 months are long-term
+COMPACT_AFTER = 1024  # sold-out lots dropped from the front of a queue before it is compacted
+SHARE_EPSILON = 1e-9  # smaller remainders of a split-adjusted lot count as sold out
+
+Match = namedtuple('Match', ['lot_id', 'quantity', 'purchase_price', 'purchase_date', 'long_term'])
+Sale = namedtuple('Sale', ['id', 'portfolio_id', 'symbol', 'quantity', 'price', 'sale_date', 'method', 'matches',
+                           'short_term', 'long_term'])
+Realized = namedtuple('Realized', ['symbol', 'quantity', 'proceeds', 'cost', 'short_term', 'long_term'])
+Unrealized = namedtuple('Unrealized', ['symbol', 'quantity', 'cost', 'value', 'short_term', 'long_term'])
+
+
+def is_long_term(purchase_date, sale_date):
+    """Whether a lot bought on purchase_date and sold on sale_date (YYYY-MM-DD) was held long-term"""
+    return (date.fromisoformat(sale_date) - date.fromisoformat(purchase_date)).days > LONG_TERM_DAYS
+
+
+def long_term_cutoff(today=None):
+    """Lots bought on or before this date (YYYY-MM-DD) are long-term today"""
+    return ((today or date.today()) - timedelta(days=LONG_TERM_DAYS + 1)).isoformat()
+
+
+def portion(lot, remaining, ratio):
+    """(lot, purchase-day shares taken, sale-day shares taken) for selling up to remaining from lot"""
+    if ratio == 1:
+        take = min(lot[2], remaining)
+        return lot, take, take
+    held = lot[2] * ratio
+    if held <= remaining + SHARE_EPSILON:
+        return lot, lot[2], held
+    return lot, remaining / ratio, remaining
+
+
+class LotQueue:
+    """One portfolio's open lots of one symbol, ordered by purchase date then id"""
+
+    def __init__(self, rows=()):
+        # Each lot is [purchase_date, id, quantity, price]; sold-out lots are skipped until compacted away
+        self.lots = [[day, lot_id, quantity, price] for lot_id, quantity, price, day in rows]
+        self.lots.sort()
+        self.head = 0
+        self.by_id = {lot[1]: lot for lot in self.lots}
+        self.quantity = sum(lot[2] for lot in self.lots)
+        self.cost = sum(lot[2] * lot[3] for lot in self.lots)
+        self.long_cache = None  # (cutoff, quantity, cost) of the lots that are long-term at cutoff
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def open_lots(self):
+        """(id, quantity, price, purchase_date) of each open lot, oldest first"""
+        return [(lot[1], lot[2], lot[3], lot[0]) for lot in self.lots[self.head:] if lot[2] > 0]
+
+    def add(self, lot_id, quantity, price, purchase_date):
+        lot = [purchase_date, lot_id, quantity, price]
+        if self.head == len(self.lots) or lot > self.lots[-1]:
+            self.lots.append(lot)
+        else:
+            bisect.insort(self.lots, lot, lo=self.head)  # a back-dated buy
+        self.by_id[lot_id] = lot
+        self.quantity += quantity
+        self.cost += quantity * price
+        self.long_cache = None
+
+    def plan_fifo(self, quantity, sale_date, ratio=None):
+        """[(lot, quantity taken, sale-day shares)] for selling quantity from the oldest lots bought by sale_date.
+
+        ratio(lot) is the number of sale-day shares per share of the lot, for
+        a symbol that split or issued bonus shares in between.
+        """
+        plan = []
+        remaining = quantity
+        lots = self.lots
+        for i in range(self.head, len(lots)):
+            lot = lots[i]
+            if remaining <= SHARE_EPSILON or lot[0] > sale_date:
+                break
+            if lot[2] > 0:
+                plan.append(portion(lot, remaining, ratio(lot) if ratio else 1))
+                remaining -= plan[-1][2]
+        if remaining > SHARE_EPSILON:
+            raise ValueError(f"Only {quantity - remaining:g} shares were held on {sale_date}; cannot sell {quantity}")
+        return plan
+
+    def plan_specific(self, lot_ids, quantity, sale_date, ratio=None):
+        """plan_fifo() for selling quantity from the given lots, in the order given"""
+        if len(set(lot_ids)) != len(lot_ids):
+            raise ValueError("Each lot can only be listed once")
+        plan = []
+        remaining = quantity
+        for lot_id in lot_ids:
+            lot = self.by_id.get(lot_id)
+            if lot is None:
+                raise ValueError(f"Lot {lot_id} is not an open lot of this holding")
+            if lot[0] > sale_date:
+                raise ValueError(f"Lot {lot_id} was bought on {lot[0]}, after the sale")
+            if remaining <= SHARE_EPSILON:
+                break
+            plan.append(portion(lot, remaining, ratio(lot) if ratio else 1))
+            remaining -= plan[-1][2]
+        if remaining > SHARE_EPSILON:
+            raise ValueError(f"The chosen lots hold {quantity - remaining:g} shares; cannot sell {quantity}")
+        return plan
+
+    def apply(self, plan):
+        """Take the planned quantities out of their lots"""
+        for lot, take, _ in plan:
+            if take == lot[2]:
+                lot[2] = 0
+                del self.by_id[lot[1]]
+            else:
+                lot[2] -= take
+            self.quantity -= take
+            self.cost -= take * lot[3]
+        while self.head < len(self.lots) and self.lots[self.head][2] == 0:
+            self.head += 1
+        if self.head >= COMPACT_AFTER and self.head * 2 >= len(self.lots):
+            self.lots = [lot for lot in self.lots[self.head:] if lot[2] > 0]
+            self.head = 0
+        if not self.by_id:
+            self.quantity = 0
+            self.cost = 0.0  # no rounding residue on a closed position
+        self.long_cache = None
+
+    def long_term(self, cutoff):
+        """(quantity, cost) of the open lots bought on or before cutoff; cached until the queue changes"""
+        if self.long_cache is None or self.long_cache[0] != cutoff:
+            quantity = 0
+            cost = 0.0
+            lots = self.lots
+            for i in range(self.head, len(lots)):
+                lot = lots[i]
+                if lot[0] > cutoff:
+                    break
+                quantity += lot[2]
+                cost += lot[2] * lot[3]
+            self.long_cache = (cutoff, quantity, cost)
+        return self.long_cache[1:]
+
+    def unrealized(self, price, cutoff):
+        """(short-term, long-term) unrealized gain at price"""
+        long_quantity, long_cost = self.long_term(cutoff)
+        long_gain = long_quantity * price - long_cost
+        return (self.quantity - long_quantity) * price - (self.cost - long_cost), long_gain
+
+    def adjusted(self, price, cutoff, factors):
+        """(quantity, cost, short-term, long-term gain) with each open lot scaled by its factor in factors(days)"""
+        lots = self.open_lots()
+        if not lots:
+            return 0, 0.0, 0.0, 0.0
+        _, quantities, prices, days = zip(*lots)
+        quantities = np.array(quantities, dtype=np.float64)
+        shares = quantities * factors(days)
+        costs = quantities * np.array(prices, dtype=np.float64)
+        long = to_days(days) <= np.datetime64(cutoff)
+        long_gain = float(shares[long].sum()) * price - float(costs[long].sum())
+        short_gain = float(shares[~long].sum()) * price - float(costs[~long].sum())
+        return round(float(shares.sum()), 6), float(costs.sum()), short_gain, long_gain
+
+
+def stale(queue, totals):
+    """Whether a queue no longer matches its holdings row's (quantity, lots)"""
+    quantity, lots = totals
+    return len(queue) != lots or abs(queue.quantity - quantity) > 1e-6
+
+
+class LotBook:
+    """Open-lot queues per (portfolio_id, symbol), loaded lazily and kept up to date by buy() and sell()"""
+
+    def __init__(self):
+        self.queues = {}
+
+    def clear(self):
+        self.queues.clear()
+
+    def invalidate(self, portfolio_id=None, symbol=None):
+        """Forget queues whose lots were changed elsewhere; they are reloaded when next needed"""
+        if portfolio_id is None and symbol is None:
+            self.queues.clear()
+            return
+        for key in [key for key in self.queues
+                    if portfolio_id in (None, key[0]) and symbol in (None, key[1])]:
+            del self.queues[key]
+
+    def queue(self, conn, portfolio_id, symbol):
+        key = (portfolio_id, symbol)
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = LotQueue(conn.execute("""
+                SELECT id, quantity, purchase_price, purchase_date FROM portfolio
+                WHERE portfolio_id = ? AND symbol = ?
+            """, (portfolio_id, symbol)))
+        return queue
+
+    def load(self, conn, account_id=None, portfolio_id=None):
+        """The open-lot queues of a scope, {(portfolio_id, symbol): LotQueue}.
+
+        Queues already loaded are checked against the holdings rows, and only
+        missing or out-of-date ones are read from the lots, in one query.
+        """
+        if portfolio_id is not None:
+            where, args = "WHERE portfolio_id = ?", (portfolio_id,)
+        elif account_id is not None:
+            where, args = "WHERE account_id = ?", (account_id,)
+        else:
+            where, args = "", ()
+        scope = {(pid, symbol): (quantity, lots) for pid, symbol, quantity, lots in conn.execute(
+            f"SELECT portfolio_id, symbol, quantity, lots FROM holdings {where}", args)}
+        needed = set()
+        for key, totals in scope.items():
+            queue = self.queues.get(key)
+            if queue is None or stale(queue, totals):
+                needed.add(key)
+        if needed:
+            rows = {key: [] for key in needed}
+            for pid, symbol, lot_id, quantity, price, day in conn.execute(f"""
+                SELECT portfolio_id, symbol, id, quantity, purchase_price, purchase_date FROM portfolio {where}
+            """, args):
+                lots = rows.get((pid, symbol))
+                if lots is not None:
+                    lots.append((lot_id, quantity, price, day))
+            for key, lots in rows.items():
+                self.queues[key] = LotQueue(lots)
+        return {key: self.queues[key] for key in scope}
+
+    def check(self, conn, portfolio_id, symbol):
+        """The queue for a sale, reloaded first if its lots no longer match the holdings row"""
+        queue = self.queue(conn, portfolio_id, symbol)
+        row = conn.execute("SELECT quantity, lots FROM holdings WHERE portfolio_id = ? AND symbol = ?",
+                           (portfolio_id, symbol)).fetchone()
+        if stale(queue, row or (0, 0)):
+            self.invalidate(portfolio_id, symbol)
+            queue = self.queue(conn, portfolio_id, symbol)
+        return queue
+
+    def buy(self, conn, symbol, quantity, price, purchase_date, portfolio_id=storage.DEFAULT_PORTFOLIO):
+        """Record a buy as a new open lot and commit; returns its id"""
+        with conn:
+            lot_id = storage.insert_lot(conn, symbol, quantity, price, purchase_date, portfolio_id)
+        queue = self.queues.get((portfolio_id, symbol))
+        if queue is not None:
+            queue.add(lot_id, quantity, price, purchase_date)
+        return lot_id
+
+    def sell(self, conn, symbol, quantity, price, sale_date, portfolio_id=storage.DEFAULT_PORTFOLIO, lot_ids=None,
+             import_key=None):
+        """Record a sale matched FIFO, or against lot_ids in order, and commit; returns the Sale.
+
+        quantity is in sale_date's share basis. Raises ValueError if the
+        portfolio didn't hold enough shares on sale_date. import_key, as for
+        lots, must be unique within the portfolio.
+        """
+        account_id = storage.portfolio_account(conn, portfolio_id)
+        method = 'specific' if lot_ids else 'fifo'
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            queue = self.check(conn, portfolio_id, symbol)
+            ratio = None
+            adjustments = Adjustments.load(conn, [symbol])
+            if symbol in adjustments:
+                sale_factor = adjustments.factor(symbol, sale_date)
+                ratio = lambda lot: adjustments.factor(symbol, lot[0]) / sale_factor
+            if lot_ids:
+                plan = queue.plan_specific(lot_ids, quantity, sale_date, ratio)
+            else:
+                plan = queue.plan_fifo(quantity, sale_date, ratio)
+            sale_id = conn.execute("""
+                INSERT INTO sales (portfolio_id, account_id, symbol, quantity, price, sale_date, method, import_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (portfolio_id, account_id, symbol, quantity, price, sale_date, method, import_key)).lastrowid
+            matches = [Match(lot[1], shares, lot[3] if take == shares else lot[3] * take / shares, lot[0],
+                             is_long_term(lot[0], sale_date))
+                       for lot, take, shares in plan]
+            conn.executemany("""
+                INSERT INTO lot_matches (sale_id, lot_id, quantity, purchase_price, purchase_date, long_term)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [(sale_id, m.lot_id, m.quantity, m.purchase_price, m.purchase_date, int(m.long_term))
+                  for m in matches])
+            conn.executemany("DELETE FROM portfolio WHERE id = ?",
+                             [(lot[1],) for lot, take, _ in plan if take == lot[2]])
+            conn.executemany("UPDATE portfolio SET quantity = quantity - ? WHERE id = ?",
+                             [(take, lot[1]) for lot, take, _ in plan if take < lot[2]])
+            conn.commit()
+        except (sqlite3.Error, ValueError):
+            conn.rollback()
+            raise
+        queue.apply(plan)
+        short = sum(m.quantity * (price - m.purchase_price) for m in matches if not m.long_term)
+        long = sum(m.quantity * (price - m.purchase_price) for m in matches if m.long_term)
+        return Sale(sale_id, portfolio_id, symbol, quantity, price, sale_date, method, matches, short, long)
+
+    def unrealized(self, queues, prices, today=None, adjustments=None):
+        """Unrealized gain per symbol for queues from load(), at {symbol: price}; unpriced symbols are left out.
+
+        Prices are in today's share basis; pass Adjustments so lots of symbols
+        that split or issued bonus shares are counted in it too.
+        """
+        cutoff = long_term_cutoff(today)
+        totals = {}
+        for (_, symbol), queue in queues.items():
+            price = prices.get(symbol)
+            if price is None or price != price:
+                continue
+            if adjustments is not None and symbol in adjustments:
+                held, spent, short, long = queue.adjusted(
+                    price, cutoff, lambda days: adjustments.factors_for(symbol, days))
+            else:
+                held, spent = queue.quantity, queue.cost
+                short, long = queue.unrealized(price, cutoff)
+            quantity, cost, value, s, l = totals.get(symbol, (0, 0.0, 0.0, 0.0, 0.0))
+            totals[symbol] = (quantity + held, cost + spent, value + held * price, s + short, l + long)
+        return [Unrealized(symbol, *totals[symbol]) for symbol in sorted(totals)]
+
+
+def parse_sale(symbol, quantity, price):
+    """Validate user-supplied sale fields like parse_lot(); returns (symbol, quantity, price)"""
+    symbol = normalize_symbol(symbol)
+    if not symbol or not str(quantity).strip() or not str(price).strip():
+        raise ValueError("Please fill in all fields")
+    quantity, price = parse_amounts(str(quantity).strip(), str(price).strip())
+    return symbol, quantity, price
+
+
+def realized(conn, account_id=None, portfolio_id=None, start=None, end=None):
+    """Realized gain per symbol from sales between start and end (YYYY-MM-DD, inclusive)"""
+    where, args = [], []
+    for clause, value in (("s.portfolio_id = ?", portfolio_id), ("s.account_id = ?", account_id),
+                          ("s.sale_date >= ?", start), ("s.sale_date <= ?", end)):
+        if value is not None:
+            where.append(clause)
+            args.append(value)
+    return [Realized(*row) for row in conn.execute(f"""
+        SELECT s.symbol, SUM(m.quantity), SUM(m.quantity * s.price), SUM(m.quantity * m.purchase_price),
+               TOTAL(CASE WHEN m.long_term THEN 0 ELSE m.quantity * (s.price - m.purchase_price) END),
+               TOTAL(CASE WHEN m.long_term THEN m.quantity * (s.price - m.purchase_price) ELSE 0 END)
+        FROM sales s JOIN lot_matches m ON m.sale_id = s.id
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        GROUP BY s.symbol
+        ORDER BY s.symbol
+    """, args)]
+
+
+def format_pnl(realized_rows, unrealized_rows, dividends=()):
+    """Plain-text realized and unrealized totals, split short/long term, and dividend income"""
+    lines = [
+        f"Realized: ₹{sum(r.short_term + r.long_term for r in realized_rows):,.2f} "
+        f"(short-term ₹{sum(r.short_term for r in realized_rows):,.2f}, "
+        f"long-term ₹{sum(r.long_term for r in realized_rows):,.2f})",
+        f"Unrealized: ₹{sum(u.short_term + u.long_term for u in unrealized_rows):,.2f} "
+        f"(short-term ₹{sum(u.short_term for u in unrealized_rows):,.2f}, "
+        f"long-term ₹{sum(u.long_term for u in unrealized_rows):,.2f})",
+    ]
+    if dividends:
+        lines.append(f"Dividends: ₹{sum(d.income for d in dividends):,.2f} from {len(dividends)} payouts")
+    if realized_rows:
+        lines.append("")
+        lines.append("Realized by symbol")
+        lines.extend(f"  {r.symbol}: {r.quantity} sold, ₹{r.short_term:,.2f} short-term, ₹{r.long_term:,.2f} long-term"
+                     for r in realized_rows)
+    return "\n".join(lines)
+
+
+def main():
+    import argparse
+
+    from importer import parse_date
+
+    parser = argparse.ArgumentParser(description="Record sales and report realized and unrealized P&L")
+    parser.add_argument('--db', default=storage.DB_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+    sell = sub.add_parser('sell', help="record a sale, matched FIFO unless --lots is given")
+    sell.add_argument('symbol')
+    sell.add_argument('quantity')
+    sell.add_argument('price')
+    sell.add_argument('--date', help="sale date (default today)")
+    sell.add_argument('--portfolio', type=int, default=storage.DEFAULT_PORTFOLIO)
+    sell.add_argument('--lots', type=int, nargs='+', help="lot ids to sell from, in order")
+    lots = sub.add_parser('lots', help="list a holding's open lots")
+    lots.add_argument('symbol')
+    lots.add_argument('--portfolio', type=int, default=storage.DEFAULT_PORTFOLIO)
+    pnl = sub.add_parser('pnl', help="realized and unrealized P&L at the last recorded prices")
+    pnl.add_argument('--account', type=int)
+    pnl.add_argument('--portfolio', type=int)
+    pnl.add_argument('--start')
+    pnl.add_argument('--end')
+    args = parser.parse_args()
+
+    conn = storage.connect(args.db)
+    book = LotBook()
+    try:
+        if args.command == 'sell':
+            symbol, quantity, price = parse_sale(args.symbol, args.quantity, args.price)
+            sale_date = parse_date(args.date) if args.date else date.today().isoformat()
+            sale = book.sell(conn, symbol, quantity, price, sale_date, args.portfolio, args.lots)
+            print(f"✅ Sold {quantity} {symbol} from {len(sale.matches)} lots: "
+                  f"₹{sale.short_term:,.2f} short-term, ₹{sale.long_term:,.2f} long-term")
+        elif args.command == 'lots':
+            symbol = normalize_symbol(args.symbol)
+            for lot_id, quantity, price, day in book.queue(conn, args.portfolio, symbol).open_lots():
+                print(f"{lot_id:>8}  {day}  {quantity:>8} @ ₹{price:,.2f}")
+        else:
+            queues = book.load(conn, args.account, args.portfolio)
+            latest = storage.latest_prices(conn, {symbol for _, symbol in queues})
+            prices = {symbol: price for symbol, (price, _) in latest.items()}
+            print(format_pnl(realized(conn, args.account, args.portfolio, args.start, args.end),
+                             book.unrealized(queues, prices, adjustments=Adjustments.load(conn)),
+                             dividend_income(conn, args.account, args.portfolio, args.start, args.end)))
+    except (ValueError, sqlite3.Error) as e:
+        print(f"❌ {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Load generator and replayable quote feed for the Stock Portfolio Tracker
+
+- generate_lots()/populate() build a synthetic book of any size (10 to
+  millions of lots) over a universe of real NSE symbols padded with
+  synthetic ones. Lot counts per symbol follow a Zipf-like curve, so a
+  few names dominate the book the way they do in real portfolios.
+- QuoteFeed is a sequence of price frames, either generated as random
+  walks or recorded from a live provider, saved as JSON Lines.
+- ReplayProvider serves a feed as a quote provider, one frame at a time,
+  with configurable latency, jitter, error rate and rate limit.
+
+All of it is seeded, so every run with the same arguments is identical.
+"""
+
+import json
+import random
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import storage
+from quotes import Quote, QuoteProvider, StubProvider
+from symbols import load_symbols
+
+BATCH_SIZE = 50000
+
+
+class ProviderError(Exception):
+    """An injected provider failure"""
+
+
+class RateLimitError(ProviderError):
+    """Too many requests in the last second"""
+
+
+def synthetic_symbols(count):
+    """The first count symbols of nse_symbols.csv, then SYN00000.NS onwards"""
+    real = [symbol for symbol, _ in load_symbols()][:count]
+    return real + [f"SYN{i:05d}.NS" for i in range(count - len(real))]
+
+
+def base_price(symbol):
+    """The stub provider's deterministic price for symbol"""
+    return 100 + (zlib.crc32(symbol.encode()) % 400000) / 100
+
+
+def generate_lots(count, symbols=1000, seed=0, start='2015-01-01', end=None, batch_size=BATCH_SIZE):
+    """Yield batches of (symbol, quantity, purchase_price, purchase_date, import_key) lots"""
+    universe = synthetic_symbols(symbols) if isinstance(symbols, int) else list(symbols)
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, len(universe) + 1) ** 1.1
+    weights /= weights.sum()
+    bases = np.array([base_price(symbol) for symbol in universe])
+    first = np.datetime64(start, 'D')
+    days = int((np.datetime64(end or 'today', 'D') - first).astype(int)) + 1
+
+    for offset in range(0, count, batch_size):
+        n = min(batch_size, count - offset)
+        picks = rng.choice(len(universe), size=n, p=weights)
+        quantities = rng.integers(1, 500, n)
+        prices = np.round(bases[picks] * rng.uniform(0.6, 1.4, n), 2)
+        dates = (first + rng.integers(0, days, n)).astype(str)
+        yield list(zip([universe[i] for i in picks], quantities.tolist(), prices.tolist(), dates.tolist(), [None] * n))
+
+
+def populate(db_path, lots, symbols=1000, seed=0, history_days=0, progress=None):
+    """Fill db_path with a synthetic book, plus history_days of price_history per symbol.
+
+    Returns {'lots', 'symbols', 'history_rows', 'seconds'}.
+    """
+    start = time.perf_counter()
+    universe = synthetic_symbols(symbols)
+    conn = storage.connect(db_path)
+    inserted = 0
+    history_rows = 0
+    try:
+        for batch in generate_lots(lots, universe, seed):
+            inserted += storage.bulk_insert_lots(conn, batch)
+            if progress:
+                progress(inserted)
+        if history_days:
+            feed = QuoteFeed.generate(universe, history_days, seed=seed)
+            dates = np.arange(np.datetime64('today', 'D') - history_days + 1, np.datetime64('today', 'D') + 1).astype(str)
+            storage.save_prices(conn, ((symbol, price, day) for j, symbol in enumerate(universe)
+                                       for price, day in zip(feed.prices[:, j].tolist(), dates.tolist())))
+            history_rows = history_days * len(universe)
+    finally:
+        conn.close()
+    return {'lots': inserted, 'symbols': len(universe), 'history_rows': history_rows,
+            'seconds': time.perf_counter() - start}
+
+
+class QuoteFeed:
+    """Price frames for a set of symbols: prices[i, j] is symbols[j] at frame i (NaN if unknown)"""
+
+    def __init__(self, symbols, prices, interval=60.0):
+        self.symbols = list(symbols)
+        self.col = {symbol: j for j, symbol in enumerate(self.symbols)}
+        self.prices = np.asarray(prices, dtype=float).reshape(-1, len(self.symbols))
+        self.interval = interval
+
+    def __len__(self):
+        return len(self.prices)
+
+    @classmethod
+    def generate(cls, symbols, frames, seed=0, volatility=0.002, interval=60.0):
+        """Random walks from each symbol's stub price, with volatility per frame"""
+        symbols = synthetic_symbols(symbols) if isinstance(symbols, int) else list(symbols)
+        rng = np.random.default_rng(seed)
+        bases = np.array([base_price(symbol) for symbol in symbols])
+        walk = np.exp(np.cumsum(rng.normal(0, volatility, (frames, len(symbols))), axis=0))
+        return cls(symbols, np.round(bases * walk, 2), interval)
+
+    @classmethod
+    def record(cls, provider, symbols, frames, interval=60.0, progress=None):
+        """Capture frames from a live provider, interval seconds apart"""
+        symbols = list(symbols)
+        prices = np.full((frames, len(symbols)), np.nan)
+        for i in range(frames):
+            started = time.monotonic()
+            quotes = provider.get_quotes(symbols)
+            prices[i] = [quotes[symbol].price if quotes.get(symbol) else np.nan for symbol in symbols]
+            if progress:
+                progress(i + 1)
+            if i + 1 < frames:
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+        return cls(symbols, prices, interval)
+
+    @classmethod
+    def load(cls, path):
+        """Read a feed saved by save(); symbols missing from a frame are NaN there"""
+        frames = []
+        symbols = {}
+        interval = 60.0
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    frame = json.loads(line)
+                    frames.append(frame['prices'])
+                    for symbol in frame['prices']:
+                        symbols.setdefault(symbol, len(symbols))
+                    if len(frames) == 2:
+                        interval = frame['t']
+        prices = np.full((len(frames), len(symbols)), np.nan)
+        for i, frame in enumerate(frames):
+            for symbol, price in frame.items():
+                prices[i, symbols[symbol]] = np.nan if price is None else price
+        return cls(symbols, prices, interval)
+
+    def save(self, path):
+        """Write one JSON line per frame: {"t": seconds from the first frame, "prices": {symbol: price}}"""
+        with open(path, 'w') as f:
+            for i, row in enumerate(self.prices.tolist()):
+                prices = {symbol: price for symbol, price in zip(self.symbols, row) if price == price}
+                f.write(json.dumps({'t': i * self.interval, 'prices': prices}) + '\n')
+
+
+class ReplayProvider(StubProvider):
+    """Serves a QuoteFeed one frame at a time, with injected latency, jitter, errors and a rate limit.
+
+    Each fetch sleeps latency plus up to jitter seconds, fails with
+    ProviderError with probability error_rate, and fails with RateLimitError
+    beyond rate_limit requests per second. Symbols not in the feed get no
+    quote; a NaN in the current frame serves the symbol's last earlier
+    price. History comes from the stub's random walk.
+    """
+
+    def __init__(self, feed, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None, seed=0, loop=True,
+                 currency='INR', max_workers=8, timeout=10.0):
+        super().__init__(currency=currency, latency=latency, max_workers=max_workers, timeout=timeout)
+        self.feed = feed
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.loop = loop
+        self.position = 0
+        self.errors = 0
+        self.seed = seed
+        self.attempts = {}  # (symbol, position) -> fetches so far
+        self.lock = threading.Lock()
+        self.window = []  # request times in the last second, for the rate limit
+
+        # Carry each symbol's last known price forward over gaps in the feed
+        prices = feed.prices.copy()
+        for i in range(1, len(prices)):
+            gaps = np.isnan(prices[i])
+            prices[i, gaps] = prices[i - 1, gaps]
+        self.prices = prices
+
+    def advance(self, frames=1):
+        """Move to a later frame (wrapping around with loop=True); returns the new position"""
+        with self.lock:
+            self.attempts.clear()
+            position = self.position + frames
+            self.position = position % len(self.prices) if self.loop else min(position, len(self.prices) - 1)
+            return self.position
+
+    def fetch_quote(self, symbol):
+        with self.lock:
+            self.calls += 1
+            position = self.position
+            attempt = self.attempts[symbol, position] = self.attempts.get((symbol, position), 0) + 1
+            # Draws depend only on the request, not on which worker thread got there first
+            draw = random.Random(zlib.crc32(f"{symbol}|{position}|{attempt}".encode()) ^ self.seed)
+            delay = self.latency + draw.random() * self.jitter
+            fail = draw.random() < self.error_rate
+            limited = False
+            if self.rate_limit:
+                now = time.monotonic()
+                self.window = [t for t in self.window if now - t < 1.0]
+                limited = len(self.window) >= self.rate_limit
+                if not limited:
+                    self.window.append(now)
+            if fail or limited:
+                self.errors += 1
+
+        if delay:
+            time.sleep(delay)
+        if limited:
+            raise RateLimitError("429 Too Many Requests")
+        if fail:
+            raise ProviderError(f"Injected error for {symbol}")
+        j = self.feed.col.get(symbol)
+        if j is None or np.isnan(self.prices[position, j]):
+            return None
+        return Quote(symbol, float(self.prices[position, j]), self.currency)
+
+    def map_symbols(self, fetch, symbols, timeout=None):
+        # Always use the pool, which turns injected exceptions into failed quotes like a real provider
+        return QuoteProvider.map_symbols(self, fetch, symbols, timeout=timeout)
+
+
+def replay(db_path, provider, frames):
+    """Run frames refresh cycles of the headless recorder against provider, advancing the feed after each.
+
+    Returns the cycles' daemon CycleResults (None for a cycle that raised).
+    """
+    from daemon import PriceDaemon
+
+    daemon = PriceDaemon(db_path, provider=provider)
+    results = []
+    for _ in range(frames):
+        results.append(daemon.run_cycle(threading.Event()))
+        provider.advance()
+    return results
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate synthetic portfolios and replay quote feeds")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    portfolio = commands.add_parser('portfolio', help="fill a database with a synthetic book")
+    portfolio.add_argument('--lots', type=int, default=10000)
+    portfolio.add_argument('--symbols', type=int, default=1000)
+    portfolio.add_argument('--history-days', type=int, default=0, help="also write this many days of price_history")
+    portfolio.add_argument('--seed', type=int, default=0)
+    portfolio.add_argument('--db', default='load.db')
+
+    feed = commands.add_parser('feed', help="generate a random-walk quote feed")
+    feed.add_argument('output')
+    feed.add_argument('--symbols', type=int, default=1000)
+    feed.add_argument('--frames', type=int, default=100)
+    feed.add_argument('--volatility', type=float, default=0.002)
+    feed.add_argument('--interval', type=float, default=60.0)
+    feed.add_argument('--seed', type=int, default=0)
+
+    record = commands.add_parser('record', help="record a feed of live quotes for the held symbols")
+    record.add_argument('output')
+    record.add_argument('--db', default=storage.DB_PATH)
+    record.add_argument('--frames', type=int, default=10)
+    record.add_argument('--interval', type=float, default=60.0)
+
+    play = commands.add_parser('replay', help="run refresh cycles against a recorded or generated feed")
+    play.add_argument('feed')
+    play.add_argument('--db', default='load.db')
+    play.add_argument('--frames', type=int, default=10)
+    play.add_argument('--latency', type=float, default=0.0)
+    play.add_argument('--jitter', type=float, default=0.0)
+    play.add_argument('--error-rate', type=float, default=0.0)
+    play.add_argument('--rate-limit', type=float, default=None, help="requests per second before 429s")
+    play.add_argument('--workers', type=int, default=8)
+    play.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'portfolio':
+        print(f"🏗️ Generating {args.lots:,} lots over {args.symbols:,} symbols into {args.db}...")
+        stats = populate(args.db, args.lots, args.symbols, args.seed, args.history_days,
+                         progress=lambda n: print(f"   {n:,} lots", end='\r'))
+        print(f"✅ {stats['lots']:,} lots and {stats['history_rows']:,} price_history rows in {stats['seconds']:.2f}s")
+    elif args.command == 'feed':
+        quote_feed = QuoteFeed.generate(args.symbols, args.frames, args.seed, args.volatility, args.interval)
+        quote_feed.save(args.output)
+        print(f"✅ Wrote {len(quote_feed)} frames of {len(quote_feed.symbols)} symbols to {args.output}")
+    elif args.command == 'record':
+        from quotes import YFinanceProvider
+
+        conn = storage.connect(args.db)
+        symbols = [symbol for symbol, _, _ in storage.load_holdings(conn)]
+        conn.close()
+        print(f"🎙️ Recording {args.frames} frames of {len(symbols)} symbols every {args.interval:.0f}s...")
+        quote_feed = QuoteFeed.record(YFinanceProvider(), symbols, args.frames, args.interval,
+                                      progress=lambda n: print(f"   frame {n}", end='\r'))
+        quote_feed.save(args.output)
+        print(f"✅ Wrote {len(quote_feed)} frames to {args.output}")
+    else:
+        provider = ReplayProvider(QuoteFeed.load(args.feed), args.latency, args.jitter, args.error_rate,
+                                  args.rate_limit, args.seed, max_workers=args.workers)
+        results = replay(args.db, provider, args.frames)
+        seconds = [r.seconds for r in results if r is not None] or [0.0]
+        print(f"✅ {len(results)} cycles: median {np.median(seconds):.2f}s, max {max(seconds):.2f}s, "
+              f"{provider.errors} injected errors over {provider.calls} requests")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Portfolio lot records for the Stock Portfolio Tracker
+"""
+
+import math
+
+from symbols import normalize_symbol
+
+
+def parse_lot(symbol, quantity, price):
+    """Validate user-supplied lot fields the way the Add Stock form does.
+
+    Returns (symbol, quantity, price) normalized and converted, or raises
+    ValueError with a message fit to show the user.
+    """
+    symbol = normalize_symbol(symbol)
+    quantity = str(quantity).strip()
+    price = str(price).strip()
+
+    if not symbol or not quantity or not price:
+        raise ValueError("Please fill in all fields")
+
+    quantity, price = parse_amounts(quantity, price)
+    return symbol, quantity, price
+
+
+def parse_amounts(quantity, price):
+    """Convert and check a lot's quantity and price, raising ValueError like parse_lot()"""
+    try:
+        quantity = int(quantity)
+        price = float(price)
+    except ValueError:
+        raise ValueError("Quantity must be an integer and price must be a number")
+
+    if not math.isfinite(price):
+        raise ValueError("Price must be a finite number")
+    if quantity <= 0 or price <= 0:
+        raise ValueError("Quantity and price must be positive numbers")
+
+    return quantity, price
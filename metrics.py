@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Instrumentation for the Stock Portfolio Tracker
+
+A process-wide registry of counters and latency histograms. Code under
+measurement is wrapped in span(name), which records its duration in the
+tracker_span_seconds histogram and logs any exception before re-raising it.
+Errors and notable events go to a structured log: the most recent records
+are kept in memory for the Diagnostics panel, and all of them are appended
+as JSON lines to a file once open_log() has been called. The registry can
+be exported in the Prometheus text format, and a single refresh can be
+captured with cProfile.
+"""
+
+import bisect
+import cProfile
+import io
+import json
+import math
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+PREFIX = 'tracker_'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RECENT_RECORDS = 200
+LOG_PATH = 'tracker.log.jsonl'
+PROMETHEUS_PATH = 'tracker.prom'
+PROFILE_PATH = 'refresh.prof'
+
+
+class Histogram:
+    """Observation counts per upper bound, plus a +Inf bucket, a count and a sum"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate the q-quantile by interpolating within its bucket, as Prometheus' histogram_quantile() does"""
+        if not self.count:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metrics:
+    """Thread-safe counters, histograms and a structured event log"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, recent=RECENT_RECORDS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, label key) -> value
+        self.histograms = {}  # (name, label key) -> Histogram
+        self.recent = deque(maxlen=recent)
+        self.log_file = None
+
+    def count(self, name, amount=1, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time the block into span_seconds{span=name}; exceptions are counted and logged, then re-raised.
+
+        The exception is left to the caller to report, so nothing is printed here.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.log('error', name, error=f"{type(e).__name__}: {e}", **labels)
+            raise
+        finally:
+            self.observe('span_seconds', time.perf_counter() - start, span=name, **labels)
+
+    def log(self, level, event, message=None, **fields):
+        """Record a structured event; errors and warnings are also counted and printed"""
+        record = {'time': datetime.now().isoformat(timespec='milliseconds'), 'level': level, 'event': event}
+        if message:
+            record['message'] = message
+        record.update(fields)
+        if level in ('error', 'warning'):
+            self.count('errors_total' if level == 'error' else 'warnings_total', event=event)
+            if message:
+                print(message)
+        line = json.dumps(record, default=str)
+        with self.lock:
+            self.recent.append(record)
+            if self.log_file is not None:
+                self.log_file.write(line + '\n')
+                self.log_file.flush()
+
+    def open_log(self, path=LOG_PATH):
+        """Append every later record to path as JSON lines"""
+        log_file = open(path, 'a', encoding='utf-8')
+        with self.lock:
+            previous, self.log_file = self.log_file, log_file
+        if previous is not None:
+            previous.close()
+
+    def close_log(self):
+        with self.lock:
+            log_file, self.log_file = self.log_file, None
+        if log_file is not None:
+            log_file.close()
+
+    def value(self, name, **labels):
+        with self.lock:
+            return self.counters.get((name, label_key(labels)), 0)
+
+    def histogram(self, name, **labels):
+        with self.lock:
+            return self.histograms.get((name, label_key(labels)))
+
+    def snapshot(self):
+        """A JSON-friendly copy: counters, histogram summaries (count, sum, p50, p95) and recent records"""
+        with self.lock:
+            counters = [(name, dict(key), value) for (name, key), value in sorted(self.counters.items())]
+            histograms = [(name, dict(key), h.count, h.sum, h.quantile(0.5), h.quantile(0.95))
+                          for (name, key), h in sorted(self.histograms.items())]
+            recent = list(self.recent)
+        return {
+            'counters': [{'name': name, 'labels': labels, 'value': value} for name, labels, value in counters],
+            'histograms': [{'name': name, 'labels': labels, 'count': count, 'sum': total, 'p50': p50, 'p95': p95}
+                           for name, labels, count, total, p50, p95 in histograms],
+            'recent': recent,
+        }
+
+    def prometheus_text(self):
+        """The registry in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(h.counts), h.count, h.sum, h.buckets) for key, h in self.histograms.items())
+
+        declared = set()
+        for (name, key), value in counters:
+            if name not in declared:
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                declared.add(name)
+            lines.append(f"{PREFIX}{name}{format_labels(key)} {value}")
+        for (name, key), counts, count, total, buckets in histograms:
+            if name not in declared:
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                declared.add(name)
+            cumulative = 0
+            for bound, bucket in zip(buckets, counts):
+                cumulative += bucket
+                lines.append(f"{PREFIX}{name}_bucket{format_labels(key, [('le', repr(float(bound)))])} {cumulative}")
+            lines.append(f"{PREFIX}{name}_bucket{format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{PREFIX}{name}_sum{format_labels(key)} {total}")
+            lines.append(f"{PREFIX}{name}_count{format_labels(key)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path=PROMETHEUS_PATH):
+        """Write prometheus_text() atomically, e.g. for node_exporter's textfile collector"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.recent.clear()
+
+
+REGISTRY = Metrics()
+
+
+def count(name, amount=1, **labels):
+    REGISTRY.count(name, amount, **labels)
+
+
+def observe(name, value, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+
+def span(name, **labels):
+    return REGISTRY.span(name, **labels)
+
+
+def log(level, event, message=None, **fields):
+    REGISTRY.log(level, event, message, **fields)
+
+
+def format_report(snapshot, recent=20):
+    """Render a snapshot() as the plain text shown in the Diagnostics panel"""
+    lines = ["Latency (count, p50, p95, total)"]
+    for h in snapshot['histograms']:
+        labels = ', '.join(f"{name}={value}" for name, value in h['labels'].items())
+        lines.append(f"  {h['name']}{f' [{labels}]' if labels else ''}: {h['count']}, "
+                     f"{h['p50'] * 1000:.1f} ms, {h['p95'] * 1000:.1f} ms, {h['sum']:.2f} s")
+    lines.append("")
+    lines.append("Counters")
+    for c in snapshot['counters']:
+        labels = ', '.join(f"{name}={value}" for name, value in c['labels'].items())
+        lines.append(f"  {c['name']}{f' [{labels}]' if labels else ''}: {c['value']:g}")
+    problems = [r for r in snapshot['recent'] if r['level'] in ('error', 'warning')][-recent:]
+    if problems:
+        lines.append("")
+        lines.append("Recent problems")
+        lines.extend(f"  {r['time']} {r.get('message') or r['event'] + ': ' + str(r.get('error', ''))}"
+                     for r in problems)
+    return '\n'.join(lines)
+
+
+@contextmanager
+def profile(path=PROFILE_PATH):
+    """Run the block under cProfile and save the stats to path.
+
+    Only the calling thread is profiled; time spent waiting on the quote
+    pool shows up under the wait, not inside the individual fetches.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+def profile_report(path=PROFILE_PATH, limit=25):
+    """The top functions by cumulative time from a saved profile"""
+    stream = io.StringIO()
+    pstats.Stats(path, stream=stream).sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
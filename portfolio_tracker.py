@@ -1,73 +1,161 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
+from tkinter import ttk, messagebox, filedialog, simpledialog
 import sqlite3
-import yfinance as yf
-import pandas as pd
-from datetime import datetime
+from datetime import date, datetime
 import threading
-import csv
+import time
+from collections import deque
+from contextlib import nullcontext
+
+import alerts
+import exporter
+import importer
+import metrics
+import storage
+from analytics import PortfolioAnalytics, backfill_benchmark, format_summary, history_rates, price_column_loader
+from chart import ChartData, ChartView
+from corporate_actions import Adjustments, dividend_income
+from engine import PortfolioEngine, value_accounts
+from fx import FxRates
+from history_store import HistoryStore
+from ledger import LotBook, format_pnl, parse_sale, realized
+from lots import parse_lot
+from quote_cache import QuoteCache
+from quotes import YFinanceProvider
+from symbol_index import SymbolIndex
+from tree_view import TreeRenderer
+from workers import DbWriter, RefreshController, UiQueue
+
+QUOTE_TTL = 60  # seconds before a cached quote is revalidated
+REFRESH_CHUNK = 50  # symbols fetched between cancellation checks and UI updates
+RECENT_ALERTS = 100  # alerts listed in the Alerts window
+RULES_SHOWN = 1000  # rules listed there; the rest are still checked
+
+
+def format_row(valuation, i, failed_symbols=()):
+    """The Treeview values for row i of an engine Valuation"""
+    symbol = valuation.symbols[i]
+    quantity = int(valuation.quantities[i])
+    avg_cost = valuation.avg_costs[i]
+    price = valuation.prices[i]
+    if price == price:  # not NaN
+        return (symbol, quantity, f"₹{avg_cost:.2f}", f"₹{price:.2f}",
+                f"₹{valuation.gain_loss[i]:.2f}", f"₹{valuation.value[i]:.2f}")
+    status = "Error" if symbol in failed_symbols else "Loading..."
+    return (symbol, quantity, f"₹{avg_cost:.2f}", status, status, status)
+
+
+def cached_prices(symbols, quote_cache, fx):
+    """INR prices for the symbols whose quotes are already cached, without touching the network"""
+    cached = {symbol: quote_cache.peek(symbol) for symbol in symbols}
+    return fx.convert_quotes({symbol: quote for symbol, quote in cached.items() if quote}, fetch=False)
+
+
+def fetch_chunks(symbols, quote_cache, fx, cancelled):
+    """Yield {symbol: INR price or None} for symbols, REFRESH_CHUNK at a time, stopping once cancelled is set"""
+    for start in range(0, len(symbols), REFRESH_CHUNK):
+        if cancelled.is_set():
+            return
+        chunk = symbols[start:start + REFRESH_CHUNK]
+        quotes = quote_cache.get_quotes(chunk)
+        yield fx.convert_quotes({symbol: quotes.get(symbol) for symbol in chunk})
+
 
 class PortfolioTracker:
-    def __init__(self, root):
+    def __init__(self, root, db_path=storage.DB_PATH, provider=None):
         self.root = root
+        self.db_path = db_path
         self.root.title("Stock Portfolio Tracker")
         self.root.geometry("900x600")
 
+        self.engine = PortfolioEngine()
+        self.failed_symbols = set()
+        self.pending_history = {}
+        self.snapshot_prices = None
+        self.account_id = None  # the scope shown: one portfolio, one account, or all of them (consolidated)
+        self.portfolio_id = None
+        self.scopes = []  # (label, account_id, portfolio_id) in switcher order
+        self.profile_next = False  # capture the next refresh with cProfile
+        self.diagnostics = None
+        self.last_profile = None
+        self.alert_engine = alerts.AlertEngine()
+        self.book = LotBook()  # open lots per portfolio and symbol, for matching sales
+        self.analytics = None  # ((account_id, portfolio_id), PortfolioAnalytics) kept up to date once built
+        self.analytics_version = 0  # bumped on every lot change, so an analytics build that raced one is dropped
+        self.recent_alerts = deque(maxlen=RECENT_ALERTS)
+        self.alerts_window = None
+        self.quote_provider = provider or YFinanceProvider()
+        self.fx = FxRates(self.quote_provider)
+        self.quote_cache = QuoteCache(self.quote_provider, ttl=QUOTE_TTL, on_revalidated=self.on_revalidated)
+        self.ui_queue = UiQueue(self.root)
+        self.refresher = RefreshController(self.refresh_job)
+
         # Initialize database
         self.init_database()
-
-        # Create GUI
+        self.db_writer = DbWriter(self.db_path, on_error=lambda e: self.ui_queue.post(self.set_status, f"Database error: {e}"))
+        self.alert_engine.load(self.conn)
+        self.recent_alerts.extend(alerts.read_log(limit=RECENT_ALERTS))
+        self.load_last_snapshot()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # Create GUI; the symbol search index loads in the background
+        self.symbol_index = None
         self.create_widgets()
+        self.load_accounts()
+        SymbolIndex.load_async(lambda index: self.ui_queue.post(self.on_symbol_index_loaded, index))
 
-        # Load existing data
+        # Paint the last known values at once, then fetch live prices in the background
         self.refresh_portfolio()
+        if len(self.engine):
+            self.root.after_idle(self.refresh_prices_threaded)
 
     def init_database(self):
-        self.conn = sqlite3.connect('portfolio.db')
+        self.conn = storage.connect(self.db_path)
         self.cursor = self.conn.cursor()
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS portfolio (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                symbol TEXT NOT NULL,
-                quantity INTEGER NOT NULL,
-                purchase_price REAL NOT NULL,
-                purchase_date TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS price_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                symbol TEXT NOT NULL,
-                price REAL NOT NULL,
-                date TEXT NOT NULL,
-                UNIQUE(symbol, date)
-            )
-        """)
-        self.conn.commit()
-
-    def load_symbols_from_csv(self):
-        symbols = []
-        try:
-            with open('nse_symbols.csv', 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    symbols.append(row['Symbol'])
-        except Exception as e:
-            print(f"Error loading symbols: {e}")
-        return symbols
+
+    def load_last_snapshot(self):
+        """Warm the cache from price_history, and keep the last valuation snapshot's prices for the first paint"""
+        self.quote_cache.warm_from_db(self.cursor)
+        snapshot = storage.load_snapshot(self.conn)
+        if snapshot is not None:
+            self.snapshot_prices = {symbol: price for symbol, _, _, price in snapshot[1]}
+
+    def on_symbol_index_loaded(self, index):
+        self.symbol_index = index
+        self.suggest_symbols()
+
+    def suggest_symbols(self, event=None):
+        """Offer matching tickers and company names for what has been typed so far"""
+        if self.symbol_index is None or (event is not None and event.keysym in ('Up', 'Down', 'Return', 'Escape', 'Tab')):
+            return
+        matches = self.symbol_index.search(self.symbol_entry.get())
+        self.symbol_entry.config(values=[f"{symbol}  {name}" for symbol, name in matches])
+
+    def on_symbol_selected(self, event=None):
+        self.symbol_entry.set(self.symbol_entry.get().split()[0])
 
     def create_widgets(self):
         main_frame = ttk.Frame(self.root, padding="10")
         main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
 
+        account_frame = ttk.Frame(main_frame)
+        account_frame.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 10))
+        ttk.Label(account_frame, text="Account:").pack(side=tk.LEFT)
+        self.account_selector = ttk.Combobox(account_frame, width=40, state='readonly')
+        self.account_selector.pack(side=tk.LEFT, padx=(5, 10))
+        self.account_selector.bind('<<ComboboxSelected>>', self.on_scope_selected)
+        ttk.Button(account_frame, text="New Account", command=self.new_account).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(account_frame, text="New Portfolio", command=self.new_portfolio).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(account_frame, text="Account Totals", command=self.show_account_totals).pack(side=tk.LEFT)
+
         input_frame = ttk.LabelFrame(main_frame, text="Add Stock", padding="10")
-        input_frame.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 10))
+        input_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 10))
 
         ttk.Label(input_frame, text="Symbol:").grid(row=0, column=0, sticky=tk.W)
-        self.stock_symbols = self.load_symbols_from_csv()
-        self.symbol_entry = ttk.Combobox(input_frame, values=self.stock_symbols)
+        self.symbol_entry = ttk.Combobox(input_frame, width=40)
         self.symbol_entry.grid(row=0, column=1, padx=(5, 20))
+        self.symbol_entry.bind('<KeyRelease>', self.suggest_symbols)
+        self.symbol_entry.bind('<<ComboboxSelected>>', self.on_symbol_selected)
 
         ttk.Label(input_frame, text="Quantity:").grid(row=0, column=2, sticky=tk.W)
         self.quantity_entry = ttk.Entry(input_frame, width=15)
@@ -78,9 +166,10 @@ class PortfolioTracker:
         self.price_entry.grid(row=0, column=5, padx=(5, 20))
 
         ttk.Button(input_frame, text="Add Stock", command=self.add_stock).grid(row=0, column=6, padx=(10, 0))
+        ttk.Button(input_frame, text="Sell", command=self.sell_stock).grid(row=0, column=7, padx=(10, 0))
 
         display_frame = ttk.LabelFrame(main_frame, text="Portfolio", padding="10")
-        display_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
+        display_frame.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
 
         columns = ('Symbol', 'Quantity', 'Purchase Price', 'Current Price', 'Gain/Loss', 'Total Value')
         self.tree = ttk.Treeview(display_frame, columns=columns, show='headings', height=15)
@@ -88,144 +177,345 @@ class PortfolioTracker:
             self.tree.heading(col, text=col)
             self.tree.column(col, width=120, anchor=tk.CENTER)
 
-        scrollbar = ttk.Scrollbar(display_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        self.tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar = ttk.Scrollbar(display_frame, orient=tk.VERTICAL)
+        self.renderer = TreeRenderer(self.root, self.tree, scrollbar)
         self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
 
         button_frame = ttk.Frame(main_frame)
-        button_frame.grid(row=2, column=0, columnspan=2, pady=(10, 0))
+        button_frame.grid(row=3, column=0, columnspan=2, pady=(10, 0))
 
         ttk.Button(button_frame, text="Refresh Prices", command=self.refresh_prices_threaded).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(button_frame, text="Cancel Refresh", command=self.cancel_refresh).pack(side=tk.LEFT, padx=(0, 10))
         ttk.Button(button_frame, text="Delete Selected", command=self.delete_selected).pack(side=tk.LEFT, padx=(0, 10))
-        ttk.Button(button_frame, text="Export CSV", command=self.export_csv).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(button_frame, text="Import Trades", command=self.import_trades).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(button_frame, text="Export", command=self.export_data).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(button_frame, text="Analytics", command=self.show_analytics).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(button_frame, text="Chart", command=self.show_chart).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(button_frame, text="P&L", command=self.show_pnl).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(button_frame, text="Alerts", command=self.show_alerts).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(button_frame, text="Diagnostics", command=self.show_diagnostics).pack(side=tk.LEFT, padx=(0, 10))
 
         self.status_label = ttk.Label(main_frame, text="Ready")
-        self.status_label.grid(row=3, column=0, columnspan=2, pady=(10, 0))
+        self.status_label.grid(row=4, column=0, columnspan=2, pady=(10, 0))
 
         self.root.columnconfigure(0, weight=1)
         self.root.rowconfigure(0, weight=1)
         main_frame.columnconfigure(0, weight=1)
-        main_frame.rowconfigure(1, weight=1)
+        main_frame.rowconfigure(2, weight=1)
         display_frame.columnconfigure(0, weight=1)
         display_frame.rowconfigure(0, weight=1)
 
-    def add_stock(self):
-        symbol = self.symbol_entry.get().upper().strip()
-        if not symbol.endswith(".NS"):
-            symbol += ".NS"
-        quantity = self.quantity_entry.get().strip()
-        price = self.price_entry.get().strip()
-
-        if not symbol or not quantity or not price:
-            messagebox.showerror("Error", "Please fill in all fields")
+    def load_accounts(self, select=None):
+        """Fill the account switcher; select is a (account_id, portfolio_id) scope to show afterwards"""
+        portfolios = storage.list_portfolios(self.conn)
+        self.scopes = [("All accounts (consolidated)", None, None)]
+        for account_id, name in storage.list_accounts(self.conn):
+            owned = [(portfolio_id, title) for portfolio_id, owner, title in portfolios if owner == account_id]
+            if len(owned) == 1:
+                self.scopes.append((name, account_id, owned[0][0]))
+                continue
+            self.scopes.append((f"{name} (all portfolios)", account_id, None))
+            self.scopes.extend((f"{name} / {title}", account_id, portfolio_id) for portfolio_id, title in owned)
+
+        if select is None:
+            # One account: show it, so Add Stock works straight away; several: start consolidated
+            select = self.scopes[1][1:] if len(self.scopes) == 2 else (None, None)
+        self.account_selector.config(values=[label for label, _, _ in self.scopes])
+        for i, (_, account_id, portfolio_id) in enumerate(self.scopes):
+            if (account_id, portfolio_id) == tuple(select):
+                self.account_selector.current(i)
+                self.account_id, self.portfolio_id = account_id, portfolio_id
+                return
+        self.account_selector.current(0)
+        self.account_id, self.portfolio_id = None, None
+
+    def on_scope_selected(self, event=None):
+        _, self.account_id, self.portfolio_id = self.scopes[self.account_selector.current()]
+        self.refresh_portfolio()
+        # Quotes are cached per symbol, so only symbols no other view has fetched go to the network
+        if len(self.engine):
+            self.refresh_prices_threaded()
+
+    def scope_name(self):
+        return self.scopes[self.account_selector.current()][0]
+
+    def new_account(self):
+        name = simpledialog.askstring("New Account", "Account name:", parent=self.root)
+        if not name:
+            return
+        try:
+            account_id, portfolio_id = storage.create_account(self.conn, name)
+        except (sqlite3.Error, ValueError) as e:
+            messagebox.showerror("Account Error", str(e))
             return
+        self.load_accounts(select=(account_id, portfolio_id))
+        self.refresh_portfolio()
+        self.set_status(f"Created account {name.strip()}")
 
+    def new_portfolio(self):
+        if self.account_id is None:
+            messagebox.showwarning("Warning", "Choose an account to add a portfolio to")
+            return
+        name = simpledialog.askstring("New Portfolio", "Portfolio name:", parent=self.root)
+        if not name:
+            return
         try:
-            quantity = int(quantity)
-            price = float(price)
-        except ValueError:
-            messagebox.showerror("Error", "Quantity must be an integer and price must be a number")
+            portfolio_id = storage.create_portfolio(self.conn, self.account_id, name)
+        except (sqlite3.Error, ValueError) as e:
+            messagebox.showerror("Portfolio Error", str(e))
             return
+        self.load_accounts(select=(self.account_id, portfolio_id))
+        self.refresh_portfolio()
+        self.set_status(f"Created portfolio {name.strip()}")
+
+    def show_account_totals(self):
+        """Value every account from one price per distinct symbol, fetching those not priced yet in the background"""
+        positions = storage.load_account_holdings(self.conn)
+        prices = {symbol: price for symbol, price in zip(self.engine.symbols.tolist(), self.engine.prices.tolist())
+                  if price == price}
+        missing = {symbol for _, symbol, _, _ in positions if symbol not in prices}
+        prices.update(cached_prices(missing, self.quote_cache, self.fx))
+        missing = sorted(symbol for symbol in missing if prices.get(symbol) is None)
+        if not missing:
+            self.show_account_values(positions, prices)
+            return
+
+        def fetch_missing():
+            quotes = self.quote_cache.get_quotes(missing)
+            prices.update(self.fx.convert_quotes({symbol: quotes.get(symbol) for symbol in missing}))
+            self.ui_queue.post(self.set_status, "Ready")
+            self.ui_queue.post(self.show_account_values, positions, prices)
+
+        self.set_status(f"Fetching prices for {len(missing)} symbols...")
+        thread = threading.Thread(target=fetch_missing)
+        thread.daemon = True
+        thread.start()
+
+    def show_account_values(self, positions, prices):
+        names = dict(storage.list_accounts(self.conn))
+        lines = [f"{names.get(t.account_id, t.account_id)}: value ₹{t.total_value:,.2f}, "
+                 f"gain/loss ₹{t.total_gain_loss:,.2f} ({t.positions} positions)"
+                 for t in value_accounts(positions, prices)]
+        unpriced = sum(1 for symbol in {p[1] for p in positions} if prices.get(symbol) is None)
+        if unpriced:
+            lines.append(f"\n{unpriced} symbols could not be priced and are left out")
+        messagebox.showinfo("Account Totals", "\n".join(lines) or "No accounts hold any stock")
+
+    def require_portfolio(self, action):
+        """The portfolio_id to write to, or None (after telling the user) if the view spans several"""
+        if self.portfolio_id is None:
+            messagebox.showwarning("Warning", f"Choose a single account or portfolio to {action}")
+        return self.portfolio_id
 
-        if quantity <= 0 or price <= 0:
-            messagebox.showerror("Error", "Quantity and price must be positive numbers")
+    def add_stock(self):
+        try:
+            symbol, quantity, price = parse_lot(self.symbol_entry.get(), self.quantity_entry.get(), self.price_entry.get())
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        portfolio_id = self.require_portfolio("add stock to")
+        if portfolio_id is None:
             return
 
         purchase_date = datetime.now().strftime('%Y-%m-%d')
         try:
-            self.cursor.execute("""
-                INSERT INTO portfolio (symbol, quantity, purchase_price, purchase_date)
-                VALUES (?, ?, ?, ?)
-            """, (symbol, quantity, price, purchase_date))
-            self.conn.commit()
+            with metrics.span('db_transaction'):
+                self.book.buy(self.conn, symbol, quantity, price, purchase_date, portfolio_id)
+            self.feed_analytics(symbol, quantity, price, purchase_date, portfolio_id)
             self.symbol_entry.set('')
             self.quantity_entry.delete(0, tk.END)
             self.price_entry.delete(0, tk.END)
             self.refresh_portfolio()
-            self.status_label.config(text=f"Added {quantity} shares of {symbol}")
+            self.status_label.config(text=f"Added {quantity} shares of {symbol} to {self.scope_name()}")
+        except (sqlite3.Error, ValueError) as e:
+            messagebox.showerror("Database Error", str(e))
+
+    def sell_stock(self):
+        """Record a sale of the entered quantity at the entered price, matched against the oldest lots first"""
+        try:
+            symbol, quantity, price = parse_sale(self.symbol_entry.get(), self.quantity_entry.get(), self.price_entry.get())
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        portfolio_id = self.require_portfolio("sell from")
+        if portfolio_id is None:
+            return
+
+        sale_date = datetime.now().strftime('%Y-%m-%d')
+        try:
+            with metrics.span('db_transaction'):
+                sale = self.book.sell(self.conn, symbol, quantity, price, sale_date, portfolio_id)
+        except (sqlite3.Error, ValueError) as e:
+            messagebox.showerror("Sale Error", str(e))
+            return
+        self.feed_analytics(symbol, -quantity, price, sale_date, portfolio_id)
+        self.symbol_entry.set('')
+        self.quantity_entry.delete(0, tk.END)
+        self.price_entry.delete(0, tk.END)
+        self.refresh_portfolio()
+        self.set_status(f"Sold {quantity} shares of {symbol} from {len(sale.matches)} lots: realized "
+                        f"₹{sale.short_term + sale.long_term:,.2f} (short-term ₹{sale.short_term:,.2f}, "
+                        f"long-term ₹{sale.long_term:,.2f})")
+
+    def show_pnl(self):
+        """Realized and unrealized P&L for the scope shown, split into short and long term"""
+        try:
+            queues = self.book.load(self.conn, self.account_id, self.portfolio_id)
+            realized_rows = realized(self.conn, self.account_id, self.portfolio_id)
+            dividends = dividend_income(self.conn, self.account_id, self.portfolio_id)
+            adjustments = Adjustments.load(self.conn)
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", str(e))
+            return
+        prices = dict(zip(self.engine.symbols.tolist(), self.engine.prices.tolist()))
+        unrealized_rows = self.book.unrealized(queues, prices, adjustments=adjustments)
+        report = format_pnl(realized_rows, unrealized_rows, dividends)
+        unpriced = len({symbol for _, symbol in queues} - {u.symbol for u in unrealized_rows})
+        if unpriced:
+            report += f"\n\n{unpriced} holdings have no price yet and are left out of unrealized P&L"
+        messagebox.showinfo(f"P&L: {self.scope_name()}", report)
 
     def refresh_portfolio(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-
-        self.cursor.execute("""
-            SELECT symbol, SUM(quantity) as total_quantity, AVG(purchase_price) as avg_price
-            FROM portfolio
-            GROUP BY symbol
-        """)
-        portfolio_data = self.cursor.fetchall()
+        portfolio_data = storage.load_holdings(self.conn, self.account_id, self.portfolio_id)
+        self.engine.load(portfolio_data)
+        if self.alert_engine.pnl_rules:
+            self.alert_engine.load_positions(self.conn)
 
         if not portfolio_data:
+            self.render()
             self.status_label.config(text="No stocks in portfolio")
             return
 
-        for symbol, quantity, avg_price in portfolio_data:
-            self.tree.insert('', 'end', values=(symbol, quantity, f"₹{avg_price:.2f}", "Loading...", "Loading...", "Loading..."))
-        self.status_label.config(text="Portfolio loaded")
-
-    def get_stock_price(self, symbol):
-        """Get current stock price using yfinance and convert to INR if needed"""
-        try:
-            stock = yf.Ticker(symbol)
-            info = stock.info
+        # Show last known prices straight away, without waiting on the network; on the first
+        # paint the snapshot's prices win over the cache's price_history ones for the holdings it has
+        self.engine.set_prices(cached_prices(self.engine.symbols.tolist(), self.quote_cache, self.fx))
+        if self.snapshot_prices:
+            self.engine.set_prices(self.snapshot_prices)
+            self.snapshot_prices = None
 
-            current_price = info.get('currentPrice') or info.get('regularMarketPrice')
-            currency = info.get('currency', 'USD')  # Get currency of stock
-
-            if current_price is None:
-                return None
-
-            if currency == "INR":
-                return round(current_price, 2)  # Already in rupees
-            else:
-                # Convert USD to INR
-                usd_inr = yf.Ticker("USDINR=X").info.get("regularMarketPrice", None)
-                if usd_inr is None:
-                    print("⚠️ Unable to fetch USD to INR rate")
-                    return None
-                return round(current_price * usd_inr, 2)
+        self.render()
+        self.status_label.config(text="Portfolio loaded")
 
-        except Exception as e:
-            print(f"Error getting price for {symbol}: {e}")
-            return None
+    def render(self):
+        """Redraw the Treeview from the engine's valuation; only changed rows are touched"""
+        valuation = self.engine.valuation()
+        self.renderer.render(valuation.symbols.tolist(), lambda i: self.format_row(valuation, i))
 
+    def format_row(self, valuation, i):
+        return format_row(valuation, i, self.failed_symbols)
 
+    def get_stock_price(self, symbol):
+        """Get current stock price using the quote provider and convert to INR if needed"""
+        return self.fx.convert_quotes({symbol: self.quote_cache.get_quote(symbol)})[symbol]
+
+    def set_status(self, text):
+        self.status_label.config(text=text)
+
+    def apply_prices(self, prices):
+        """Value the given {symbol: INR price or None}, queue them for price_history and redraw.
+
+        Runs on the Tk main loop; background threads post it through self.ui_queue.
+        """
+        self.engine.set_prices(prices)
+        self.failed_symbols.update(symbol for symbol, price in prices.items() if price is None)
+        self.failed_symbols.difference_update(symbol for symbol, price in prices.items() if price is not None)
+        self.pending_history.update((symbol, price) for symbol, price in prices.items()
+                                    if price is not None and symbol in self.engine.index)
+        self.render()
+        self.check_alerts(prices)
+
+    def check_alerts(self, prices):
+        """Evaluate the alert rules against new prices, saving their state and showing any that fire"""
+        if self.alert_engine.loaded_day != date.today():
+            self.alert_engine.load(self.conn)  # move rules measure from the latest previous close
+        fired = self.alert_engine.update(prices)
+        changes = self.alert_engine.take_changes()
+        if changes:
+            self.db_writer.call(alerts.write_state, changes)
+        if not fired:
+            return
+        try:
+            alerts.append_log(fired)
+        except OSError as e:
+            metrics.log('error', 'alert_log', f"Error writing {alerts.LOG_PATH}: {e}")
+        self.recent_alerts.extend(fired)
+        more = f" (+{len(fired) - 1} more, see Alerts)" if len(fired) > 1 else ""
+        self.set_status(fired[-1].message + more)
+        self.root.bell()
+        if self.alerts_window is not None and self.alerts_window.winfo_exists():
+            self.update_alerts_window()
+
+    def save_price_history(self):
+        """Write all prices applied since the last save in one transaction"""
+        if not self.pending_history:
+            return
+        today = datetime.now().strftime('%Y-%m-%d')
+        self.db_writer.executemany(storage.UPSERT_PRICE,
+                                   [(symbol, price, today) for symbol, price in self.pending_history.items()])
+        if self.analytics is not None:
+            self.analytics[1].update_prices(today, self.pending_history)
+        self.pending_history = {}
+
+    def on_revalidated(self, quotes):
+        """Called on the cache's background thread with freshly fetched quotes"""
+        self.ui_queue.post(self.apply_prices, self.fx.convert_quotes(quotes))
+        self.ui_queue.post(self.save_price_history)
+
+    def refresh_job(self, cancelled):
+        """Time (and optionally profile) one refresh, recording it in the metrics"""
+        profiling, self.profile_next = self.profile_next, False
+        start = time.perf_counter()
+        with metrics.profile() if profiling else nullcontext():
+            symbols, failed = self.fetch_prices(cancelled)
+        seconds = time.perf_counter() - start
+        result = 'cancelled' if cancelled.is_set() else 'done'
+        metrics.observe('refresh_seconds', seconds)
+        metrics.count('refreshes_total', result=result)
+        metrics.log('info', 'refresh', result=result, seconds=round(seconds, 4), symbols=symbols, failed=failed)
+        if profiling:
+            self.ui_queue.post(self.on_profile_saved, metrics.PROFILE_PATH)
+
+    def fetch_prices(self, cancelled):
+        """Fetch prices for every holding in chunks, posting results to the UI as they arrive.
+
+        Returns (symbols fetched, symbols without a price).
+        """
+        self.ui_queue.post(self.set_status, "Updating prices...")
+        symbols = self.engine.symbols.tolist()
+        fetched = failed = 0
+        for prices in fetch_chunks(symbols, self.quote_cache, self.fx, cancelled):
+            fetched += len(prices)
+            failed += sum(1 for price in prices.values() if price is None)
+            self.ui_queue.post(self.apply_prices, prices)
+        self.ui_queue.post(self.save_price_history)
+        if fetched < len(symbols):
+            self.ui_queue.post(self.set_status, "Refresh cancelled")
+            return fetched, failed
+        self.ui_queue.post(self.show_refresh_summary)
+        return fetched, failed
+
+    def save_snapshot(self):
+        if len(self.engine):
+            self.db_writer.call(storage.write_snapshot, self.engine.valuation())
+
+    def show_refresh_summary(self):
+        self.save_snapshot()
+        valuation = self.engine.valuation()
+        stats = self.quote_cache.stats()
+        self.set_status(
+            f"Prices updated: value ₹{valuation.total_value:.2f}, gain/loss ₹{valuation.total_gain_loss:.2f} "
+            f"(cache: {stats['hits']} hits, {stats['stale_hits']} stale, {stats['misses']} misses)"
+        )
 
     def refresh_prices_threaded(self):
-        def refresh_prices():
-            self.status_label.config(text="Updating prices...")
-            for item in self.tree.get_children():
-                values = list(self.tree.item(item)['values'])
-                symbol = values[0]
-                quantity = int(values[1])
-                purchase_price = float(values[2].replace('₹', ''))
-
-                current_price = self.get_stock_price(symbol)
-                if current_price:
-                    gain_loss = (current_price - purchase_price) * quantity
-                    total_value = current_price * quantity
-                    self.tree.item(item, values=(
-                        symbol, quantity, f"₹{purchase_price:.2f}", f"₹{current_price:.2f}", f"₹{gain_loss:.2f}", f"₹{total_value:.2f}"
-                    ))
-                    today = datetime.now().strftime('%Y-%m-%d')
-                    try:
-                        self.cursor.execute("""
-                            INSERT OR REPLACE INTO price_history (symbol, price, date)
-                            VALUES (?, ?, ?)
-                        """, (symbol, current_price, today))
-                        self.conn.commit()
-                    except sqlite3.Error:
-                        pass
-                else:
-                    self.tree.item(item, values=(symbol, quantity, f"₹{purchase_price:.2f}", "Error", "Error", "Error"))
-            self.status_label.config(text="Prices updated")
-
-        thread = threading.Thread(target=refresh_prices)
-        thread.daemon = True
-        thread.start()
+        if not self.refresher.request():
+            self.set_status("Refresh already running; another will follow it")
+
+    def cancel_refresh(self):
+        if self.refresher.is_running():
+            self.refresher.cancel()
+            self.set_status("Cancelling refresh...")
 
     def delete_selected(self):
         selected = self.tree.selection()
@@ -233,46 +523,321 @@ class PortfolioTracker:
             messagebox.showwarning("Warning", "Please select a stock to delete")
             return
 
-        item = selected[0]
-        symbol = self.tree.item(item)['values'][0]
+        symbol = selected[0]
+        if self.account_id is None:
+            messagebox.showwarning("Warning", "Choose an account to delete its positions; the consolidated view spans all of them")
+            return
 
-        if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete all {symbol} positions?"):
+        scope = self.scope_name()
+        if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete all {symbol} positions in {scope}?"):
             try:
-                self.cursor.execute('DELETE FROM portfolio WHERE symbol = ?', (symbol,))
-                self.conn.commit()
+                with metrics.span('db_transaction'):
+                    storage.delete_position(self.conn, symbol, self.account_id, self.portfolio_id)
+                    self.conn.commit()
+                self.book.invalidate(self.portfolio_id, symbol)
+                self.drop_analytics()
                 self.refresh_portfolio()
-                self.status_label.config(text=f"Deleted {symbol} from portfolio")
+                self.status_label.config(text=f"Deleted {symbol} from {scope}")
             except sqlite3.Error as e:
                 messagebox.showerror("Database Error", str(e))
 
-    def export_csv(self):
-        if not self.tree.get_children():
+    def import_trades(self):
+        portfolio_id = self.require_portfolio("import trades into")
+        if portfolio_id is None:
+            return
+        filename = filedialog.askopenfilename(
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
+        )
+        if not filename:
+            return
+
+        def run_import():
+            try:
+                result = importer.import_trades(
+                    filename, self.db_path, portfolio_id=portfolio_id,
+                    progress=lambda rows: self.ui_queue.post(self.set_status, f"Importing... {rows:,} rows read")
+                )
+            except (OSError, ValueError, sqlite3.Error) as e:
+                self.ui_queue.post(messagebox.showerror, "Import Error", str(e))
+                return
+            self.ui_queue.post(self.on_import_done, result)
+
+        self.set_status(f"Importing {filename}...")
+        thread = threading.Thread(target=run_import)
+        thread.daemon = True
+        thread.start()
+
+    def on_import_done(self, result):
+        self.book.clear()
+        self.drop_analytics()
+        self.refresh_portfolio()
+        self.set_status(importer.format_result(result))
+        if result.errors:
+            messagebox.showwarning("Import Warnings", "\n".join(result.errors))
+
+    def export_data(self):
+        if not len(self.engine):
             messagebox.showwarning("Warning", "No data to export")
             return
 
         filename = filedialog.asksaveasfilename(
             defaultextension=".csv",
-            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
+            filetypes=[("CSV files", "*.csv"), ("JSON Lines files", "*.jsonl"), ("Parquet files", "*.parquet"),
+                       ("All files", "*.*")]
         )
 
         if filename:
             try:
-                data = [self.tree.item(item)['values'] for item in self.tree.get_children()]
-                df = pd.DataFrame(data, columns=['Symbol', 'Quantity', 'Purchase Price', 'Current Price', 'Gain/Loss', 'Total Value'])
-                df.to_csv(filename, index=False)
-                self.status_label.config(text=f"Data exported to {filename}")
+                count = exporter.export_valuation(self.engine.valuation(), filename)
+                self.status_label.config(text=f"Exported {count} holdings to {filename}")
                 messagebox.showinfo("Success", f"Portfolio data exported to {filename}")
-            except Exception as e:
+            except (OSError, ValueError) as e:
+                messagebox.showerror("Export Error", str(e))
+
+    def feed_analytics(self, symbol, quantity, price, day, portfolio_id):
+        """Add a trade made here (a sale has quantity < 0) to the kept analytics, if its scope covers portfolio_id"""
+        self.analytics_version += 1
+        if self.analytics is None:
+            return
+        (account_id, scope_portfolio), analytics = self.analytics
+        if scope_portfolio is not None:
+            covered = scope_portfolio == portfolio_id
+        else:
+            covered = account_id is None or storage.portfolio_account(self.conn, portfolio_id) == account_id
+        if covered:
+            analytics.add_lot(symbol, quantity, price, day)
+
+    def drop_analytics(self):
+        """Forget the kept analytics after a change add_lot() can't express; the next Analytics rebuilds them"""
+        self.analytics_version += 1
+        self.analytics = None
+
+    def show_analytics(self):
+        scope = (self.account_id, self.portfolio_id)
+        if self.analytics is not None and self.analytics[0] == scope:
+            messagebox.showinfo("Portfolio Analytics", format_summary(self.analytics[1].summary()))
+            return
+        version = self.analytics_version
+
+        def run_analytics():
+            try:
+                store = HistoryStore()
+                backfill_benchmark(store, self.quote_provider)
+                conn = storage.connect(self.db_path)
+                try:
+                    fx_rates = history_rates(conn, self.fx, *scope)
+                    analytics = PortfolioAnalytics.from_db(conn, store, fx_rates=fx_rates,
+                                                           account_id=scope[0], portfolio_id=scope[1])
+                    summary = analytics.summary()
+                finally:
+                    conn.close()
+            except (OSError, sqlite3.Error, ValueError) as e:
+                self.ui_queue.post(messagebox.showerror, "Analytics Error", str(e))
+                return
+            # add_lot() runs on the UI thread, so symbols first traded later are priced over its connection
+            analytics.column_loader = price_column_loader(self.conn, store, fx_rates)
+            self.ui_queue.post(self.on_analytics_loaded, scope, version, analytics, summary)
+
+        self.set_status("Computing analytics...")
+        thread = threading.Thread(target=run_analytics)
+        thread.daemon = True
+        thread.start()
+
+    def on_analytics_loaded(self, scope, version, analytics, summary):
+        if version == self.analytics_version:
+            self.analytics = (scope, analytics)
+        self.set_status("Ready")
+        messagebox.showinfo("Portfolio Analytics", format_summary(summary))
+
+    def show_chart(self):
+        """Chart portfolio value and the selected holdings' prices (all holdings if none are selected)"""
+        account_id, portfolio_id = self.account_id, self.portfolio_id
+        symbols = list(self.tree.selection()) or None
+        title = f"Chart: {self.scope_name()}"
+
+        def run_load():
+            try:
+                conn = storage.connect(self.db_path)
+                try:
+                    fx_rates = history_rates(conn, self.fx, account_id, portfolio_id)
+                    data = ChartData.load(conn, HistoryStore(), fx_rates, account_id, portfolio_id)
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                self.ui_queue.post(messagebox.showerror, "Chart Error", str(e))
+                return
+            self.ui_queue.post(self.set_status, "Ready")
+            self.ui_queue.post(self.open_chart, data, symbols, title)
+
+        self.set_status("Loading chart...")
+        thread = threading.Thread(target=run_load)
+        thread.daemon = True
+        thread.start()
+
+    def open_chart(self, data, symbols, title):
+        window = tk.Toplevel(self.root)
+        window.title(title)
+        window.geometry("1000x600")
+        view = ChartView(window, data, self.db_path, self.ui_queue.post, symbols)
+        view.canvas.pack(fill=tk.BOTH, expand=True)
+        ttk.Label(window, text="Scroll to zoom, drag to pan, double-click to reset").pack(pady=(0, 5))
+        view.schedule()
+
+    def show_alerts(self):
+        """Open (or raise) a window listing the alert rules and recent alerts, with a form to add rules"""
+        if self.alerts_window is not None and self.alerts_window.winfo_exists():
+            self.alerts_window.lift()
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title("Alerts")
+        window.geometry("700x500")
+        self.alerts_window = window
+
+        form = ttk.Frame(window, padding="10")
+        form.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E))
+        ttk.Label(form, text="Alert when").grid(row=0, column=0, sticky=tk.W)
+        self.alert_symbol = ttk.Entry(form, width=18)
+        self.alert_symbol.grid(row=0, column=1, padx=(5, 5))
+        selected = self.tree.selection()
+        if selected:
+            self.alert_symbol.insert(0, self.tree.item(selected[0])['values'][0])
+        self.alert_kind = ttk.Combobox(form, width=12, state='readonly', values=alerts.KINDS)
+        self.alert_kind.set('above')
+        self.alert_kind.grid(row=0, column=2, padx=(0, 5))
+        self.alert_threshold = ttk.Entry(form, width=12)
+        self.alert_threshold.grid(row=0, column=3, padx=(0, 5))
+        ttk.Button(form, text="Add Alert", command=self.add_alert).grid(row=0, column=4, padx=(5, 0))
+        ttk.Label(form, text="Thresholds are ₹ for prices and P&L, % for moves; P&L limits apply to the selected "
+                             "account (or all accounts)").grid(row=1, column=0, columnspan=5, sticky=tk.W, pady=(5, 0))
+
+        self.rule_tree = ttk.Treeview(window, columns=('ID', 'Rule', 'State'), show='headings', height=8)
+        for col, width in (('ID', 60), ('Rule', 420), ('State', 180)):
+            self.rule_tree.heading(col, text=col)
+            self.rule_tree.column(col, width=width, anchor=tk.W)
+        self.rule_tree.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), padx=10)
+        ttk.Button(window, text="Delete Alert", command=self.delete_alert).grid(row=2, column=0, sticky=tk.W,
+                                                                               padx=10, pady=5)
+        ttk.Label(window, text=f"Log: {alerts.LOG_PATH}").grid(row=2, column=1, sticky=tk.E, padx=10, pady=5)
+
+        self.alert_list = tk.Listbox(window, height=10)
+        self.alert_list.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), padx=10, pady=(0, 10))
+        window.columnconfigure(0, weight=1)
+        window.rowconfigure(1, weight=1)
+        window.rowconfigure(3, weight=1)
+        self.update_alerts_window()
+
+    def update_alerts_window(self):
+        rules = alerts.list_rules(self.conn)
+        self.rule_tree.delete(*self.rule_tree.get_children())
+        for rule in rules[:RULES_SHOWN]:
+            armed = self.alert_engine.armed.get(rule.id, rule.armed)
+            state = "Armed" if armed else f"Fired {rule.triggered_at or ''}".strip()
+            self.rule_tree.insert('', tk.END, iid=str(rule.id), values=(rule.id, alerts.describe_rule(rule), state))
+        self.alert_list.delete(0, tk.END)
+        for alert in reversed(self.recent_alerts):
+            self.alert_list.insert(tk.END, f"{alert.triggered_at}  {alert.message}")
+
+    def add_alert(self):
+        try:
+            alerts.add_rule(self.conn, self.alert_kind.get(), self.alert_threshold.get().strip(),
+                            self.alert_symbol.get(), self.account_id if self.alert_kind.get() in alerts.PNL_KINDS else None)
+        except (sqlite3.Error, ValueError) as e:
+            messagebox.showerror("Alert Error", str(e), parent=self.alerts_window)
+            return
+        self.reload_alerts()
+        self.alert_threshold.delete(0, tk.END)
+        # Check the new rule against the prices on screen straight away
+        valuation = self.engine.valuation()
+        self.check_alerts(dict(zip(valuation.symbols.tolist(), valuation.prices.tolist())))
+
+    def delete_alert(self):
+        selected = self.rule_tree.selection()
+        if not selected:
+            messagebox.showwarning("Warning", "Please select an alert to delete", parent=self.alerts_window)
+            return
+        try:
+            for iid in selected:
+                alerts.delete_rule(self.conn, int(iid))
+        except sqlite3.Error as e:
+            messagebox.showerror("Alert Error", str(e), parent=self.alerts_window)
+        self.reload_alerts()
+
+    def reload_alerts(self):
+        self.alert_engine.load(self.conn)
+        self.update_alerts_window()
+
+    def show_diagnostics(self):
+        """Open (or raise) a window with live timings, counters, recent errors and the profiler toggle"""
+        if self.diagnostics is not None and self.diagnostics.winfo_exists():
+            self.diagnostics.lift()
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title("Diagnostics")
+        window.geometry("700x500")
+        self.diagnostics = window
+
+        text = tk.Text(window, wrap=tk.NONE, font=('TkFixedFont', 9))
+        text.grid(row=0, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), padx=10, pady=10)
+        self.profile_var = tk.BooleanVar(value=self.profile_next)
+        ttk.Checkbutton(window, text="Profile next refresh", variable=self.profile_var,
+                        command=lambda: setattr(self, 'profile_next', self.profile_var.get())
+                        ).grid(row=1, column=0, sticky=tk.W, padx=10, pady=(0, 10))
+        ttk.Button(window, text="Export Metrics", command=self.export_metrics).grid(row=1, column=1, pady=(0, 10))
+        ttk.Label(window, text=f"Log: {metrics.LOG_PATH}").grid(row=1, column=2, sticky=tk.E, padx=10, pady=(0, 10))
+        window.columnconfigure(0, weight=1)
+        window.rowconfigure(0, weight=1)
+
+        def update():
+            if not window.winfo_exists():
+                return
+            report = metrics.format_report(metrics.REGISTRY.snapshot())
+            if self.last_profile:
+                report += "\n\nLast profiled refresh\n" + self.last_profile
+            position = text.yview()[0]
+            text.delete('1.0', tk.END)
+            text.insert('1.0', report)
+            text.yview_moveto(position)
+            window.after(1000, update)
+
+        update()
+
+    def on_profile_saved(self, path):
+        self.last_profile = metrics.profile_report(path)
+        if self.diagnostics is not None and self.diagnostics.winfo_exists():
+            self.profile_var.set(False)
+        self.set_status(f"Refresh profile saved to {path}")
+
+    def export_metrics(self):
+        filename = filedialog.asksaveasfilename(
+            initialfile=metrics.PROMETHEUS_PATH, defaultextension=".prom",
+            filetypes=[("Prometheus text", "*.prom"), ("All files", "*.*")]
+        )
+        if filename:
+            try:
+                metrics.REGISTRY.write_prometheus(filename)
+                self.set_status(f"Metrics written to {filename}")
+            except OSError as e:
                 messagebox.showerror("Export Error", str(e))
 
-    def __del__(self):
-        if hasattr(self, 'conn'):
-            self.conn.close()
+    def on_close(self):
+        self.refresher.cancel()
+        self.save_price_history()
+        self.save_snapshot()
+        self.db_writer.close()
+        self.conn.close()
+        self.root.destroy()
 
 def main():
+    try:
+        metrics.REGISTRY.open_log(metrics.LOG_PATH)
+    except OSError as e:
+        print(f"Error opening log {metrics.LOG_PATH}: {e}")
     root = tk.Tk()
     app = PortfolioTracker(root)
     root.mainloop()
+    metrics.REGISTRY.close_log()
 
 if __name__ == "__main__":
     main()
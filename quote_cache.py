@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+TTL/LRU quote cache for the Stock Portfolio Tracker
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import metrics
+from quotes import Quote
+
+
+class QuoteCache:
+    """Serves quotes from memory, revalidating stale entries in the background.
+
+    Fresh entries (younger than ttl seconds) are returned without touching the
+    provider. Stale entries are returned immediately and refetched on a
+    background thread; on_revalidated(quotes) is called with the new values.
+    Misses are fetched synchronously in one batch. The least recently used
+    entries are evicted beyond max_size.
+    """
+
+    def __init__(self, provider, ttl=60.0, max_size=5000, on_revalidated=None):
+        self.provider = provider
+        self.ttl = ttl
+        self.max_size = max_size
+        self.on_revalidated = on_revalidated
+        self.entries = OrderedDict()  # symbol -> (Quote, fetched_at)
+        self.revalidating = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def store(self, quotes, fetched_at=None):
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        with self.lock:
+            for symbol, quote in quotes.items():
+                if quote is None:
+                    continue
+                self.entries[symbol] = (quote, fetched_at)
+                self.entries.move_to_end(symbol)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def peek(self, symbol):
+        """Return the cached quote for symbol without counting a hit or refetching"""
+        with self.lock:
+            entry = self.entries.get(symbol)
+        return entry[0] if entry else None
+
+    def get_quote(self, symbol):
+        return self.get_quotes([symbol]).get(symbol)
+
+    def get_quotes(self, symbols):
+        now = time.time()
+        quotes = {}
+        stale = []
+        missing = []
+        hits = 0
+        with self.lock:
+            for symbol in dict.fromkeys(symbols):
+                entry = self.entries.get(symbol)
+                if entry is None:
+                    missing.append(symbol)
+                    self.misses += 1
+                    continue
+                self.entries.move_to_end(symbol)
+                quotes[symbol] = entry[0]
+                if now - entry[1] <= self.ttl:
+                    self.hits += 1
+                    hits += 1
+                else:
+                    self.stale_hits += 1
+                    if symbol not in self.revalidating:
+                        self.revalidating.add(symbol)
+                        stale.append(symbol)
+
+        metrics.count('quote_cache_total', hits, result='hit')
+        metrics.count('quote_cache_total', len(quotes) - hits, result='stale')
+        metrics.count('quote_cache_total', len(missing), result='miss')
+        if stale:
+            thread = threading.Thread(target=self.revalidate, args=(stale,))
+            thread.daemon = True
+            thread.start()
+
+        if missing:
+            fetched = self.provider.get_quotes(missing)
+            self.store(fetched)
+            quotes.update(fetched)
+        return quotes
+
+    def revalidate(self, symbols):
+        try:
+            fresh = self.provider.get_quotes(symbols)
+            self.store(fresh)
+        except Exception as e:
+            metrics.log('error', 'quote_revalidate', f"Error revalidating quotes: {e}", symbols=len(symbols))
+            fresh = {}
+        finally:
+            with self.lock:
+                self.revalidating.difference_update(symbols)
+
+        fresh = {symbol: quote for symbol, quote in fresh.items() if quote is not None}
+        if fresh and self.on_revalidated:
+            self.on_revalidated(fresh)
+
+    def warm_from_db(self, cursor, currency='INR'):
+        """Seed the cache with the last recorded price of every symbol in price_history.
+
+        Entries are timestamped with their price date, so they are served at
+        once and revalidated on first use.
+        """
+        cursor.execute("SELECT symbol, price, MAX(date) FROM price_history GROUP BY symbol")
+        count = 0
+        for symbol, price, date in cursor.fetchall():
+            try:
+                fetched_at = datetime.strptime(date, '%Y-%m-%d').timestamp()
+            except ValueError:
+                fetched_at = 0.0
+            self.store({symbol: Quote(symbol, price, currency)}, fetched_at=fetched_at)
+            count += 1
+        return count
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            }
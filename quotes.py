@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Quote providers for the Stock Portfolio Tracker
+"""
+
+import threading
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+import metrics
+
+Quote = namedtuple('Quote', ['symbol', 'price', 'currency'])
+
+# Daily bars as parallel arrays; dates are datetime64[D]
+History = namedtuple('History', ['dates', 'open', 'high', 'low', 'close', 'volume'])
+
+
+STUB_EPOCH = np.datetime64('2000-01-03')
+
+
+class QuoteProvider:
+    """Base class for quote sources. Subclasses implement fetch_quote()."""
+
+    def __init__(self, max_workers=8, timeout=10.0):
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+    def fetch_quote(self, symbol):
+        """Return a Quote for a single symbol, or None if it has no price"""
+        raise NotImplementedError
+
+    def get_quote(self, symbol):
+        return self.get_quotes([symbol]).get(symbol)
+
+    def fetch_history(self, symbol, start=None):
+        """Return a History of daily bars from start (a YYYY-MM-DD string, or all available) to today"""
+        raise NotImplementedError
+
+    def get_quotes(self, symbols):
+        """Fetch many symbols on a bounded thread pool.
+
+        Returns a dict mapping every requested symbol to a Quote, or to None
+        when the fetch failed or ran longer than self.timeout seconds.
+        """
+        with metrics.span('quote_fetch'):
+            quotes = self.map_symbols(self.fetch_quote, symbols)
+        priced = sum(1 for quote in quotes.values() if quote is not None)
+        metrics.count('quotes_total', priced, result='priced')
+        metrics.count('quotes_total', len(quotes) - priced, result='missing')
+        return quotes
+
+    def get_histories(self, starts, timeout=None):
+        """Fetch daily bars for {symbol: start or None} on the thread pool, like get_quotes()"""
+        return self.map_symbols(lambda symbol: self.fetch_history(symbol, starts[symbol]), starts,
+                                timeout=timeout or self.timeout * 6)
+
+    def map_symbols(self, fetch, symbols, timeout=None):
+        """Run fetch(symbol) for each symbol on the pool, giving up on any that take over timeout seconds"""
+        symbols = list(dict.fromkeys(symbols))
+        timeout = timeout or self.timeout
+        results = {}
+        if not symbols:
+            return results
+
+        workers = max(1, min(self.max_workers, len(symbols)))
+        started = {}
+
+        def task(symbol):
+            started[symbol] = time.monotonic()
+            return fetch(symbol)
+
+        # A hung fetch keeps its worker busy, so give up on the whole batch
+        # once every wave of workers could have timed out.
+        waves = -(-len(symbols) // workers)
+        deadline = time.monotonic() + timeout * (waves + 1)
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {executor.submit(task, symbol): symbol for symbol in symbols}
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=min(0.05, timeout), return_when=FIRST_COMPLETED)
+                for future in done:
+                    symbol = futures[future]
+                    try:
+                        results[symbol] = future.result()
+                    except Exception as e:
+                        metrics.log('error', 'quote_fetch', f"Error getting data for {symbol}: {e}", symbol=symbol)
+                        results[symbol] = None
+
+                now = time.monotonic()
+                for future in list(pending):
+                    symbol = futures[future]
+                    start = started.get(symbol)
+                    if now > deadline or (start is not None and now - start > timeout):
+                        metrics.log('error', 'quote_timeout', f"Timed out getting data for {symbol}", symbol=symbol)
+                        results[symbol] = None
+                        pending.discard(future)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return results
+
+
+class YFinanceProvider(QuoteProvider):
+    """Live quotes from Yahoo Finance"""
+
+    @staticmethod
+    def ticker(symbol):
+        # yfinance pulls in pandas and takes most of a second to import, so wait until a quote is needed
+        import yfinance as yf
+        return yf.Ticker(symbol)
+
+    def fetch_quote(self, symbol):
+        info = self.ticker(symbol).info
+        price = info.get('currentPrice') or info.get('regularMarketPrice')
+        if price is None:
+            return None
+        return Quote(symbol, price, info.get('currency') or 'USD')
+
+    def fetch_history(self, symbol, start=None):
+        ticker = self.ticker(symbol)
+        if start:
+            frame = ticker.history(start=start, auto_adjust=False, actions=False)
+        else:
+            frame = ticker.history(period='max', auto_adjust=False, actions=False)
+        if frame is None or frame.empty:
+            return None
+        index = frame.index
+        if getattr(index, 'tz', None) is not None:
+            index = index.tz_localize(None)
+        return History(
+            dates=index.values.astype('datetime64[D]'),
+            open=frame['Open'].to_numpy(dtype=float),
+            high=frame['High'].to_numpy(dtype=float),
+            low=frame['Low'].to_numpy(dtype=float),
+            close=frame['Close'].to_numpy(dtype=float),
+            volume=frame['Volume'].to_numpy(dtype=float),
+        )
+
+
+class StubProvider(QuoteProvider):
+    """Offline provider with deterministic prices, for tests and benchmarks"""
+
+    def __init__(self, prices=None, currency='INR', currencies=None, latency=0.0, max_workers=8, timeout=10.0):
+        super().__init__(max_workers=max_workers, timeout=timeout)
+        self.prices = dict(prices or {})
+        self.currency = currency
+        self.currencies = dict(currencies or {})
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def fetch_quote(self, symbol):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        price = self.prices.get(symbol)
+        if price is None:
+            price = 100 + (zlib.crc32(symbol.encode()) % 400000) / 100
+        return Quote(symbol, round(price, 2), self.currencies.get(symbol, self.currency))
+
+    def fetch_history(self, symbol, start=None):
+        """A deterministic random walk over business days since STUB_EPOCH, sliced from start"""
+        if self.latency:
+            time.sleep(self.latency)
+        dates = np.arange(STUB_EPOCH, np.datetime64('today', 'D'), dtype='datetime64[D]')
+        dates = dates[np.is_busday(dates)]
+        rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+        close = (100 + zlib.crc32(symbol.encode()) % 900) * np.exp(np.cumsum(rng.normal(0.0003, 0.015, len(dates))))
+        spread = np.abs(rng.normal(0, 0.01, len(dates))) * close
+        open_ = np.concatenate(([close[0]], close[:-1]))
+        volume = rng.integers(10000, 1000000, len(dates)).astype(float)
+        keep = dates >= np.datetime64(start, 'D') if start else slice(None)
+        return History(dates[keep], open_[keep], np.maximum(open_, close)[keep] + spread[keep],
+                       np.minimum(open_, close)[keep] - spread[keep], close[keep], volume[keep])
+
+    def map_symbols(self, fetch, symbols, timeout=None):
+        if self.latency:
+            return super().map_symbols(fetch, symbols, timeout=timeout)
+        return {symbol: fetch(symbol) for symbol in dict.fromkeys(symbols)}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark quote fetching against the offline stub provider")
+    parser.add_argument('--symbols', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    symbols = [f"SYM{i}.NS" for i in range(args.symbols)]
+    provider = StubProvider(latency=args.latency, max_workers=args.workers)
+    start = time.perf_counter()
+    quotes = provider.get_quotes(symbols)
+    elapsed = time.perf_counter() - start
+    print(f"Fetched {len(quotes)} quotes in {elapsed:.2f}s ({len(quotes) / elapsed:.0f} quotes/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,27 +3,20 @@
 Simple launcher for the Stock Portfolio Tracker
 """
 
+import importlib.util
 import sys
 import subprocess
 import os
 
 def check_dependencies():
-    """Check if required packages are installed"""
+    """Check if required packages are installed, without importing them"""
     missing_packages = []
 
-    try:
-        import yfinance
-    except ImportError:
-        missing_packages.append('yfinance')
-
-    try:
-        import pandas
-    except ImportError:
-        missing_packages.append('pandas')
+    for package in ('yfinance', 'pandas', 'numpy'):
+        if importlib.util.find_spec(package) is None:
+            missing_packages.append(package)
 
-    try:
-        import tkinter
-    except ImportError:
+    if importlib.util.find_spec('tkinter') is None:
         missing_packages.append('tkinter (usually comes with Python)')
 
     if missing_packages:
@@ -3,36 +3,13 @@
 Setup demo data for the Stock Portfolio Tracker
 """
 
-import sqlite3
-from datetime import datetime
+import storage
 
 def setup_demo_data():
     """Add some demo stocks to the portfolio"""
-    conn = sqlite3.connect('portfolio.db')
+    conn = storage.connect()
     cursor = conn.cursor()
 
-    # Create tables if they don't exist
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS portfolio (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            symbol TEXT NOT NULL,
-            quantity INTEGER NOT NULL,
-            purchase_price REAL NOT NULL,
-            purchase_date TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS price_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            symbol TEXT NOT NULL,
-            price REAL NOT NULL,
-            date TEXT NOT NULL,
-            UNIQUE(symbol, date)
-        )
-    """)
-
     # Demo stocks with realistic purchase prices
     demo_stocks = [
         ('AAPL', 10, 150.00, '2024-01-15'),
@@ -50,11 +27,11 @@ def setup_demo_data():
     cursor.execute('DELETE FROM portfolio')
     cursor.execute('DELETE FROM price_history')
 
+    cursor.executemany("""
+        INSERT INTO portfolio (symbol, quantity, purchase_price, purchase_date)
+        VALUES (?, ?, ?, ?)
+    """, demo_stocks)
     for symbol, quantity, price, date in demo_stocks:
-        cursor.execute("""
-            INSERT INTO portfolio (symbol, quantity, purchase_price, purchase_date)
-            VALUES (?, ?, ?, ?)
-        """, (symbol, quantity, price, date))
         print(f"Added {quantity} shares of {symbol} at ${price}")
 
     conn.commit()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the Stock Portfolio Tracker
+
+Each run starts a fresh interpreter against a generated database holding a
+saved valuation snapshot, and measures the time from the first import to
+the first painted frame of the portfolio. Without a display the same steps
+are timed without Tk. The run fails if the median exceeds the budget or if
+a heavy module (yfinance, pandas) was imported before first paint.
+"""
+
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+STARTUP_BUDGET_MS = 1000
+HEAVY_MODULES = ('yfinance', 'pandas')
+
+
+def build_database(path, positions):
+    """Create a database with positions holdings and a snapshot pricing all of them"""
+    import storage
+    from engine import PortfolioEngine
+    from quotes import StubProvider
+
+    conn = storage.connect(path)
+    symbols = [f"BENCH{i}.NS" for i in range(positions)]
+    storage.bulk_insert_lots(conn, [(symbol, 10, 100.0, '2024-01-01', f"bench:{symbol}") for symbol in symbols])
+    engine = PortfolioEngine()
+    engine.load(storage.load_holdings(conn))
+    engine.set_prices({symbol: quote.price for symbol, quote in StubProvider().get_quotes(symbols).items()})
+    storage.save_snapshot(conn, engine.valuation())
+    conn.close()
+
+
+def first_frame_headless(db_path):
+    """The work PortfolioTracker does before its first paint, minus Tk; returns (rows drawn, rows priced)"""
+    import storage
+    from engine import PortfolioEngine
+    from fx import FxRates
+    from quote_cache import QuoteCache
+    from quotes import StubProvider
+    from tree_view import VIRTUAL_THRESHOLD
+
+    provider = StubProvider()
+    cache = QuoteCache(provider)
+    conn = storage.connect(db_path)
+    snapshot = storage.load_snapshot(conn)
+    engine = PortfolioEngine()
+    holdings = storage.load_holdings(conn)
+    engine.load(holdings)
+    if snapshot is not None:
+        engine.set_prices({symbol: price for symbol, _, _, price in snapshot[1]})
+    cached = {symbol: cache.peek(symbol) for symbol, _, _ in holdings}
+    engine.set_prices(FxRates(provider).convert_quotes({s: q for s, q in cached.items() if q}, fetch=False))
+    valuation = engine.valuation()
+    # Past VIRTUAL_THRESHOLD rows the tree only draws a window of them
+    shown = min(len(engine), VIRTUAL_THRESHOLD)
+    rows = [(symbol, f"₹{price:.2f}") for symbol, price in zip(valuation.symbols[:shown].tolist(),
+                                                              valuation.prices[:shown].tolist())]
+    conn.close()
+    return rows, int((valuation.prices == valuation.prices).sum())
+
+
+def child(db_path, gui):
+    """Run in a fresh interpreter: time imports and first paint, print the result as JSON"""
+    start = time.perf_counter()
+    import portfolio_tracker
+    imported = time.perf_counter()
+    heavy = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    root = None
+    if gui:
+        import tkinter as tk
+        try:
+            root = tk.Tk()
+        except tk.TclError:
+            root = None
+
+    if root is not None:
+        from quotes import StubProvider
+
+        app = portfolio_tracker.PortfolioTracker(root, db_path, provider=StubProvider())
+        root.update()
+        painted = time.perf_counter()
+        priced = int((app.engine.prices == app.engine.prices).sum())
+        app.refresher.cancel()
+        root.destroy()
+        mode = 'gui'
+    else:
+        _, priced = first_frame_headless(db_path)
+        painted = time.perf_counter()
+        mode = 'headless'
+
+    print(json.dumps({
+        'mode': mode,
+        'import_ms': (imported - start) * 1000,
+        'first_paint_ms': (painted - start) * 1000,
+        'priced_rows': priced,
+        'heavy_modules': heavy,
+    }))
+
+
+def run(positions=1000, repeat=5, gui=True):
+    """Measure repeat cold starts; returns a summary dict with medians"""
+    root = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(root, 'startup.db')
+        build_database(db_path, positions)
+        here = os.path.dirname(os.path.abspath(__file__))
+        runs = []
+        for _ in range(repeat):
+            command = [sys.executable, os.path.join(here, 'startup_bench.py'), '--child', db_path]
+            if not gui:
+                command.append('--headless')
+            output = subprocess.run(command, cwd=here, capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        'positions': positions,
+        'mode': runs[0]['mode'],
+        'import_ms': statistics.median(r['import_ms'] for r in runs),
+        'first_paint_ms': statistics.median(r['first_paint_ms'] for r in runs),
+        'priced_rows': min(r['priced_rows'] for r in runs),
+        'heavy_modules': sorted({name for r in runs for name in r['heavy_modules']}),
+    }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure time to first paint on a cold start")
+    parser.add_argument('--positions', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=STARTUP_BUDGET_MS, help="fail if the median exceeds this")
+    parser.add_argument('--headless', action='store_true', help="skip Tk even if a display is available")
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--child', metavar='DB', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, gui=not args.headless)
+        return
+
+    result = run(args.positions, args.repeat, gui=not args.headless)
+    failures = []
+    if result['first_paint_ms'] > args.max_ms:
+        failures.append(f"first paint {result['first_paint_ms']:.0f} ms is over the {args.max_ms:.0f} ms budget")
+    if result['heavy_modules']:
+        failures.append(f"{', '.join(result['heavy_modules'])} imported before first paint")
+    if result['priced_rows'] < result['positions']:
+        failures.append(f"only {result['priced_rows']} of {result['positions']} rows priced at first paint")
+
+    if args.json:
+        print(json.dumps(dict(result, failures=failures), indent=2))
+    else:
+        print(f"🚀 Cold start ({result['mode']}, {result['positions']} positions, median of {args.repeat}): "
+              f"import {result['import_ms']:.0f} ms, first paint {result['first_paint_ms']:.0f} ms")
+        for failure in failures:
+            print(f"❌ {failure}")
+        if not failures:
+            print("✅ Within budget")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
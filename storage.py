@@ -0,0 +1,651 @@
+#!/usr/bin/env python3
+"""
+SQLite storage for the Stock Portfolio Tracker
+
+Every connection should come from connect(), which applies the pragmas and
+brings the schema up to date. Schema changes are appended to MIGRATIONS;
+never edit a migration that has already shipped.
+"""
+
+import json
+import sqlite3
+from datetime import datetime
+
+import corporate_actions
+
+DB_PATH = 'portfolio.db'
+
+HOLDINGS_INSERT_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS holdings_lot_insert AFTER INSERT ON portfolio BEGIN
+        INSERT INTO holdings (symbol, quantity, cost, lots)
+        VALUES (NEW.symbol, NEW.quantity, NEW.quantity * NEW.purchase_price, 1)
+        ON CONFLICT(symbol) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            cost = cost + excluded.cost,
+            lots = lots + 1;
+    END
+"""
+
+# From migration 6 holdings are kept per portfolio; lots carry their portfolio and its account
+LOT_INSERT_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS holdings_lot_insert AFTER INSERT ON portfolio BEGIN
+        INSERT INTO holdings (portfolio_id, account_id, symbol, quantity, cost, lots)
+        VALUES (NEW.portfolio_id, NEW.account_id, NEW.symbol, NEW.quantity, NEW.quantity * NEW.purchase_price, 1)
+        ON CONFLICT(portfolio_id, symbol) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            cost = cost + excluded.cost,
+            lots = lots + 1;
+    END
+"""
+
+# From migration 10 the insert trigger stands aside while bulk_insert_lots() sets lot_trigger_guard
+GUARDED_LOT_INSERT_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS holdings_lot_insert AFTER INSERT ON portfolio
+    WHEN NOT (SELECT suspended FROM lot_trigger_guard) BEGIN
+        INSERT INTO holdings (portfolio_id, account_id, symbol, quantity, cost, lots)
+        VALUES (NEW.portfolio_id, NEW.account_id, NEW.symbol, NEW.quantity, NEW.quantity * NEW.purchase_price, 1)
+        ON CONFLICT(portfolio_id, symbol) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            cost = cost + excluded.cost,
+            lots = lots + 1;
+    END
+"""
+
+DEFAULT_ACCOUNT = 1
+DEFAULT_PORTFOLIO = 1
+
+MIGRATIONS = [
+    # 1: original tables (IF NOT EXISTS, so databases created before migrations adopt them as-is)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS portfolio (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            symbol TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            purchase_price REAL NOT NULL,
+            purchase_date TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS price_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            symbol TEXT NOT NULL,
+            price REAL NOT NULL,
+            date TEXT NOT NULL,
+            UNIQUE(symbol, date)
+        )
+        """,
+    ],
+    # 2: indexes for lookups by symbol and by day (UNIQUE(symbol, date) already covers symbol ranges)
+    [
+        "CREATE INDEX IF NOT EXISTS idx_portfolio_symbol ON portfolio(symbol)",
+        "CREATE INDEX IF NOT EXISTS idx_price_history_date ON price_history(date, symbol)",
+    ],
+    # 3: per-symbol holdings kept in step with portfolio lots by triggers
+    [
+        """
+        CREATE TABLE IF NOT EXISTS holdings (
+            symbol TEXT PRIMARY KEY,
+            quantity INTEGER NOT NULL,
+            cost REAL NOT NULL,
+            lots INTEGER NOT NULL
+        )
+        """,
+        HOLDINGS_INSERT_TRIGGER,
+        """
+        CREATE TRIGGER IF NOT EXISTS holdings_lot_delete AFTER DELETE ON portfolio BEGIN
+            UPDATE holdings SET
+                quantity = quantity - OLD.quantity,
+                cost = cost - OLD.quantity * OLD.purchase_price,
+                lots = lots - 1
+            WHERE symbol = OLD.symbol;
+            DELETE FROM holdings WHERE symbol = OLD.symbol AND lots <= 0;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS holdings_lot_update
+        AFTER UPDATE OF symbol, quantity, purchase_price ON portfolio BEGIN
+            UPDATE holdings SET
+                quantity = quantity - OLD.quantity,
+                cost = cost - OLD.quantity * OLD.purchase_price,
+                lots = lots - 1
+            WHERE symbol = OLD.symbol;
+            DELETE FROM holdings WHERE symbol = OLD.symbol AND lots <= 0;
+            INSERT INTO holdings (symbol, quantity, cost, lots)
+            VALUES (NEW.symbol, NEW.quantity, NEW.quantity * NEW.purchase_price, 1)
+            ON CONFLICT(symbol) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                cost = cost + excluded.cost,
+                lots = lots + 1;
+        END
+        """,
+        "DELETE FROM holdings",
+        """
+        INSERT INTO holdings (symbol, quantity, cost, lots)
+        SELECT symbol, SUM(quantity), SUM(quantity * purchase_price), COUNT(*)
+        FROM portfolio
+        GROUP BY symbol
+        """,
+    ],
+    # 4: natural key of imported trades, so re-importing a file skips rows already loaded
+    [
+        "ALTER TABLE portfolio ADD COLUMN import_key TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_portfolio_import_key ON portfolio(import_key)",
+    ],
+    # 5: valuation snapshots, so the app can show the last known values before any quote arrives
+    [
+        """
+        CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            taken_at TEXT NOT NULL,
+            total_cost REAL NOT NULL,
+            total_value REAL NOT NULL,
+            positions INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS snapshot_positions (
+            snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+            symbol TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            avg_cost REAL NOT NULL,
+            price REAL,
+            PRIMARY KEY (snapshot_id, symbol)
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 6: accounts and their portfolios; existing lots move to a default account's portfolio
+    [
+        """
+        CREATE TABLE IF NOT EXISTS accounts (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS portfolios (
+            id INTEGER PRIMARY KEY,
+            account_id INTEGER NOT NULL REFERENCES accounts(id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(account_id, name)
+        )
+        """,
+        f"INSERT INTO accounts (id, name) VALUES ({DEFAULT_ACCOUNT}, 'Default')",
+        f"INSERT INTO portfolios (id, account_id, name) VALUES ({DEFAULT_PORTFOLIO}, {DEFAULT_ACCOUNT}, 'Main')",
+        f"ALTER TABLE portfolio ADD COLUMN account_id INTEGER NOT NULL DEFAULT {DEFAULT_ACCOUNT}",
+        f"ALTER TABLE portfolio ADD COLUMN portfolio_id INTEGER NOT NULL DEFAULT {DEFAULT_PORTFOLIO}",
+        "CREATE INDEX IF NOT EXISTS idx_portfolio_account_symbol ON portfolio(account_id, symbol)",
+        "CREATE INDEX IF NOT EXISTS idx_portfolio_portfolio_symbol ON portfolio(portfolio_id, symbol)",
+        # The same broker file may be imported into several portfolios
+        "DROP INDEX IF EXISTS idx_portfolio_import_key",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_portfolio_import_key ON portfolio(portfolio_id, import_key)",
+        "DROP TRIGGER IF EXISTS holdings_lot_insert",
+        "DROP TRIGGER IF EXISTS holdings_lot_delete",
+        "DROP TRIGGER IF EXISTS holdings_lot_update",
+        "DROP TABLE IF EXISTS holdings",
+        """
+        CREATE TABLE holdings (
+            portfolio_id INTEGER NOT NULL,
+            account_id INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            cost REAL NOT NULL,
+            lots INTEGER NOT NULL,
+            PRIMARY KEY (portfolio_id, symbol)
+        )
+        """,
+        # Covering indexes, so per-account and consolidated reads never touch the table
+        "CREATE INDEX IF NOT EXISTS idx_holdings_account_symbol ON holdings(account_id, symbol, quantity, cost)",
+        "CREATE INDEX IF NOT EXISTS idx_holdings_symbol ON holdings(symbol, quantity, cost)",
+        LOT_INSERT_TRIGGER,
+        """
+        CREATE TRIGGER IF NOT EXISTS holdings_lot_delete AFTER DELETE ON portfolio BEGIN
+            UPDATE holdings SET
+                quantity = quantity - OLD.quantity,
+                cost = cost - OLD.quantity * OLD.purchase_price,
+                lots = lots - 1
+            WHERE portfolio_id = OLD.portfolio_id AND symbol = OLD.symbol;
+            DELETE FROM holdings WHERE portfolio_id = OLD.portfolio_id AND symbol = OLD.symbol AND lots <= 0;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS holdings_lot_update
+        AFTER UPDATE OF symbol, quantity, purchase_price, portfolio_id, account_id ON portfolio BEGIN
+            UPDATE holdings SET
+                quantity = quantity - OLD.quantity,
+                cost = cost - OLD.quantity * OLD.purchase_price,
+                lots = lots - 1
+            WHERE portfolio_id = OLD.portfolio_id AND symbol = OLD.symbol;
+            DELETE FROM holdings WHERE portfolio_id = OLD.portfolio_id AND symbol = OLD.symbol AND lots <= 0;
+            INSERT INTO holdings (portfolio_id, account_id, symbol, quantity, cost, lots)
+            VALUES (NEW.portfolio_id, NEW.account_id, NEW.symbol, NEW.quantity, NEW.quantity * NEW.purchase_price, 1)
+            ON CONFLICT(portfolio_id, symbol) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                cost = cost + excluded.cost,
+                lots = lots + 1;
+        END
+        """,
+        """
+        INSERT INTO holdings (portfolio_id, account_id, symbol, quantity, cost, lots)
+        SELECT portfolio_id, account_id, symbol, SUM(quantity), SUM(quantity * purchase_price), COUNT(*)
+        FROM portfolio
+        GROUP BY portfolio_id, symbol
+        """,
+    ],
+    # 7: alert rules; armed is cleared when a rule fires and set again once the price moves back
+    [
+        """
+        CREATE TABLE IF NOT EXISTS alert_rules (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL CHECK (kind IN ('above', 'below', 'move_up', 'move_down', 'pnl_above', 'pnl_below')),
+            symbol TEXT,
+            account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE,
+            threshold REAL NOT NULL,
+            reference REAL,
+            armed INTEGER NOT NULL DEFAULT 1,
+            triggered_at TEXT,
+            note TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            CHECK ((kind IN ('pnl_above', 'pnl_below')) = (symbol IS NULL))
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_alert_rules_symbol ON alert_rules(symbol)",
+    ],
+    # 8: sales and the lots each was matched against; lots hold only what is still open
+    [
+        """
+        CREATE TABLE IF NOT EXISTS sales (
+            id INTEGER PRIMARY KEY,
+            portfolio_id INTEGER NOT NULL REFERENCES portfolios(id) ON DELETE CASCADE,
+            account_id INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            quantity INTEGER NOT NULL CHECK (quantity > 0),
+            price REAL NOT NULL,
+            sale_date TEXT NOT NULL,
+            method TEXT NOT NULL CHECK (method IN ('fifo', 'specific')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_sales_portfolio_symbol ON sales(portfolio_id, symbol, sale_date)",
+        "CREATE INDEX IF NOT EXISTS idx_sales_account_date ON sales(account_id, sale_date)",
+        # lot_id is not a foreign key: a lot is deleted once it has been sold in full
+        """
+        CREATE TABLE IF NOT EXISTS lot_matches (
+            sale_id INTEGER NOT NULL REFERENCES sales(id) ON DELETE CASCADE,
+            lot_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            purchase_price REAL NOT NULL,
+            purchase_date TEXT NOT NULL,
+            long_term INTEGER NOT NULL,
+            PRIMARY KEY (sale_id, lot_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_lot_matches_lot ON lot_matches(lot_id)",
+    ],
+    # 9: splits, bonus issues and dividends; cumulative is the product of the symbol's ratios from ex_date on
+    [
+        """
+        CREATE TABLE IF NOT EXISTS corporate_actions (
+            id INTEGER PRIMARY KEY,
+            symbol TEXT NOT NULL,
+            kind TEXT NOT NULL CHECK (kind IN ('split', 'bonus', 'dividend')),
+            ex_date TEXT NOT NULL,
+            ratio REAL NOT NULL DEFAULT 1,
+            amount REAL NOT NULL DEFAULT 0,
+            cumulative REAL NOT NULL DEFAULT 1,
+            note TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(symbol, ex_date, kind)
+        )
+        """,
+    ],
+    # 10: a one-row flag that suspends the lot insert trigger, instead of dropping it during bulk inserts
+    [
+        "CREATE TABLE IF NOT EXISTS lot_trigger_guard (suspended INTEGER NOT NULL)",
+        "INSERT INTO lot_trigger_guard (suspended) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM lot_trigger_guard)",
+        "DROP TRIGGER IF EXISTS holdings_lot_insert",
+        GUARDED_LOT_INSERT_TRIGGER,
+    ],
+    # 11: imported sales carry an import_key like imported lots, so re-importing a tradebook doesn't sell twice
+    [
+        "ALTER TABLE sales ADD COLUMN import_key TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_import_key ON sales(portfolio_id, import_key)",
+    ],
+]
+
+SNAPSHOT_POSITIONS_KEPT = 5  # snapshots whose per-position rows are kept; totals are kept for all
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -20000",
+    "PRAGMA foreign_keys = ON",
+]
+
+UPSERT_PRICE = """
+    INSERT INTO price_history (symbol, price, date)
+    VALUES (?, ?, ?)
+    ON CONFLICT(symbol, date) DO UPDATE SET price = excluded.price
+"""
+
+
+def connect(path=DB_PATH, timeout=30):
+    """Open a connection with the tuned pragmas and an up-to-date schema"""
+    conn = sqlite3.connect(path, timeout=timeout)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    migrate(conn)
+    return conn
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply any migrations newer than the database's user_version, each in its own transaction"""
+    while schema_version(conn) < len(MIGRATIONS):
+        # IMMEDIATE takes the write lock first, so concurrent connections migrate one at a time
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(conn)
+            if version < len(MIGRATIONS):
+                for statement in MIGRATIONS[version]:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    return schema_version(conn)
+
+
+def load_holdings(conn, account_id=None, portfolio_id=None):
+    """Return (symbol, quantity, weighted average cost) for every held symbol.
+
+    Scoped to one portfolio or one account when given; otherwise the
+    consolidated book across all accounts. Symbols with a split or bonus
+    issue are counted in today's shares (see corporate_actions).
+    """
+    if portfolio_id is not None:
+        rows = conn.execute("""
+            SELECT symbol, quantity, cost / quantity
+            FROM holdings
+            WHERE portfolio_id = ? AND quantity > 0
+            ORDER BY symbol
+        """, (portfolio_id,)).fetchall()
+        return corporate_actions.adjust_positions(conn, rows, where="portfolio_id = ?", args=(portfolio_id,))
+    if account_id is not None:
+        rows = conn.execute("""
+            SELECT symbol, SUM(quantity), SUM(cost) / SUM(quantity)
+            FROM holdings
+            WHERE account_id = ? AND quantity > 0
+            GROUP BY symbol
+            ORDER BY symbol
+        """, (account_id,)).fetchall()
+        return corporate_actions.adjust_positions(conn, rows, where="account_id = ?", args=(account_id,))
+    rows = conn.execute("""
+        SELECT symbol, SUM(quantity), SUM(cost) / SUM(quantity)
+        FROM holdings
+        WHERE quantity > 0
+        GROUP BY symbol
+        ORDER BY symbol
+    """).fetchall()
+    return corporate_actions.adjust_positions(conn, rows)
+
+
+def load_account_holdings(conn):
+    """Return (account_id, symbol, quantity, weighted average cost) for every account's positions, in today's shares"""
+    rows = conn.execute("""
+        SELECT account_id, symbol, SUM(quantity), SUM(cost) / SUM(quantity)
+        FROM holdings
+        WHERE quantity > 0
+        GROUP BY account_id, symbol
+        ORDER BY account_id, symbol
+    """).fetchall()
+    return corporate_actions.adjust_positions(conn, rows, key_columns=2)
+
+
+def rebuild_holdings(conn):
+    """Recompute the holdings table from scratch from the portfolio lots"""
+    with conn:
+        conn.execute("DELETE FROM holdings")
+        conn.execute("""
+            INSERT INTO holdings (portfolio_id, account_id, symbol, quantity, cost, lots)
+            SELECT portfolio_id, account_id, symbol, SUM(quantity), SUM(quantity * purchase_price), COUNT(*)
+            FROM portfolio
+            GROUP BY portfolio_id, symbol
+        """)
+
+
+def check_holdings(conn, repair=False, tolerance=1e-6):
+    """Compare holdings with an aggregate over all lots.
+
+    Returns the symbols that disagree in any portfolio; with repair=True the
+    table is rebuilt when any do.
+    """
+    expected = {(portfolio_id, symbol): (quantity, cost, lots)
+                for portfolio_id, symbol, quantity, cost, lots in conn.execute("""
+        SELECT portfolio_id, symbol, SUM(quantity), SUM(quantity * purchase_price), COUNT(*)
+        FROM portfolio
+        GROUP BY portfolio_id, symbol
+    """)}
+    actual = {(portfolio_id, symbol): (quantity, cost, lots)
+              for portfolio_id, symbol, quantity, cost, lots in conn.execute(
+                  "SELECT portfolio_id, symbol, quantity, cost, lots FROM holdings")}
+
+    mismatched = set()
+    for key in set(expected) | set(actual):
+        want = expected.get(key)
+        got = actual.get(key)
+        if (want is None or got is None or want[0] != got[0] or want[2] != got[2]
+                or abs(want[1] - got[1]) > tolerance * max(1.0, abs(want[1]))):
+            mismatched.add(key[1])
+
+    if mismatched and repair:
+        rebuild_holdings(conn)
+    return sorted(mismatched)
+
+
+def bulk_insert_lots(conn, rows, portfolio_id=DEFAULT_PORTFOLIO):
+    """Insert (symbol, quantity, purchase_price, purchase_date, import_key) lots into a portfolio in one transaction.
+
+    Rows whose import_key is already present in the portfolio are skipped.
+    Instead of firing the per-lot holdings trigger, holdings are updated once
+    per symbol from the aggregate of the new lots. The trigger is suspended
+    through lot_trigger_guard inside the transaction, so other connections
+    never see it off and a failure rolls the flag back with the lots.
+    Returns the number of lots inserted.
+    """
+    account_id = portfolio_account(conn, portfolio_id)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM portfolio").fetchone()[0]
+        conn.execute("UPDATE lot_trigger_guard SET suspended = 1")
+        cursor = conn.executemany("""
+            INSERT OR IGNORE INTO portfolio
+                (symbol, quantity, purchase_price, purchase_date, import_key, account_id, portfolio_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (tuple(row) + (account_id, portfolio_id) for row in rows))
+        inserted = cursor.rowcount
+        conn.execute("""
+            INSERT INTO holdings (portfolio_id, account_id, symbol, quantity, cost, lots)
+            SELECT portfolio_id, account_id, symbol, SUM(quantity), SUM(quantity * purchase_price), COUNT(*)
+            FROM portfolio
+            WHERE id > ?
+            GROUP BY symbol
+            ON CONFLICT(portfolio_id, symbol) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                cost = cost + excluded.cost,
+                lots = lots + excluded.lots
+        """, (last_id,))
+        conn.execute("UPDATE lot_trigger_guard SET suspended = 0")
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return inserted
+
+
+def portfolio_account(conn, portfolio_id):
+    """The account owning portfolio_id; raises ValueError if there is no such portfolio"""
+    row = conn.execute("SELECT account_id FROM portfolios WHERE id = ?", (portfolio_id,)).fetchone()
+    if row is None:
+        raise ValueError(f"No portfolio with id {portfolio_id}")
+    return row[0]
+
+
+def insert_lot(conn, symbol, quantity, price, purchase_date, portfolio_id=DEFAULT_PORTFOLIO):
+    """Insert one lot into a portfolio without committing; returns its id"""
+    return conn.execute("""
+        INSERT INTO portfolio (symbol, quantity, purchase_price, purchase_date, account_id, portfolio_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (symbol, quantity, price, purchase_date, portfolio_account(conn, portfolio_id), portfolio_id)).lastrowid
+
+
+def delete_position(conn, symbol, account_id=None, portfolio_id=None):
+    """Delete every lot of symbol in a portfolio or account (or everywhere) without committing; returns the count"""
+    if portfolio_id is not None:
+        return conn.execute("DELETE FROM portfolio WHERE portfolio_id = ? AND symbol = ?",
+                            (portfolio_id, symbol)).rowcount
+    if account_id is not None:
+        return conn.execute("DELETE FROM portfolio WHERE account_id = ? AND symbol = ?",
+                            (account_id, symbol)).rowcount
+    return conn.execute("DELETE FROM portfolio WHERE symbol = ?", (symbol,)).rowcount
+
+
+def create_account(conn, name, portfolio='Main'):
+    """Add an account with one portfolio; returns (account_id, portfolio_id)"""
+    name = name.strip()
+    if not name:
+        raise ValueError("Account name cannot be empty")
+    with conn:
+        account_id = conn.execute("INSERT INTO accounts (name) VALUES (?)", (name,)).lastrowid
+        portfolio_id = conn.execute("INSERT INTO portfolios (account_id, name) VALUES (?, ?)",
+                                    (account_id, portfolio)).lastrowid
+    return account_id, portfolio_id
+
+
+def create_portfolio(conn, account_id, name):
+    """Add a portfolio to an account; returns its id"""
+    name = name.strip()
+    if not name:
+        raise ValueError("Portfolio name cannot be empty")
+    with conn:
+        return conn.execute("INSERT INTO portfolios (account_id, name) VALUES (?, ?)", (account_id, name)).lastrowid
+
+
+def list_accounts(conn):
+    """Return (account_id, name) for every account, by name"""
+    return conn.execute("SELECT id, name FROM accounts ORDER BY name COLLATE NOCASE").fetchall()
+
+
+def list_portfolios(conn, account_id=None):
+    """Return (portfolio_id, account_id, name) for one account's portfolios, or all of them"""
+    if account_id is not None:
+        return conn.execute("SELECT id, account_id, name FROM portfolios WHERE account_id = ? ORDER BY name",
+                            (account_id,)).fetchall()
+    return conn.execute("SELECT id, account_id, name FROM portfolios ORDER BY account_id, name").fetchall()
+
+
+def delete_account(conn, account_id):
+    """Remove an account with its portfolios, lots and holdings"""
+    with conn:
+        conn.execute("DELETE FROM portfolio WHERE account_id = ?", (account_id,))
+        conn.execute("DELETE FROM holdings WHERE account_id = ?", (account_id,))
+        conn.execute("DELETE FROM accounts WHERE id = ?", (account_id,))
+
+
+def save_prices(conn, rows):
+    """Upsert (symbol, price, date) rows into price_history in a single transaction"""
+    with conn:
+        conn.executemany(UPSERT_PRICE, rows)
+
+
+def latest_prices(conn, symbols):
+    """Return {symbol: (price, date)} from each symbol's newest price_history row, one index seek per symbol"""
+    return {symbol: (price, day) for symbol, price, day in conn.execute("""
+        SELECT value, price, date FROM json_each(?)
+        JOIN price_history ON price_history.id = (
+            SELECT id FROM price_history WHERE symbol = value ORDER BY date DESC LIMIT 1
+        )
+    """, (json.dumps(list(symbols)),))}
+
+
+def write_snapshot(conn, valuation, taken_at=None, keep=SNAPSHOT_POSITIONS_KEPT):
+    """Record an engine Valuation as the newest snapshot and return its id.
+
+    Does not commit, so it can share a transaction (e.g. a DbWriter batch).
+    Position rows of all but the newest keep snapshots are deleted.
+    """
+    taken_at = taken_at or datetime.now().isoformat(timespec='seconds')
+    snapshot_id = conn.execute("""
+        INSERT INTO snapshots (taken_at, total_cost, total_value, positions) VALUES (?, ?, ?, ?)
+    """, (taken_at, valuation.total_cost, valuation.total_value, len(valuation.symbols))).lastrowid
+    prices = [None if price != price else price for price in valuation.prices.tolist()]
+    conn.executemany("""
+        INSERT INTO snapshot_positions (snapshot_id, symbol, quantity, avg_cost, price) VALUES (?, ?, ?, ?, ?)
+    """, zip([snapshot_id] * len(prices), valuation.symbols.tolist(), valuation.quantities.tolist(),
+             valuation.avg_costs.tolist(), prices))
+    conn.execute("DELETE FROM snapshot_positions WHERE snapshot_id <= ?", (snapshot_id - keep,))
+    return snapshot_id
+
+
+def save_snapshot(conn, valuation, taken_at=None):
+    with conn:
+        return write_snapshot(conn, valuation, taken_at)
+
+
+def load_snapshot(conn):
+    """Return (taken_at, [(symbol, quantity, avg_cost, price)]) for the newest snapshot, or None"""
+    row = conn.execute("SELECT id, taken_at FROM snapshots ORDER BY id DESC LIMIT 1").fetchone()
+    if row is None:
+        return None
+    positions = conn.execute("""
+        SELECT symbol, quantity, avg_cost, price FROM snapshot_positions WHERE snapshot_id = ? ORDER BY symbol
+    """, (row[0],)).fetchall()
+    return row[1], positions
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Portfolio database maintenance")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--check-holdings', action='store_true', help="compare holdings with the lots they aggregate")
+    parser.add_argument('--repair', action='store_true', help="rebuild holdings from lots if they disagree")
+    parser.add_argument('--accounts', action='store_true', help="list accounts and their portfolio ids")
+    parser.add_argument('--create-account', metavar='NAME', help="add an account with one portfolio")
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    print(f"Schema version {schema_version(conn)}")
+    if args.create_account:
+        try:
+            account_id, portfolio_id = create_account(conn, args.create_account)
+            print(f"✅ Created account {account_id} with portfolio {portfolio_id}")
+        except (sqlite3.Error, ValueError) as e:
+            print(f"❌ Could not create account: {e}")
+    if args.accounts or args.create_account:
+        portfolios = list_portfolios(conn)
+        for account_id, name in list_accounts(conn):
+            owned = ', '.join(f"{title} (id {portfolio_id})"
+                              for portfolio_id, owner, title in portfolios if owner == account_id)
+            print(f"{account_id}: {name} - {owned}")
+    if args.check_holdings or args.repair:
+        mismatched = check_holdings(conn, repair=args.repair)
+        if not mismatched:
+            print("✅ Holdings match portfolio lots")
+        else:
+            print(f"❌ Holdings out of step for {len(mismatched)} symbols: {', '.join(mismatched[:10])}")
+            if args.repair:
+                print("🔧 Holdings rebuilt from lots")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
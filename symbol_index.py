@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Symbol search index for the Stock Portfolio Tracker
+
+Suggestions for the Add Stock box come from three structures built over
+the exchange symbol list:
+
+- a prefix trie over tickers (without the .NS/.BO suffix),
+- a prefix trie over the words of each company name,
+- a trigram index over tickers and names, for typos and partial words.
+
+The tries are stored flattened: sorted unique keys plus, for each key, the
+ids of the entries it belongs to, laid out contiguously. Every key under a
+prefix forms one contiguous run found by binary search, so a lookup is two
+bisects and an array slice, and the whole index pickles into a handful of
+arrays. The built index is cached next to the CSV and reused until the
+CSV's size or modification time changes.
+"""
+
+import bisect
+import os
+import pickle
+import re
+import threading
+
+import numpy as np
+
+from symbols import SYMBOLS_CSV, load_symbols
+
+INDEX_VERSION = 1
+MAX_RESULTS = 20
+MIN_COVERAGE = 0.5  # share of the query's trigrams a fuzzy match must contain
+
+WORD = re.compile(r'[a-z0-9&]+')
+
+
+def words(text):
+    return WORD.findall(text.lower())
+
+
+def base_symbol(symbol):
+    """'RELIANCE.NS' -> 'reliance'"""
+    return symbol.rsplit('.', 1)[0].lower() if '.' in symbol else symbol.lower()
+
+
+def trigrams(text):
+    text = f"  {' '.join(words(text))} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class PrefixTrie:
+    """Maps string prefixes to the sorted ids of the entries with a key starting with them"""
+
+    def __init__(self, pairs):
+        pairs = sorted(set(pairs))
+        self.keys = []
+        offsets = []
+        for i, (key, _) in enumerate(pairs):
+            if not self.keys or self.keys[-1] != key:
+                self.keys.append(key)
+                offsets.append(i)
+        offsets.append(len(pairs))
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.ids = np.array([i for _, i in pairs], dtype=np.int32)
+
+    def lookup(self, prefix):
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix + '\uffff', lo)
+        if lo == hi:
+            return np.empty(0, dtype=np.int32)
+        ids = self.ids[self.offsets[lo]:self.offsets[hi]]
+        return ids if hi - lo == 1 else np.unique(ids)
+
+
+class SymbolIndex:
+    def __init__(self, entries):
+        """Build the index over (symbol, name) pairs; results keep the given order within a rank"""
+        self.entries = list(entries)
+        self.symbol_trie = PrefixTrie((base_symbol(symbol), i) for i, (symbol, _) in enumerate(self.entries))
+        self.name_trie = PrefixTrie((word, i) for i, (_, name) in enumerate(self.entries) for word in words(name))
+
+        postings = {}
+        for i, (symbol, name) in enumerate(self.entries):
+            for gram in trigrams(base_symbol(symbol)) | trigrams(name):
+                postings.setdefault(gram, []).append(i)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self.lengths = np.array([len(symbol) + len(name) for symbol, name in self.entries], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def fuzzy(self, query):
+        """Return ids sharing most of query's trigrams, most shared first, then shortest"""
+        grams = trigrams(query)
+        lists = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not lists:
+            return []
+        hits = np.bincount(np.concatenate(lists), minlength=len(self.entries))
+        candidates = np.flatnonzero(hits >= MIN_COVERAGE * len(grams))
+        return candidates[np.lexsort((self.lengths[candidates], -hits[candidates]))].tolist()
+
+    def search(self, query, limit=MAX_RESULTS):
+        """Return up to limit (symbol, name) pairs for a partial ticker or company name.
+
+        Tickers starting with the query come first, then companies with a
+        name word starting with each query word, then fuzzy matches.
+        """
+        query_words = words(query)
+        if not query_words:
+            return []
+
+        found = []
+        seen = set()
+
+        def take(ids):
+            for i in ids:
+                if len(found) >= limit:
+                    return
+                if i not in seen:
+                    seen.add(i)
+                    found.append(i)
+
+        take(self.symbol_trie.lookup(base_symbol(query.strip())).tolist())
+        if len(found) < limit:
+            matches = self.name_trie.lookup(query_words[0])
+            for word in query_words[1:]:
+                matches = np.intersect1d(matches, self.name_trie.lookup(word), assume_unique=True)
+            take(matches.tolist())
+        if len(found) < limit:
+            take(self.fuzzy(query))
+        return [self.entries[i] for i in found]
+
+    @classmethod
+    def load(cls, path=SYMBOLS_CSV, cache_path=None):
+        """Return the index for path, from its cache file if the CSV is unchanged, else rebuilt and cached"""
+        cache_path = cache_path or path + '.idx'
+        try:
+            stat = os.stat(path)
+            key = (INDEX_VERSION, stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            key = None
+
+        if key is not None:
+            try:
+                with open(cache_path, 'rb') as f:
+                    cached_key, index = pickle.load(f)
+                if cached_key == key:
+                    return index
+            except Exception:
+                pass
+
+        index = cls(load_symbols(path))
+        if key is not None:
+            try:
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump((key, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                print(f"Error caching symbol index: {e}")
+        return index
+
+    @classmethod
+    def load_async(cls, callback, path=SYMBOLS_CSV, cache_path=None):
+        """Load the index on a background thread and call callback(index) from that thread"""
+        thread = threading.Thread(target=lambda: callback(cls.load(path, cache_path)))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Search the exchange symbol list")
+    parser.add_argument('query', nargs='+')
+    parser.add_argument('--csv', default=SYMBOLS_CSV)
+    parser.add_argument('--limit', type=int, default=MAX_RESULTS)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = SymbolIndex.load(args.csv)
+    loaded = time.perf_counter()
+    results = index.search(' '.join(args.query), args.limit)
+    searched = time.perf_counter()
+    for symbol, name in results:
+        print(f"{symbol:<20} {name}")
+    print(f"\n{len(results)} of {len(index)} symbols; "
+          f"load {(loaded - start) * 1000:.1f} ms, search {(searched - loaded) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Symbol helpers for the Stock Portfolio Tracker
+"""
+
+import csv
+
+SYMBOLS_CSV = 'nse_symbols.csv'
+
+
+def normalize_symbol(symbol):
+    """Upper-case a ticker and add the NSE suffix, as typed into the Add Stock form"""
+    symbol = str(symbol).upper().strip()
+    if symbol and not symbol.endswith(".NS"):
+        symbol += ".NS"
+    return symbol
+
+
+def load_symbols(path=SYMBOLS_CSV):
+    """Return (symbol, name) pairs from the exchange symbol list"""
+    symbols = []
+    try:
+        with open(path, 'r', newline='') as f:
+            for row in csv.DictReader(f):
+                symbols.append((row['Symbol'], row.get('Name') or ''))
+    except Exception as e:
+        print(f"Error loading symbols: {e}")
+    return symbols
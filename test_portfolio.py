@@ -31,32 +31,11 @@ def test_database_operations():
     print("🧪 Testing database operations...")
 
     try:
-        # Create test database
-        conn = sqlite3.connect('test_portfolio.db')
+        # Create test database with the application's schema
+        from storage import connect
+        conn = connect('test_portfolio.db')
         cursor = conn.cursor()
 
-        # Create tables
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS portfolio (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                symbol TEXT NOT NULL,
-                quantity INTEGER NOT NULL,
-                purchase_price REAL NOT NULL,
-                purchase_date TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS price_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                symbol TEXT NOT NULL,
-                price REAL NOT NULL,
-                date TEXT NOT NULL,
-                UNIQUE(symbol, date)
-            )
-        """)
-
         # Test inserting data
         test_data = [
             ('AAPL', 10, 150.50, '2024-01-15'),
@@ -172,6 +151,1431 @@ def test_csv_export():
         print(f"❌ CSV export test failed: {e}")
         return False
 
+def test_quote_provider():
+    """Test batched quote fetching with the offline stub provider"""
+    print("🧪 Testing quote provider...")
+
+    try:
+        import threading
+        from quotes import StubProvider, Quote
+
+        # Count overlapping fetches instead of timing them, so a loaded machine can't fail the test
+        class CountingProvider(StubProvider):
+            def __init__(self, **kwargs):
+                super().__init__(**kwargs)
+                self.lock = threading.Lock()
+                self.active = 0
+                self.peak = 0
+
+            def fetch_quote(self, symbol):
+                with self.lock:
+                    self.active += 1
+                    self.peak = max(self.peak, self.active)
+                try:
+                    return super().fetch_quote(symbol)
+                finally:
+                    with self.lock:
+                        self.active -= 1
+
+        symbols = [f"SYM{i}.NS" for i in range(40)]
+        provider = CountingProvider(prices={'SYM0.NS': 155.25}, latency=0.02, max_workers=8)
+        quotes = provider.get_quotes(symbols)
+
+        # One slow ticker must not stall the rest of the batch
+        release = threading.Event()
+        finished = threading.Event()
+
+        class SlowProvider(StubProvider):
+            def fetch_quote(self, symbol):
+                if symbol == 'SLOW.NS':
+                    release.wait(10.0)
+                    finished.set()
+                return super().fetch_quote(symbol)
+
+        slow = SlowProvider(latency=0.001, max_workers=4, timeout=0.2)
+        slow_quotes = slow.get_quotes(['SLOW.NS', 'TCS.NS', 'INFY.NS'])
+        returned_early = not finished.is_set()
+        release.set()
+
+        if (len(quotes) == 40 and quotes['SYM0.NS'] == Quote('SYM0.NS', 155.25, 'INR')
+                and provider.calls == 40 and 1 < provider.peak <= 8
+                and slow_quotes['SLOW.NS'] is None and slow_quotes['TCS.NS'] is not None
+                and returned_early):
+            print("✅ Quote provider works")
+            return True
+        else:
+            print("❌ Quote provider failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Quote provider test failed: {e}")
+        return False
+
+def test_fx_conversion():
+    """Test that each currency pair is fetched once and converted correctly"""
+    print("🧪 Testing FX conversion...")
+
+    try:
+        from fx import FxRates
+        from quotes import StubProvider
+
+        provider = StubProvider(
+            prices={'AAPL': 200.0, 'MSFT': 400.0, 'VOD.L': 75.0, 'SAP.DE': 150.0,
+                    'USDINR=X': 83.0, 'GBPINR=X': 105.0, 'EURINR=X': 90.0},
+            currencies={'AAPL': 'USD', 'MSFT': 'USD', 'VOD.L': 'GBp', 'SAP.DE': 'EUR'}
+        )
+        fx = FxRates(provider)
+        symbols = ['AAPL', 'MSFT', 'VOD.L', 'SAP.DE', 'TCS.NS']
+        quotes = provider.get_quotes(symbols)
+        calls_before = provider.calls
+        prices = fx.convert_quotes(quotes)
+        fx_calls = provider.calls - calls_before
+
+        # Rates are cached, so a second refresh makes no FX lookups
+        fx.convert_quotes(quotes)
+        cached_calls = provider.calls - calls_before - fx_calls
+
+        # Per-symbol rates for HistoryStore closes come from the cache only; unknown rates are NaN, not 1.0
+        rates = fx.symbol_rates(quotes)
+        cold = FxRates(provider).symbol_rates(quotes)
+        # ...or come from freshly fetched quotes
+        fetched = FxRates(provider).fetch_symbol_rates(['AAPL', 'TCS.NS'])
+
+        expected = {'AAPL': 16600.0, 'MSFT': 33200.0, 'VOD.L': 78.75, 'SAP.DE': 13500.0,
+                    'TCS.NS': quotes['TCS.NS'].price}
+        if (prices == expected and fx_calls == 3 and cached_calls == 0
+                and rates == {'AAPL': 83.0, 'MSFT': 83.0, 'VOD.L': 1.05, 'SAP.DE': 90.0, 'TCS.NS': 1.0}
+                and cold['TCS.NS'] == 1.0 and cold['AAPL'] != cold['AAPL']
+                and fetched == {'AAPL': 83.0, 'TCS.NS': 1.0}):
+            print("✅ FX conversion correct")
+            return True
+        else:
+            print("❌ FX conversion failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ FX conversion test failed: {e}")
+        return False
+
+def test_quote_cache():
+    """Test TTL/LRU quote caching, background revalidation and warm start"""
+    print("🧪 Testing quote cache...")
+
+    try:
+        import threading
+        from quote_cache import QuoteCache
+        from quotes import StubProvider
+
+        provider = StubProvider()
+        revalidated = threading.Event()
+        cache = QuoteCache(provider, ttl=60, max_size=3, on_revalidated=lambda quotes: revalidated.set())
+
+        cache.get_quotes(['TCS.NS', 'INFY.NS'])
+        cache.get_quotes(['TCS.NS', 'INFY.NS'])
+        calls_after_hits = provider.calls
+
+        # Adding two more symbols evicts the least recently used one
+        cache.get_quotes(['TCS.NS', 'WIPRO.NS', 'ITC.NS'])
+        evicted = cache.peek('INFY.NS') is None
+
+        # Warm start from price_history serves old prices and revalidates them
+        conn = sqlite3.connect(':memory:')
+        cursor = conn.cursor()
+        cursor.execute("CREATE TABLE price_history (symbol TEXT, price REAL, date TEXT, UNIQUE(symbol, date))")
+        cursor.executemany("INSERT INTO price_history VALUES (?, ?, ?)", [
+            ('HDFCBANK.NS', 1500.0, '2024-07-01'), ('HDFCBANK.NS', 1552.5, '2024-07-08')
+        ])
+        warm = QuoteCache(provider, ttl=60, on_revalidated=lambda quotes: revalidated.set())
+        warm.warm_from_db(cursor)
+        conn.close()
+        warm_quote = warm.get_quote('HDFCBANK.NS')
+        revalidated.wait(2)
+
+        stats = cache.stats()
+        if (calls_after_hits == 2 and evicted and stats['hits'] == 3 and stats['misses'] == 4
+                and warm_quote.price == 1552.5 and revalidated.is_set()
+                and warm.peek('HDFCBANK.NS').price != 1552.5):
+            print("✅ Quote cache works")
+            return True
+        else:
+            print("❌ Quote cache failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Quote cache test failed: {e}")
+        return False
+
+def test_portfolio_engine():
+    """Test vectorized valuation in the headless portfolio engine"""
+    print("🧪 Testing portfolio engine...")
+
+    try:
+        import time
+        from engine import PortfolioEngine
+
+        engine = PortfolioEngine()
+        engine.load([('AAPL', 10, 150.00), ('GOOGL', 5, 2800.00), ('MSFT', 8, 380.00)])
+        engine.set_prices({'AAPL': 155.25, 'GOOGL': 2750.00, 'UNKNOWN': 1.0})
+        valuation = engine.valuation()
+
+        # MSFT has no price yet, so it is excluded from totals and weights
+        expected_value = 1552.50 + 13750.00
+        correct = (abs(valuation.gain_loss[0] - 52.50) < 0.01
+                   and abs(valuation.gain_loss[1] - (-250.00)) < 0.01
+                   and abs(valuation.total_value - expected_value) < 0.01
+                   and abs(valuation.weights[0] - 1552.50 / expected_value) < 1e-9
+                   and valuation.weights[2] == 0.0)
+
+        big = PortfolioEngine()
+        big.load((f"SYM{i}.NS", 1 + i % 100, 100.0 + i % 50) for i in range(100000))
+        big.set_prices({f"SYM{i}.NS": 110.0 for i in range(100000)})
+        start = time.perf_counter()
+        big.valuation()
+        elapsed = time.perf_counter() - start
+
+        if correct and elapsed < 0.1:
+            print("✅ Portfolio engine valuation correct")
+            return True
+        else:
+            print("❌ Portfolio engine failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Portfolio engine test failed: {e}")
+        return False
+
+def test_tree_diff():
+    """Test that only changed Treeview rows are inserted, updated or removed"""
+    print("🧪 Testing incremental rendering...")
+
+    try:
+        from tree_view import diff_rows
+
+        shown = {
+            'AAPL': ('AAPL', 10, '₹150.00', '₹155.25'),
+            'GOOGL': ('GOOGL', 5, '₹2800.00', '₹2750.00'),
+            'MSFT': ('MSFT', 8, '₹380.00', '₹395.50'),
+        }
+        keys = ['AAPL', 'MSFT', 'TSLA']
+        rows = [
+            ('AAPL', 10, '₹150.00', '₹155.25'),
+            ('MSFT', 8, '₹380.00', '₹401.00'),
+            ('TSLA', 3, '₹200.00', 'Loading...'),
+        ]
+        inserts, updates, removes = diff_rows(shown, keys, rows)
+
+        if (inserts == [(2, 'TSLA', rows[2])] and updates == [('MSFT', rows[1])]
+                and removes == ['GOOGL'] and diff_rows(dict(zip(keys, rows)), keys, rows) == ([], [], [])):
+            print("✅ Incremental rendering diff correct")
+            return True
+        else:
+            print("❌ Incremental rendering diff failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Incremental rendering test failed: {e}")
+        return False
+
+def test_background_workers():
+    """Test the DB writer thread and refresh coalescing/cancellation"""
+    print("🧪 Testing background workers...")
+
+    try:
+        import threading
+        import time
+        from workers import DbWriter, RefreshController
+
+        conn = sqlite3.connect('test_portfolio.db')
+        conn.execute("CREATE TABLE IF NOT EXISTS price_history (symbol TEXT, price REAL, date TEXT, UNIQUE(symbol, date))")
+        conn.commit()
+
+        # Writes from another thread go through the writer's own connection
+        writer = DbWriter('test_portfolio.db')
+        thread = threading.Thread(target=writer.executemany, args=(
+            "INSERT OR REPLACE INTO price_history VALUES (?, ?, ?)",
+            [(f"SYM{i}.NS", 100.0 + i, '2024-07-08') for i in range(500)]
+        ))
+        thread.start()
+        thread.join()
+        writer.flush()
+
+        # A failing write is rolled back alone, not with the writes batched alongside it
+        errors = []
+        writer.on_error = errors.append
+        gate = threading.Event()
+        writer.call(lambda conn: gate.wait(5))
+        writer.execute("INSERT OR REPLACE INTO price_history VALUES (?, ?, ?)", ('BEFORE.NS', 1.0, '2024-07-08'))
+        writer.execute("INSERT INTO no_such_table VALUES (?)", (1,))
+        writer.execute("INSERT OR REPLACE INTO price_history VALUES (?, ?, ?)", ('AFTER.NS', 1.0, '2024-07-08'))
+        gate.set()
+        writer.flush()
+        writer.close()
+        written = conn.execute("SELECT COUNT(*) FROM price_history").fetchone()[0] - 2
+        survivors = conn.execute("SELECT COUNT(*) FROM price_history WHERE symbol IN ('BEFORE.NS', 'AFTER.NS')"
+                                 ).fetchone()[0]
+        conn.close()
+        os.remove('test_portfolio.db')
+
+        runs = []
+        release = threading.Event()
+
+        def job(cancelled):
+            runs.append(cancelled)
+            release.wait(2)
+
+        controller = RefreshController(job)
+        started = controller.request()
+        coalesced = [controller.request() for _ in range(5)]
+        release.set()
+        deadline = time.time() + 2
+        while controller.is_running() and time.time() < deadline:
+            time.sleep(0.01)
+
+        release.clear()
+        controller.request()
+        controller.request()
+        controller.cancel()
+        release.set()
+        while controller.is_running() and time.time() < deadline:
+            time.sleep(0.01)
+
+        # Five extra clicks make one follow-up run; cancelling drops the queued one
+        if (written == 500 and survivors == 2 and len(errors) == 1 and started and not any(coalesced)
+                and len(runs) == 3 and runs[2].is_set()):
+            print("✅ Background workers work")
+            return True
+        else:
+            print("❌ Background workers failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Background workers test failed: {e}")
+        return False
+
+def test_storage_layer():
+    """Test schema migrations, pragmas and batched price writes"""
+    print("🧪 Testing storage layer...")
+
+    try:
+        import storage
+
+        # A database created by an older version adopts the migrations without losing data
+        conn = sqlite3.connect('test_portfolio.db')
+        conn.execute("""
+            CREATE TABLE portfolio (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                symbol TEXT NOT NULL,
+                quantity INTEGER NOT NULL,
+                purchase_price REAL NOT NULL,
+                purchase_date TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.execute("INSERT INTO portfolio (symbol, quantity, purchase_price, purchase_date) VALUES ('TCS.NS', 5, 3500.0, '2024-01-15')")
+        conn.commit()
+        conn.close()
+
+        conn = storage.connect('test_portfolio.db')
+        version = storage.schema_version(conn)
+        journal = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        kept = conn.execute("SELECT COUNT(*) FROM portfolio").fetchone()[0]
+
+        rows = [(f"SYM{i}.NS", 100.0 + i, '2024-07-08') for i in range(5000)]
+        before = conn.total_changes
+        storage.save_prices(conn, rows)
+        storage.save_prices(conn, [('SYM0.NS', 99.0, '2024-07-08')])
+        written = conn.total_changes - before
+        count = conn.execute("SELECT COUNT(*) FROM price_history").fetchone()[0]
+        updated = conn.execute("SELECT price FROM price_history WHERE symbol = 'SYM0.NS'").fetchone()[0]
+        conn.close()
+        os.remove('test_portfolio.db')
+
+        if (version == len(storage.MIGRATIONS) and journal == 'wal' and kept == 1
+                and {'idx_portfolio_symbol', 'idx_price_history_date'} <= indexes
+                and written == 5001 and count == 5000 and updated == 99.0):
+            print("✅ Storage layer works")
+            return True
+        else:
+            print("❌ Storage layer failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Storage layer test failed: {e}")
+        return False
+
+def test_holdings_table():
+    """Test that holdings track lots incrementally with a weighted average cost"""
+    print("🧪 Testing holdings table...")
+
+    try:
+        import storage
+
+        conn = storage.connect(':memory:')
+        lots = [
+            ('TCS.NS', 10, 3000.00, '2024-01-15'),
+            ('TCS.NS', 30, 4000.00, '2024-02-01'),
+            ('INFY.NS', 5, 1500.00, '2024-01-20'),
+        ]
+        conn.executemany("""
+            INSERT INTO portfolio (symbol, quantity, purchase_price, purchase_date)
+            VALUES (?, ?, ?, ?)
+        """, lots)
+        conn.commit()
+
+        # Weighted: (10 * 3000 + 30 * 4000) / 40, not the plain average 3500
+        after_insert = storage.load_holdings(conn)
+
+        conn.execute("DELETE FROM portfolio WHERE symbol = 'INFY.NS'")
+        conn.execute("DELETE FROM portfolio WHERE purchase_price = 3000.00")
+        conn.commit()
+        after_delete = storage.load_holdings(conn)
+        consistent = storage.check_holdings(conn) == []
+
+        conn.execute("UPDATE holdings SET quantity = 1")
+        drifted = storage.check_holdings(conn, repair=True)
+        repaired = storage.load_holdings(conn)
+        conn.close()
+
+        if (after_insert == [('INFY.NS', 5, 1500.00), ('TCS.NS', 40, 3750.00)]
+                and after_delete == [('TCS.NS', 30, 4000.00)] and consistent
+                and drifted == ['TCS.NS'] and repaired == after_delete):
+            print("✅ Holdings table correct")
+            return True
+        else:
+            print("❌ Holdings table failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Holdings table test failed: {e}")
+        return False
+
+def test_bulk_import():
+    """Test streaming trade import with validation and de-duplication"""
+    print("🧪 Testing bulk import...")
+
+    try:
+        import csv
+        import importer
+        import storage
+
+        with open('test_trades.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Symbol', 'Trade Date', 'Trade Type', 'Quantity', 'Price', 'Trade ID'])
+            writer.writerow(['tcs', '2024-01-15T09:15:32', 'buy', '10', '3500.50', 'T1'])
+            writer.writerow(['INFY.NS', '20-02-2024', 'BUY', '5', '1500', 'T2'])
+            writer.writerow(['TCS', '2024-03-01', 'buy', '30', '4000', 'T3'])
+            writer.writerow(['TCS', '2024-03-05', 'sell', '5', '4100', 'T4'])
+            writer.writerow(['NOTREAL', '2024-03-01', 'buy', '1', '10', 'T5'])
+            writer.writerow(['INFY', '2024-03-01', 'buy', '-3', '10', 'T6'])
+            writer.writerow(['INFY', '2024-03-01', 'buy', '3', 'nan', 'T7'])
+            writer.writerow(['INFY', '2024-03-01', 'buy', '3', 'inf', 'T8'])
+            writer.writerow(['INFY', '2024-03-02', 'sell', '50', '1600', 'T9'])  # more than was held
+
+        first = importer.import_trades('test_trades.csv', 'test_portfolio.db', batch_size=2)
+        again = importer.import_trades('test_trades.csv', 'test_portfolio.db')
+
+        # Without trade ids, a later export with an extra row and a different order only adds the new trades
+        rows = [['WIPRO', '2024-04-01', '2', '400'], ['WIPRO', '2024-04-01', '2', '400'], ['HCLTECH', '2024-04-02', '1', '1200']]
+        with open('test_trades.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Symbol', 'Date', 'Quantity', 'Price'])
+            writer.writerows(rows)
+        no_ids = importer.import_trades('test_trades.csv', 'test_portfolio.db', validate=False)
+        with open('test_trades.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Symbol', 'Date', 'Quantity', 'Price'])
+            writer.writerows([['WIPRO', '2024-03-28', '1', '390']] + rows[::-1] + [['WIPRO', '2024-04-01', '2', '400']])
+        overlap = importer.import_trades('test_trades.csv', 'test_portfolio.db', validate=False)
+
+        conn = storage.connect('test_portfolio.db')
+        # A failed batch leaves the lot trigger working: a lot added afterwards still updates holdings
+        try:
+            storage.bulk_insert_lots(conn, [('INFY.NS', 1, 1500.0, '2024-05-01', 'bad'), ('INFY.NS', 1, 1.0, '2024-05-01')])
+            failed = False
+        except sqlite3.Error:
+            failed = True
+        with conn:
+            storage.insert_lot(conn, 'INFY.NS', 1, 1500.0, '2024-05-02')
+        holdings = storage.load_holdings(conn)
+        consistent = storage.check_holdings(conn) == []
+        conn.close()
+        os.remove('test_trades.csv')
+        os.remove('test_portfolio.db')
+
+        if (first.rows == 9 and first.imported == 3 and first.sold == 1 and first.invalid == 5
+                and again.imported == 0 and again.sold == 0 and again.duplicates == 4 and consistent
+                and any(error.startswith('line 10:') for error in first.errors)
+                and no_ids.imported == 3 and overlap.imported == 2 and overlap.duplicates == 3 and failed
+                and holdings == [('HCLTECH.NS', 1, 1200.0), ('INFY.NS', 6, 1500.0),
+                                 ('TCS.NS', 35, (5 * 3500.50 + 30 * 4000) / 35), ('WIPRO.NS', 7, 2790 / 7)]):
+            print("✅ Bulk import works")
+            return True
+        else:
+            print(f"❌ Bulk import failed: {first} {again} {no_ids} {overlap} {holdings}")
+            return False
+
+    except Exception as e:
+        print(f"❌ Bulk import test failed: {e}")
+        return False
+
+def test_history_store():
+    """Test columnar OHLCV storage, incremental append and aligned range queries"""
+    print("🧪 Testing history store...")
+
+    try:
+        import tempfile
+        import numpy as np
+        from history_store import HistoryStore
+        from quotes import History, StubProvider
+
+        with tempfile.TemporaryDirectory() as root:
+            store = HistoryStore(root)
+            provider = StubProvider()
+            symbols = [f"SYM{i}.NS" for i in range(20)]
+
+            full = store.backfill(symbols, provider)
+            incremental = store.backfill(symbols, provider)
+
+            def bars(dates, closes):
+                closes = np.array(closes, dtype=float)
+                return History(np.array(dates, dtype='datetime64[D]'), closes, closes, closes, closes, closes)
+
+            store.append('NEW.NS', bars(['2024-01-01', '2024-01-02', '2024-01-03'], [10, 11, 12]))
+            store.append('NEW.NS', bars(['2024-01-03', '2024-01-04'], [12.5, 13]))
+            store.append('GAP.NS', bars(['2024-01-02', '2024-01-04'], [20, 21]))
+
+            dates, closes = store.window('NEW.NS', '2024-01-02', '2024-01-03')
+            days, matrix = store.matrix(['NEW.NS', 'GAP.NS'], '2024-01-01', '2024-01-04')
+            big_days, big = store.matrix(symbols, '2015-01-01', '2024-12-31')
+
+        if (all(rows > 2000 for rows in full.values()) and not any(incremental.values())
+                and closes.tolist() == [11.0, 12.5] and str(dates[0]) == '2024-01-02'
+                and len(days) == 4 and matrix[:, 0].tolist() == [10, 11, 12.5, 13]
+                and np.isnan(matrix[0, 1]) and matrix[3, 1] == 21
+                and big.shape == (len(big_days), 20) and not np.isnan(big).any()):
+            print("✅ History store works")
+            return True
+        else:
+            print("❌ History store failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ History store test failed: {e}")
+        return False
+
+def test_analytics():
+    """Test vectorized returns, risk statistics and incremental updates"""
+    print("🧪 Testing portfolio analytics...")
+
+    try:
+        import numpy as np
+        from analytics import PortfolioAnalytics
+
+        dates = np.array(['2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04'], dtype='datetime64[D]')
+        prices = [[100, 50], [110, 50], [110, 55], [99, 55]]
+        benchmark = [1000, 1100, 1100, 990]
+        lots = [('A.NS', 10, 100, '2024-01-01'), ('B.NS', 20, 50, '2024-01-02')]
+        analytics = PortfolioAnalytics(lots, dates, ['A.NS', 'B.NS'], prices, benchmark=benchmark)
+
+        # Day returns net of the day-2 purchase: +10%, +1000/2100, -110/2200
+        expected_twr = 1.1 * (1 + 100 / 2100) * (1 - 110 / 2200) - 1
+        contributions = analytics.contributions()
+        values_ok = analytics.values.tolist() == [1000, 2100, 2200, 2090]
+        twr_ok = abs(analytics.time_weighted_return() - expected_twr) < 1e-12
+        drawdown_ok = abs(analytics.max_drawdown() + 0.05) < 1e-12
+        contributions_ok = contributions['A.NS'][0] == -10 and contributions['B.NS'][0] == 100
+
+        # Incremental updates must match a rebuild from scratch
+        analytics.add_lot('A.NS', 5, 105, '2024-01-03')
+        analytics.add_lot('C.NS', 1, 500, '2024-01-04')
+        analytics.update_prices('2024-01-05', {'A.NS': 90})
+        analytics.update_prices('2024-01-05', {'A.NS': 100})  # a later refresh the same day replaces the price
+        rebuilt = PortfolioAnalytics(lots + [('A.NS', 5, 105, '2024-01-03'), ('C.NS', 1, 500, '2024-01-04')],
+                                     np.append(dates, np.datetime64('2024-01-05')), ['A.NS', 'B.NS'],
+                                     prices + [[100, 55]])
+        incremental_ok = (len(analytics.dates) == len(rebuilt.dates) and np.allclose(analytics.values, rebuilt.values)
+                          and abs(analytics.xirr() - rebuilt.xirr()) < 1e-9
+                          and abs(analytics.time_weighted_return() - rebuilt.time_weighted_return()) < 1e-12)
+
+        # A single lot grown 10% over exactly one year has an XIRR of 10%
+        year = PortfolioAnalytics([('A.NS', 1, 100, '2023-01-01')], ['2023-01-01', '2024-01-01'], ['A.NS'], [[100], [110]])
+
+        if (values_ok and twr_ok and drawdown_ok and contributions_ok and incremental_ok
+                and abs(year.xirr() - 0.1) < 1e-9 and analytics.beta() is not None):
+            print("✅ Portfolio analytics work")
+            return True
+        else:
+            print("❌ Portfolio analytics failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Portfolio analytics test failed: {e}")
+        return False
+
+def test_symbol_index():
+    """Test prefix, company-name and fuzzy symbol search and the on-disk index cache"""
+    print("🧪 Testing symbol search index...")
+
+    try:
+        import os
+        import tempfile
+        from symbol_index import SymbolIndex
+
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'symbols.csv')
+            with open(path, 'w') as f:
+                f.write("Symbol,Name\nINFY.NS,Infosys Ltd\nRELIANCE.NS,Reliance Industries Ltd\n"
+                        "TATASTEEL.NS,Tata Steel Ltd\nTCS.NS,Tata Consultancy Services Ltd\n")
+
+            index = SymbolIndex.load(path)
+            prefix = [symbol for symbol, _ in index.search('ta')]
+            names = [symbol for symbol, _ in index.search('tata consult')]
+            fuzzy = [symbol for symbol, _ in index.search('relaince')]
+            cached = SymbolIndex.load(path)
+
+            with open(path, 'a') as f:
+                f.write("SBIN.NS,State Bank of India\n")
+            os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+            rebuilt = SymbolIndex.load(path)
+
+        if (prefix == ['TATASTEEL.NS', 'TCS.NS'] and names == ['TCS.NS'] and fuzzy == ['RELIANCE.NS']
+                and index.search('infy') == [('INFY.NS', 'Infosys Ltd')] and index.search('  ') == []
+                and len(cached) == 4 and cached.search('tcs') == [('TCS.NS', 'Tata Consultancy Services Ltd')]
+                and len(rebuilt) == 5 and rebuilt.search('state bank')[0][0] == 'SBIN.NS'):
+            print("✅ Symbol search index works")
+            return True
+        else:
+            print("❌ Symbol search index failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Symbol search index test failed: {e}")
+        return False
+
+def test_exporter():
+    """Test chunked numeric export of holdings, lots and price history"""
+    print("🧪 Testing streaming export...")
+
+    try:
+        import csv
+        import json
+        import tempfile
+        import exporter
+        import storage
+
+        with tempfile.TemporaryDirectory() as root:
+            conn = storage.connect(os.path.join(root, 'export.db'))
+            with conn:
+                conn.executemany("INSERT INTO portfolio (symbol, quantity, purchase_price, purchase_date) "
+                                 "VALUES (?, ?, ?, ?)",
+                                 [('TCS.NS', 10, 3000.0, '2024-01-01'), ('INFY.NS', 5, 1500.0, '2024-01-02')])
+                storage.save_prices(conn, [('TCS.NS', 3100.0, '2024-01-01'), ('TCS.NS', 3300.0, '2024-01-02')]
+                                    + [('INFY.NS', 1400.0 + day, f"2024-02-{day:02d}") for day in range(1, 26)])
+
+            holdings = exporter.export(conn, 'holdings', os.path.join(root, 'holdings.csv'))
+            lots = exporter.export(conn, 'lots', os.path.join(root, 'lots.jsonl'))
+            prices = exporter.export(conn, 'prices', os.path.join(root, 'prices.csv'), chunk_size=4)
+            conn.close()
+
+            with open(os.path.join(root, 'holdings.csv'), newline='') as f:
+                holding_rows = list(csv.DictReader(f))
+            with open(os.path.join(root, 'lots.jsonl')) as f:
+                lot_rows = [json.loads(line) for line in f]
+            with open(os.path.join(root, 'prices.csv'), newline='') as f:
+                price_rows = list(csv.reader(f))
+
+        tcs = holding_rows[1]
+        if (holdings == 2 and lots == 2 and prices == 27 and len(price_rows) == 28
+                and tcs['symbol'] == 'TCS.NS' and float(tcs['price']) == 3300.0 and float(tcs['gain_loss']) == 3000.0
+                and lot_rows[0]['quantity'] == 10 and lot_rows[1]['purchase_price'] == 1500.0
+                and (lot_rows[0]['account_id'], lot_rows[0]['portfolio_id']) == (1, 1)
+                and price_rows[1] == ['INFY.NS', '2024-02-01', '1401.0']):
+            print("✅ Streaming export works")
+            return True
+        else:
+            print("❌ Streaming export failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Streaming export test failed: {e}")
+        return False
+
+def test_cold_start():
+    """Test valuation snapshots and that startup paints them without importing yfinance or pandas"""
+    print("🧪 Testing cold start...")
+
+    try:
+        import startup_bench
+        import storage
+        from engine import PortfolioEngine
+        from workers import DbWriter
+
+        db_path = 'test_snapshot.db'
+        conn = storage.connect(db_path)
+        engine = PortfolioEngine()
+        engine.load([('INFY.NS', 5, 1500.0), ('TCS.NS', 10, 3000.0)])
+        engine.set_prices({'TCS.NS': 3300.0})
+        first = storage.save_snapshot(conn, engine.valuation(), '2024-01-01T10:00:00')
+
+        writer = DbWriter(db_path)
+        engine.set_prices({'INFY.NS': 1600.0})
+        writer.call(storage.write_snapshot, engine.valuation())
+        writer.flush()
+        writer.close()
+        taken_at, positions = storage.load_snapshot(conn)
+        snapshots = conn.execute("SELECT COUNT(*), MAX(id) FROM snapshots").fetchone()
+        conn.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+        result = startup_bench.run(positions=200, repeat=1, gui=False)
+
+        if (snapshots == (2, first + 1) and taken_at != '2024-01-01T10:00:00'
+                and positions == [('INFY.NS', 5, 1500.0, 1600.0), ('TCS.NS', 10, 3000.0, 3300.0)]
+                and result['heavy_modules'] == [] and result['priced_rows'] == 200):
+            print(f"✅ Cold start works (first paint {result['first_paint_ms']:.0f} ms)")
+            return True
+        else:
+            print("❌ Cold start failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Cold start test failed: {e}")
+        return False
+
+def test_daemon():
+    """Test the market-hours schedule, adaptive backoff and per-cycle writes of the headless recorder"""
+    print("🧪 Testing headless daemon...")
+
+    try:
+        import threading
+        from datetime import datetime
+        import alerts
+        import storage
+        from daemon import IST, MarketSchedule, PriceDaemon
+        from quotes import StubProvider
+
+        def at(text):
+            return datetime.fromisoformat(text).replace(tzinfo=IST)
+
+        schedule = MarketSchedule(market_interval=60, off_hours_interval=0, holidays=['2024-06-04'])
+        delays = [schedule.delay(at(t)) for t in ('2024-06-03T10:00', '2024-06-03T15:29:30', '2024-06-03T16:00')]
+        slow = MarketSchedule(off_hours_interval=3600).delay(at('2024-06-08T12:00'))
+
+        class FlakyProvider(StubProvider):
+            failing = True
+
+            def fetch_quote(self, symbol):
+                return None if self.failing else super().fetch_quote(symbol)
+
+        db_path = 'test_daemon.db'
+        conn = storage.connect(db_path)
+        storage.bulk_insert_lots(conn, [(f"SYM{i}.NS", 10, 100.0, '2024-01-01', f"daemon:{i}") for i in range(60)])
+        alerts.add_rule(conn, 'above', 1, 'SYM0.NS')
+        alert_log = 'test_daemon_alerts.jsonl'
+        provider = FlakyProvider(max_workers=8)
+        daemon = PriceDaemon(db_path, provider=provider, schedule=schedule, clock=lambda: at('2024-06-03T10:00'),
+                             alert_log=alert_log)
+
+        daemon.run_cycle(threading.Event())
+        daemon.run_cycle(threading.Event())
+        backed_off = (daemon.failures, provider.max_workers, daemon.next_delay(daemon.clock()))
+        nothing_written = conn.execute("SELECT COUNT(*) FROM price_history").fetchone()[0] == 0
+
+        provider.failing = False
+        daemon.run_cycle(threading.Event())
+        recorded = conn.execute("SELECT COUNT(*), MIN(date) FROM price_history").fetchone()
+        snapshot = storage.load_snapshot(conn)
+        recovered = (daemon.failures, provider.max_workers)
+        fired = [alert.symbol for alert in alerts.read_log(alert_log)]
+
+        # A weekend cycle records a snapshot but no price_history row for the Saturday
+        daemon.clock = lambda: at('2024-06-08T12:00')
+        daemon.run_cycle(threading.Event())
+        weekend_rows = conn.execute("SELECT COUNT(*) FROM price_history WHERE date = '2024-06-08'").fetchone()[0]
+        weekend_snapshot = storage.load_snapshot(conn)[0]
+
+        # Move rules measure from the previous close, re-read when the day rolls over
+        move = alerts.add_rule(conn, 'move_down', 10, 'SYM1.NS')
+        daemon.check_alerts(conn, {}, at('2024-06-03T11:00').date())
+        same_day = daemon.alert_engine.levels.get(move)
+        daemon.check_alerts(conn, {}, at('2024-06-04T10:00').date())
+        next_day = daemon.alert_engine.levels.get(move)
+        close = conn.execute("SELECT price FROM price_history WHERE symbol = 'SYM1.NS'").fetchone()[0]
+        conn.close()
+        for path in (db_path, db_path + '-wal', db_path + '-shm', alert_log):
+            if os.path.exists(path):
+                os.remove(path)
+
+        # Tuesday is a holiday, so after Monday's close the next cycle is Wednesday's open
+        if (delays == [60, 30.0, (at('2024-06-05T09:15') - at('2024-06-03T16:00')).total_seconds()] and slow == 3600
+                and backed_off[:2] == (2, 2) and 192 <= backed_off[2] <= 240 and nothing_written
+                and recovered == (0, 3) and recorded == (60, '2024-06-03')
+                and snapshot[0].startswith('2024-06-03T10:00') and len(snapshot[1]) == 60 and fired == ['SYM0.NS']
+                and same_day is None and abs(next_day - 0.9 * close) < 1e-9
+                and weekend_rows == 0 and weekend_snapshot.startswith('2024-06-08T12:00')):
+            print("✅ Headless daemon works")
+            return True
+        else:
+            print("❌ Headless daemon failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Headless daemon test failed: {e}")
+        return False
+
+def test_load_generator():
+    """Test synthetic books, feed save/load and the replay provider's injected faults"""
+    print("🧪 Testing load generator...")
+
+    try:
+        import tempfile
+        import numpy as np
+        import loadgen
+        import storage
+
+        first = [lot for batch in loadgen.generate_lots(500, symbols=50, seed=7, batch_size=200) for lot in batch]
+        again = [lot for batch in loadgen.generate_lots(500, symbols=50, seed=7, batch_size=200) for lot in batch]
+
+        with tempfile.TemporaryDirectory() as root:
+            db_path = os.path.join(root, 'load.db')
+            stats = loadgen.populate(db_path, 2000, symbols=100, history_days=30)
+
+            feed = loadgen.QuoteFeed.generate(['AAA.NS', 'BBB.NS'], 3)
+            feed.prices[1, 0] = np.nan
+            feed.save(os.path.join(root, 'feed.jsonl'))
+            loaded = loadgen.QuoteFeed.load(os.path.join(root, 'feed.jsonl'))
+
+            provider = loadgen.ReplayProvider(loaded)
+            frame0 = provider.get_quotes(['AAA.NS', 'BBB.NS', 'ZZZ.NS'])
+            provider.advance()
+            frame1 = provider.get_quotes(['AAA.NS'])
+
+            faulty = [loadgen.ReplayProvider(loadgen.QuoteFeed.generate(200, 1), error_rate=0.2, seed=3)
+                      for _ in range(2)]
+            failed = [sorted(s for s, q in p.get_quotes(p.feed.symbols).items() if q is None) for p in faulty]
+
+            cycles = loadgen.replay(db_path, loadgen.ReplayProvider(loadgen.QuoteFeed.generate(100, 2)), 2)
+            conn = storage.connect(db_path)
+            lots = conn.execute("SELECT COUNT(*) FROM portfolio").fetchone()[0]
+            snapshots = conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+            conn.close()
+
+        if (first == again and len(first) == 500 and len({lot[0] for lot in first}) <= 50
+                and stats['lots'] == 2000 and stats['history_rows'] == 3000 and lots == 2000
+                and loaded.prices.shape == (3, 2) and np.isnan(loaded.prices[1, 0])
+                and frame0['AAA.NS'].price == feed.prices[0, 0] and frame0['ZZZ.NS'] is None
+                and frame1['AAA.NS'].price == feed.prices[0, 0]
+                and failed[0] == failed[1] and 20 <= len(failed[0]) <= 60
+                and [c.priced for c in cycles] == [100, 100] and snapshots == 2):
+            print("✅ Load generator works")
+            return True
+        else:
+            print("❌ Load generator failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Load generator test failed: {e}")
+        return False
+
+def test_benchmarks():
+    """Test that the benchmark suite runs every case and flags regressions against a baseline"""
+    print("🧪 Testing benchmarks...")
+
+    try:
+        import copy
+        import tempfile
+        import benchmarks
+
+        current = benchmarks.run(sizes=[50], repeat=1)
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'bench.json')
+            benchmarks.write_results(current, path)
+            loaded = benchmarks.load_results(path)
+
+        slower = copy.deepcopy(current)
+        for result in slower['results']:
+            result['median_s'] = result['median_s'] * 2 + 0.01 if result['case'] == 'load' else result['median_s']
+        regressions = benchmarks.compare(current, slower)
+        steady = benchmarks.compare(current, current)
+
+        if (loaded == current and {r['case'] for r in current['results']} == set(benchmarks.CASES)
+                and all(r['size'] == 50 and r['items'] > 0 and r['median_s'] >= 0 for r in current['results'])
+                and [(r.case, r.size) for r in regressions] == [('load', 50)] and not steady):
+            print("✅ Benchmarks work")
+            return True
+        else:
+            print("❌ Benchmarks failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Benchmarks test failed: {e}")
+        return False
+
+def test_metrics():
+    """Test spans, counters, histograms, Prometheus text, the JSON log and profiling"""
+    print("🧪 Testing metrics...")
+
+    try:
+        import json
+        import tempfile
+        import metrics
+        from quote_cache import QuoteCache
+        from quotes import StubProvider
+
+        registry = metrics.Metrics()
+        for seconds in (0.002, 0.004, 0.02, 0.3):
+            registry.observe('refresh_seconds', seconds)
+        registry.count('quotes_total', 3, result='priced')
+        with registry.span('fx'):
+            pass
+        try:
+            with registry.span('db_transaction'):
+                raise ValueError("disk full")
+        except ValueError:
+            raised = True
+
+        with tempfile.TemporaryDirectory() as root:
+            log_path = os.path.join(root, 'log.jsonl')
+            registry.open_log(log_path)
+            registry.log('info', 'refresh', seconds=0.3, symbols=10)
+            registry.close_log()
+            with open(log_path) as f:
+                records = [json.loads(line) for line in f]
+
+            prom_path = os.path.join(root, 'metrics.prom')
+            registry.write_prometheus(prom_path)
+            with open(prom_path) as f:
+                text = f.read()
+
+            with metrics.profile(os.path.join(root, 'refresh.prof')):
+                sum(range(1000))
+            report = metrics.profile_report(os.path.join(root, 'refresh.prof'))
+
+        histogram = registry.histogram('refresh_seconds')
+        report_text = metrics.format_report(registry.snapshot())
+
+        before = metrics.REGISTRY.value('quote_cache_total', result='miss')
+        cache = QuoteCache(StubProvider())
+        cache.get_quotes(['AAA.NS', 'BBB.NS'])
+        cache.get_quotes(['AAA.NS'])
+        misses = metrics.REGISTRY.value('quote_cache_total', result='miss') - before
+
+        if (raised and histogram.count == 4 and abs(histogram.sum - 0.326) < 1e-9
+                and 0.0025 <= histogram.quantile(0.5) <= 0.005
+                and registry.value('errors_total', event='db_transaction') == 1
+                and registry.histogram('span_seconds', span='db_transaction').count == 1
+                and records == [r for r in records if r['event'] == 'refresh'] and records[0]['symbols'] == 10
+                and 'tracker_quotes_total{result="priced"} 3' in text
+                and 'tracker_refresh_seconds_bucket{le="0.005"} 2' in text
+                and 'tracker_refresh_seconds_bucket{le="+Inf"} 4' in text
+                and 'tracker_refresh_seconds_count 4' in text
+                and 'ValueError: disk full' in report_text and 'function calls' in report
+                and misses == 2):
+            print("✅ Metrics work")
+            return True
+        else:
+            print("❌ Metrics failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Metrics test failed: {e}")
+        return False
+
+def test_accounts():
+    """Test accounts and portfolios: scoped lots and holdings, consolidation and one quote per symbol"""
+    print("🧪 Testing accounts...")
+
+    try:
+        import sqlite3
+        import storage
+        from analytics import load_lots
+        from engine import value_accounts
+        from quotes import StubProvider
+
+        # A database from before accounts existed keeps its lots, now in the default portfolio
+        legacy = sqlite3.connect('test_accounts.db')
+        for statements in storage.MIGRATIONS[:5]:
+            for statement in statements:
+                legacy.execute(statement)
+        legacy.execute("PRAGMA user_version = 5")
+        legacy.execute("""
+            INSERT INTO portfolio (symbol, quantity, purchase_price, purchase_date) VALUES ('TCS.NS', 10, 3000, '2024-01-01')
+        """)
+        legacy.commit()
+        legacy.close()
+
+        conn = storage.connect('test_accounts.db')
+        migrated = storage.load_holdings(conn, portfolio_id=storage.DEFAULT_PORTFOLIO)
+        client, client_main = storage.create_account(conn, 'Client A')
+        client_ira = storage.create_portfolio(conn, client, 'IRA')
+        storage.insert_lot(conn, 'TCS.NS', 30, 4000.0, '2024-02-01', client_main)
+        storage.insert_lot(conn, 'INFY.NS', 5, 1500.0, '2024-02-01', client_ira)
+        conn.commit()
+        storage.bulk_insert_lots(conn, [('INFY.NS', 5, 1700.0, '2024-03-01', 'trade:1')], client_ira)
+        storage.bulk_insert_lots(conn, [('INFY.NS', 5, 1700.0, '2024-03-01', 'trade:1')], storage.DEFAULT_PORTFOLIO)
+
+        consolidated = storage.load_holdings(conn)
+        account = storage.load_holdings(conn, account_id=client)
+        ira = storage.load_holdings(conn, portfolio_id=client_ira)
+        ira_lots = load_lots(conn, portfolio_id=client_ira)
+        account_lots = load_lots(conn, account_id=client)
+        consistent = storage.check_holdings(conn) == []
+
+        positions = storage.load_account_holdings(conn)
+        provider = StubProvider(prices={'TCS.NS': 4500.0, 'INFY.NS': 1600.0})
+        quotes = provider.get_quotes([symbol for _, symbol, _, _ in positions])
+        totals = value_accounts(positions, {symbol: quote.price for symbol, quote in quotes.items()})
+
+        storage.delete_position(conn, 'TCS.NS', account_id=client)
+        conn.commit()
+        after_delete = storage.load_holdings(conn)
+        try:
+            storage.insert_lot(conn, 'TCS.NS', 1, 1.0, '2024-01-01', 999)
+            rejected = False
+        except ValueError:
+            rejected = True
+        storage.delete_account(conn, client)
+        remaining = storage.list_accounts(conn)
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        plan = ' '.join(row[3] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT symbol FROM portfolio WHERE account_id = 2 AND symbol = 'TCS.NS'"))
+        conn.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists('test_accounts.db' + suffix):
+                os.remove('test_accounts.db' + suffix)
+
+        if (migrated == [('TCS.NS', 10, 3000.0)] and consistent
+                and consolidated == [('INFY.NS', 15, (5 * 1500 + 10 * 1700) / 15), ('TCS.NS', 40, 3750.0)]
+                and account == [('INFY.NS', 10, 1600.0), ('TCS.NS', 30, 4000.0)]
+                and ira == [('INFY.NS', 10, 1600.0)]
+                and [lot[:2] for lot in ira_lots] == [('INFY.NS', 5), ('INFY.NS', 5)] and len(account_lots) == 3
+                and provider.calls == 2
+                and [(t.account_id, t.positions, t.total_value) for t in totals]
+                == [(1, 2, 10 * 4500 + 5 * 1600), (client, 2, 30 * 4500 + 10 * 1600)]
+                and after_delete == [('INFY.NS', 15, (5 * 1500 + 10 * 1700) / 15), ('TCS.NS', 10, 3000.0)]
+                and rejected and remaining == [(1, 'Default')]
+                and 'idx_portfolio_account_symbol' in indexes and 'idx_portfolio_account_symbol' in plan):
+            print("✅ Accounts work")
+            return True
+        else:
+            print("❌ Accounts failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ Accounts test failed: {e}")
+        return False
+
+def test_api():
+    """Test the local JSON API: reads, ETag 304s, pagination, streaming and validated writes"""
+    print("🧪 Testing API...")
+
+    try:
+        import json
+        import tempfile
+        import threading
+        import urllib.error
+        import urllib.request
+        import api
+        import storage
+
+        with tempfile.TemporaryDirectory() as root:
+            db_path = os.path.join(root, 'api.db')
+            conn = storage.connect(db_path)
+            storage.bulk_insert_lots(conn, [('TCS.NS', 10, 3000.0, '2024-01-01', 'a'),
+                                            ('INFY.NS', 5, 1500.0, '2024-01-02', 'b')])
+            storage.save_prices(conn, [(symbol, 100.0 + day, f"2024-02-{day:02d}")
+                                       for symbol in ('INFY.NS', 'TCS.NS') for day in range(1, 26)])
+            storage.save_prices(conn, [('TCS.NS', 3500.0, '2024-03-01')])
+            conn.close()
+
+            server = api.ApiServer(db_path, port=0)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+
+            def request(path, method='GET', body=None, headers=None):
+                data = json.dumps(body).encode() if body is not None else None
+                req = urllib.request.Request(base + path, data=data, method=method, headers=headers or {})
+                try:
+                    with urllib.request.urlopen(req) as response:
+                        return response.status, dict(response.headers), response.read()
+                except urllib.error.HTTPError as e:
+                    return e.code, dict(e.headers), e.read()
+
+            status, headers, body = request('/holdings')
+            holdings = {h['symbol']: h for h in json.loads(body)['holdings']}
+            etag = headers['ETag']
+            not_modified = request('/holdings', headers={'If-None-Match': etag})[0]
+
+            pages = []
+            cursor = ''
+            while cursor is not None:
+                page = json.loads(request(f"/history?limit=20&cursor={cursor}")[2])
+                pages.append(page['history'])
+                cursor = page['next']
+            streamed = [json.loads(line) for line in request('/history?format=ndjson&symbol=TCS.NS')[2].splitlines()]
+
+            # A streaming reader must not stop a writer committing prices
+            stream = urllib.request.urlopen(base + '/history?format=ndjson')
+            stream.read(10)
+            writer = storage.connect(db_path, timeout=1)
+            storage.save_prices(writer, [('TCS.NS', 3600.0, '2024-03-02')])
+            writer.close()
+            stream.close()
+
+            created = request('/lots', 'POST',
+                              {'symbol': 'reliance', 'quantity': '3', 'price': '2500', 'date': '05-01-2024'})
+            invalid = request('/lots', 'POST', {'symbol': 'TCS', 'quantity': '-1', 'price': '10'})
+            null_portfolio = request('/lots', 'POST',
+                                     {'symbol': 'TCS', 'quantity': '1', 'price': '10', 'portfolio': None})[0]
+            bad_length = request('/lots', 'POST', {}, headers={'Content-Length': 'abc'})[0]
+            lot = json.loads(created[2])
+            changed = request('/holdings', headers={'If-None-Match': etag})[0]
+            lots = json.loads(request('/lots?symbol=RELIANCE.NS')[2])['lots']
+            removed = request(f"/lots/{lot['id']}", 'DELETE')[0]
+            missing = request(f"/lots/{lot['id']}", 'DELETE')[0]
+            valuation = json.loads(request('/valuation')[2])
+            unknown = request('/nothing')[0]
+
+            server.shutdown()
+            server.server_close()
+
+        rows = [row for page in pages for row in page]
+        if (status == 200 and holdings['TCS.NS']['price'] == 3500.0 and holdings['TCS.NS']['price_date'] == '2024-03-01'
+                and not_modified == 304 and changed == 200
+                and len(pages) == 3 and len(rows) == 51 and rows == sorted(rows, key=lambda r: (r['symbol'], r['date']))
+                and len(streamed) == 26 and all(r['symbol'] == 'TCS.NS' for r in streamed)
+                and created[0] == 201 and lot['symbol'] == 'RELIANCE.NS' and lot['date'] == '2024-01-05'
+                and invalid[0] == 400 and 'positive' in json.loads(invalid[2])['error']
+                and null_portfolio == 400 and bad_length == 400
+                and [l['id'] for l in lots] == [lot['id']] and removed == 200 and missing == 404
+                and valuation['total_value'] == 10 * 3600.0 + 5 * 125.0 and len(valuation['accounts']) == 1
+                and unknown == 404):
+            print("✅ API works")
+            return True
+        else:
+            print("❌ API failed")
+            return False
+
+    except Exception as e:
+        print(f"❌ API test failed: {e}")
+        return False
+
+def test_alerts():
+    """Test alert rules: threshold crossings, percent moves, P&L limits, dedup/re-arming and the log"""
+    print("🧪 Testing alerts...")
+
+    try:
+        import random
+        import tempfile
+        import time
+        import alerts
+        import storage
+
+        with tempfile.TemporaryDirectory() as root:
+            db_path = os.path.join(root, 'alerts.db')
+            log_path = os.path.join(root, 'alerts.log.jsonl')
+            conn = storage.connect(db_path)
+            account_id, portfolio_id = storage.create_account(conn, 'Client A')
+            storage.insert_lot(conn, 'TCS.NS', 10, 100.0, '2024-01-01', portfolio_id)
+            conn.commit()
+            storage.save_prices(conn, [('INFY.NS', 200.0, '2024-01-02')])
+            above = alerts.add_rule(conn, 'above', 110, 'tcs')
+            below = alerts.add_rule(conn, 'below', 90, 'TCS.NS')
+            move = alerts.add_rule(conn, 'move_down', 10, 'INFY.NS')  # from the previous close, 200
+            pnl = alerts.add_rule(conn, 'pnl_below', -50, account_id=account_id)
+            try:
+                alerts.add_rule(conn, 'above', -5, 'TCS.NS')
+                rejected = False
+            except ValueError:
+                rejected = True
+
+            engine = alerts.AlertEngine()
+            engine.load(conn)
+            fired = []
+            for price in (100, 111, 115, 109.5, 111, 108, 112, 94, 89, 88):
+                fired.append([alert.rule_id for alert in engine.update({'TCS.NS': price, 'INFY.NS': None})])
+            infy = [alert.rule_id for alert in engine.update({'INFY.NS': 185.0})]
+            alerts.append_log([alert for alert in engine.update({'INFY.NS': 179.0})], log_path)
+            with conn:
+                alerts.write_state(conn, engine.take_changes())
+            saved = {rule.id: rule.armed for rule in alerts.list_rules(conn)}
+
+            # Disarmed rules stay quiet after a restart, until the price moves back
+            restarted = alerts.AlertEngine()
+            restarted.load(conn)
+            quiet = restarted.update({'TCS.NS': 88.0, 'INFY.NS': 179.0})
+            rearmed = restarted.update({'TCS.NS': 120.0})
+
+            # Each tick only visits the levels it crosses, however many rules there are
+            conn.executemany("INSERT INTO alert_rules (kind, symbol, threshold) VALUES (?, ?, ?)",
+                             [(random.choice(['above', 'below']), f"S{i % 20}.NS", random.uniform(50, 150))
+                              for i in range(20000)])
+            conn.commit()
+            big = alerts.AlertEngine()
+            big.load(conn)
+            big.update({f"S{i}.NS": 100.0 for i in range(20)})
+            start = time.perf_counter()
+            for _ in range(200):
+                big.update({f"S{i}.NS": 100.0 + random.uniform(-0.001, 0.001) for i in range(20)})
+            tick_seconds = (time.perf_counter() - start) / 200
+            conn.close()
+            logged = alerts.read_log(log_path)
+
+        if (rejected and fired == [[], [above], [], [], [], [], [above], [pnl], [below], []]
+                and infy == [] and [alert.rule_id for alert in logged] == [move]
+                and saved == {above: 1, below: 0, move: 0, pnl: 0}
+                and quiet == [] and [alert.rule_id for alert in rearmed] == [above]
+                and tick_seconds < 0.005):
+            print("✅ Alerts work")
+            return True
+        print(f"❌ Alerts failed: {fired} {infy} {logged} {saved} {quiet} {rearmed} {tick_seconds:.4f}s")
+        return False
+    except Exception as e:
+        print(f"❌ Alerts test failed: {e}")
+        return False
+
+
+def test_ledger():
+    """Test sales: FIFO and specific-lot matching, short/long-term P&L and incremental lot queues"""
+    print("🧪 Testing lot matching...")
+
+    try:
+        import tempfile
+        from datetime import date
+        import ledger
+        import storage
+
+        with tempfile.TemporaryDirectory() as root:
+            db_path = os.path.join(root, 'ledger.db')
+            conn = storage.connect(db_path)
+            book = ledger.LotBook()
+            old = book.buy(conn, 'TCS.NS', 10, 100.0, '2023-01-02')
+            new = book.buy(conn, 'TCS.NS', 10, 120.0, '2024-06-03')
+            oldest = book.buy(conn, 'TCS.NS', 5, 90.0, '2022-01-03')  # back-dated: matched first
+
+            fifo = book.sell(conn, 'TCS.NS', 8, 150.0, '2024-07-01')
+            specific = book.sell(conn, 'TCS.NS', 3, 150.0, '2024-07-02', lot_ids=[new])
+            try:
+                book.sell(conn, 'TCS.NS', 100, 150.0, '2024-07-03')
+                oversold = False
+            except ValueError:
+                oversold = True
+            try:
+                book.sell(conn, 'TCS.NS', 1, 150.0, '2024-01-01', lot_ids=[new])  # bought after the sale date
+                backdated = False
+            except ValueError:
+                backdated = True
+
+            # Lots added over another connection are picked up before the next sale
+            other = storage.connect(db_path)
+            storage.insert_lot(other, 'TCS.NS', 4, 80.0, '2021-01-04')
+            other.commit()
+            other.close()
+            external = book.sell(conn, 'TCS.NS', 4, 150.0, '2024-07-04')
+
+            queues = book.load(conn)
+            unrealized = book.unrealized(queues, {'TCS.NS': 130.0}, today=date(2024, 8, 1))
+            realized = ledger.realized(conn)
+            lots = {lot_id: quantity for lot_id, quantity, _, _ in book.queue(conn, 1, 'TCS.NS').open_lots()}
+            holdings = storage.load_holdings(conn)
+            consistent = storage.check_holdings(conn) == []
+            conn.close()
+
+        if (oversold and backdated and consistent
+                and [(m.lot_id, m.quantity, m.long_term) for m in fifo.matches] == [(oldest, 5, True), (old, 3, True)]
+                and (fifo.short_term, fifo.long_term) == (0, 450.0)
+                and (specific.short_term, specific.long_term) == (90.0, 0)
+                and external.long_term == 280.0 and lots == {old: 7, new: 7}
+                and holdings == [('TCS.NS', 14, 110.0)]
+                and [(r.quantity, r.short_term, r.long_term) for r in realized] == [(15, 90.0, 730.0)]
+                and [(u.quantity, u.short_term, u.long_term) for u in unrealized] == [(14, 70.0, 210.0)]):
+            print("✅ Lot matching works")
+            return True
+        print(f"❌ Lot matching failed: {fifo} {specific} {external} {lots} {holdings} {realized} {unrealized}")
+        return False
+    except Exception as e:
+        print(f"❌ Lot matching test failed: {e}")
+        return False
+
+
+def test_corporate_actions():
+    """Test splits, bonuses and dividends: cumulative factors, adjusted holdings, prices, sales and income"""
+    print("🧪 Testing corporate actions...")
+
+    try:
+        import tempfile
+        from datetime import date
+        import corporate_actions
+        import ledger
+        import numpy as np
+        import storage
+        from analytics import load_prices
+        from history_store import HistoryStore
+        from quotes import History
+
+        with tempfile.TemporaryDirectory() as root:
+            conn = storage.connect(os.path.join(root, 'actions.db'))
+            book = ledger.LotBook()
+            book.buy(conn, 'INFY.NS', 10, 1000.0, '2023-01-02')
+            storage.save_prices(conn, [('INFY.NS', 1000.0, '2024-05-31'), ('INFY.NS', 205.0, '2024-06-03')])
+
+            def bars(dates, closes):
+                closes = np.array(closes, dtype=float)
+                return History(np.array(dates, dtype='datetime64[D]'), closes, closes, closes, closes, closes)
+
+            store = HistoryStore(os.path.join(root, 'history'))
+            store.append('INFY.NS', bars(['2024-05-29'], [1004.0]), fetched='2024-05-31')
+            corporate_actions.add_action(conn, 'INFY.NS', 'split', '2024-06-03', '1:5')
+            bonus = corporate_actions.add_action(conn, 'INFY.NS', 'bonus', '2024-09-02', '1:1')
+            with_bonus = [a.cumulative for a in corporate_actions.list_actions(conn, 'INFY.NS')]
+            corporate_actions.delete_action(conn, bonus)
+            without_bonus = [a.cumulative for a in corporate_actions.list_actions(conn, 'INFY.NS')]
+            try:
+                corporate_actions.add_action(conn, 'INFY.NS', 'split', '2024-06-03', '1:2')
+                duplicate = False
+            except ValueError:
+                duplicate = True
+
+            holdings = storage.load_holdings(conn)
+            _, prices = load_prices(conn, ['INFY.NS'])
+
+            # Yahoo's closes are split-adjusted as of their fetch: the bar fetched before the split is divided by it
+            store.append('INFY.NS', bars(['2024-05-30', '2024-05-31'], [201.0, 202.0]))
+            _, merged = load_prices(conn, ['INFY.NS'], store, {'INFY.NS': 1.0})
+            _, unconverted = load_prices(conn, ['INFY.NS'], store)
+
+            # 7 post-split shares come out of the pre-split lot, leaving 8.6 of its original shares
+            corporate_actions.add_action(conn, 'INFY.NS', 'dividend', '2024-07-01', amount=2.0)
+            sale = book.sell(conn, 'INFY.NS', 7, 210.0, '2024-07-15')
+            corporate_actions.add_action(conn, 'INFY.NS', 'dividend', '2024-08-01', amount=1.0)
+            after_sale = storage.load_holdings(conn)
+            unrealized = book.unrealized(book.load(conn), {'INFY.NS': 220.0}, today=date(2024, 8, 1),
+                                         adjustments=corporate_actions.Adjustments.load(conn))
+            dividends = [(d.ex_date, round(d.shares, 6), round(d.income, 6))
+                         for d in corporate_actions.dividend_income(conn)]
+            consistent = storage.check_holdings(conn) == []
+            conn.close()
+
+        if (duplicate and consistent and with_bonus == [10.0, 2.0] and without_bonus == [5.0]
+                and holdings == [('INFY.NS', 50, 200.0)]
+                and prices[:, 0].tolist() == [200.0, 205.0] and merged[:, 0].tolist() == [200.8, 201.0, 200.0, 205.0]
+                and np.isnan(unconverted[:2, 0]).all()
+                and [(m.quantity, m.purchase_price) for m in sale.matches] == [(7, 200.0)]
+                and round(sale.long_term, 6) == 70.0
+                and [(h[0], h[1], round(h[2], 6)) for h in after_sale] == [('INFY.NS', 43, 200.0)]
+                and [(u.quantity, round(u.long_term, 6)) for u in unrealized] == [(43, 860.0)]
+                and dividends == [('2024-07-01', 50.0, 100.0), ('2024-08-01', 43.0, 43.0)]):
+            print("✅ Corporate actions work")
+            return True
+        print(f"❌ Corporate actions failed: {with_bonus} {without_bonus} {holdings} {prices} {merged} {sale} "
+              f"{after_sale} {unrealized} {dividends}")
+        return False
+    except Exception as e:
+        print(f"❌ Corporate actions test failed: {e}")
+        return False
+
+
+def test_chart():
+    """Test the chart's LTTB downsampling and its per-zoom-level tiles of portfolio value"""
+    print("🧪 Testing chart data...")
+
+    try:
+        import tempfile
+        from datetime import date, timedelta
+        import numpy as np
+        import storage
+        from chart import ChartData, lttb, lttb_columns
+
+        x = np.arange(1000)
+        y = np.sin(x / 50.0)
+        y[500] = 10.0
+        kept = lttb(x, y, 100)
+        nan_column = np.column_stack((y, np.where(x < 300, np.nan, y)))
+        columns = lttb_columns(x, nan_column, 100)
+
+        with tempfile.TemporaryDirectory() as root:
+            conn = storage.connect(os.path.join(root, 'chart.db'))
+            days = [(date(2024, 1, 1) + timedelta(days=i)).isoformat() for i in range(366)]
+            storage.save_prices(conn, [(symbol, price + i, day) for i, day in enumerate(days)
+                                       for symbol, price in (('TCS.NS', 100.0), ('INFY.NS', 50.0))])
+            with conn:
+                storage.insert_lot(conn, 'TCS.NS', 10, 100.0, '2024-01-01')
+                storage.insert_lot(conn, 'INFY.NS', 5, 50.0, '2024-07-01')
+            data = ChartData.load(conn)
+            whole = data.tile(conn, 0, 0, 1000)
+            values = dict(zip(whole.value_x.astype('datetime64[D]').astype(str).tolist(), whole.value_y.tolist()))
+            quarter_start, quarter_end = data.tile_range(2, 1)
+            quarter = data.tile(conn, 2, 1, 1000)
+            cached = data.cached(0, 0, 1000) is whole
+            conn.close()
+
+        day = days.index('2024-08-01')
+        if (len(kept) == 100 and kept[0] == 0 and kept[-1] == 999 and 500 in kept
+                and (np.diff(kept) > 0).all() and columns.shape == (100, 2) and 500 in columns[:, 1]
+                and cached and data.levels() == 4 and whole.price_y.shape == (366, 2)
+                and values['2024-03-01'] == 10 * (100.0 + days.index('2024-03-01'))
+                and values['2024-08-01'] == 10 * (100.0 + day) + 5 * (50.0 + day)
+                and str(quarter_start) == '2024-04-02' and len(quarter.value_x) == 92
+                and quarter.value_x.min() == quarter_start.astype(np.int64)):
+            print("✅ Chart data works")
+            return True
+        print(f"❌ Chart data failed: {kept} {data.levels()} {quarter_start} {len(quarter.value_x)}")
+        return False
+    except Exception as e:
+        print(f"❌ Chart data test failed: {e}")
+        return False
+
+
+def test_sale_history():
+    """Test that a sale leaves earlier analytics and chart values alone and counts its proceeds"""
+    print("🧪 Testing sale history...")
+
+    try:
+        import tempfile
+        import numpy as np
+        import storage
+        from analytics import PortfolioAnalytics, load_lots
+        from chart import ChartData
+        from ledger import LotBook
+
+        with tempfile.TemporaryDirectory() as root:
+            conn = storage.connect(os.path.join(root, 'sales.db'))
+            storage.save_prices(conn, [('INFY.NS', 100.0, '2024-01-01'), ('INFY.NS', 120.0, '2024-06-03'),
+                                       ('INFY.NS', 125.0, '2024-08-01'), ('INFY.NS', 130.0, '2024-09-02')])
+            book = LotBook()
+            book.buy(conn, 'INFY.NS', 10, 100.0, '2024-01-01')
+            before = PortfolioAnalytics.from_db(conn, benchmark=None)
+            book.sell(conn, 'INFY.NS', 5, 125.0, '2024-08-01')
+            after = PortfolioAnalytics.from_db(conn, benchmark=None)
+            lots = load_lots(conn)
+            tile = ChartData.load(conn).tile(conn, 0, 0, 1000)
+            chart = dict(zip(tile.value_x.astype('datetime64[D]').astype(str).tolist(), tile.value_y.tolist()))
+            conn.close()
+
+        earlier = after.dates < np.datetime64('2024-08-01')
+        values = dict(zip(after.dates.astype(str).tolist(), after.values.tolist()))
+        summary = after.summary()
+        if (lots == [('INFY.NS', 5, 100.0, '2024-01-01'), ('INFY.NS', 5, 100.0, '2024-01-01'),
+                     ('INFY.NS', -5, 125.0, '2024-08-01')]
+                and np.array_equal(after.values[earlier], before.values[:earlier.sum()])
+                and values['2024-01-01'] == 1000 and values['2024-08-01'] == 625 and values['2024-09-02'] == 650
+                and chart['2024-01-01'] == 1000 and chart['2024-08-01'] == 625
+                and summary['invested'] == 1000 and after.flows[-2] == -625
+                and summary['xirr'] is not None and summary['xirr'] > 0):
+            print("✅ Sale history works")
+            return True
+        print(f"❌ Sale history failed: {lots} {values} {chart} {summary}")
+        return False
+    except Exception as e:
+        print(f"❌ Sale history test failed: {e}")
+        return False
+
+
 def main():
     """Run all tests"""
     print("🚀 Running comprehensive tests for Stock Portfolio Tracker\n")
@@ -180,7 +1584,32 @@ def main():
         test_imports,
         test_database_operations,
         test_financial_calculations,
-        test_csv_export
+        test_csv_export,
+        test_quote_provider,
+        test_fx_conversion,
+        test_quote_cache,
+        test_portfolio_engine,
+        test_tree_diff,
+        test_background_workers,
+        test_storage_layer,
+        test_holdings_table,
+        test_bulk_import,
+        test_history_store,
+        test_analytics,
+        test_symbol_index,
+        test_exporter,
+        test_cold_start,
+        test_daemon,
+        test_load_generator,
+        test_benchmarks,
+        test_metrics,
+        test_accounts,
+        test_api,
+        test_alerts,
+        test_ledger,
+        test_corporate_actions,
+        test_chart,
+        test_sale_history
     ]
 
     passed = 0
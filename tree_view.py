@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Incremental Treeview rendering for the Stock Portfolio Tracker
+"""
+
+from tkinter import ttk
+
+import metrics
+
+FRAME_MS = 16  # coalesce render requests into one UI pass per frame
+VIRTUAL_THRESHOLD = 2000  # above this many rows only the visible window is materialized
+DEFAULT_ROW_HEIGHT = 20
+
+
+def diff_rows(shown, keys, rows):
+    """Compare the rows currently in the tree with the wanted ones.
+
+    shown maps item id -> values currently displayed; keys and rows give the
+    wanted ids and values in display order. Returns (inserts, updates, removes)
+    where inserts are (index, key, values), updates are (key, values) and
+    removes are keys.
+    """
+    wanted = dict(zip(keys, rows))
+    removes = [key for key in shown if key not in wanted]
+    inserts = []
+    updates = []
+    for index, (key, values) in enumerate(zip(keys, rows)):
+        old = shown.get(key)
+        if old is None:
+            inserts.append((index, key, values))
+        elif old != values:
+            updates.append((key, values))
+    return inserts, updates, removes
+
+
+class TreeRenderer:
+    """Keeps a Treeview in sync with a list of keyed rows, touching only what changed.
+
+    Rows are produced lazily by format_row(index), so in virtual mode (more
+    than virtual_threshold rows) only the visible window is ever formatted or
+    inserted, and the scrollbar is driven by the renderer instead of the tree.
+    """
+
+    def __init__(self, root, tree, scrollbar, virtual_threshold=VIRTUAL_THRESHOLD):
+        self.root = root
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.virtual_threshold = virtual_threshold
+        self.keys = []
+        self.format_row = None
+        self.shown = {}
+        self.offset = 0
+        self.virtual = False
+        self.pending = None
+
+        self.tree.configure(yscrollcommand=self.on_tree_scroll)
+        self.scrollbar.configure(command=self.yview)
+        self.tree.bind('<MouseWheel>', self.on_wheel)
+        self.tree.bind('<Button-4>', self.on_wheel)
+        self.tree.bind('<Button-5>', self.on_wheel)
+        self.tree.bind('<Configure>', lambda event: self.schedule())
+
+    def render(self, keys, format_row):
+        """Request a redraw of keys, where format_row(i) returns the values for keys[i]"""
+        self.keys = list(keys)
+        self.format_row = format_row
+        self.schedule()
+
+    def schedule(self):
+        if self.pending is None:
+            self.pending = self.root.after(FRAME_MS, self.flush)
+
+    def visible_rows(self):
+        rowheight = ttk.Style().lookup('Treeview', 'rowheight') or DEFAULT_ROW_HEIGHT
+        fitted = (self.tree.winfo_height() - DEFAULT_ROW_HEIGHT) // int(rowheight)
+        return max(int(self.tree.cget('height')), fitted)
+
+    def flush(self):
+        with metrics.span('render'):
+            self.draw()
+
+    def draw(self):
+        self.pending = None
+        total = len(self.keys)
+        self.virtual = total > self.virtual_threshold
+        if self.virtual:
+            visible = self.visible_rows()
+            self.offset = max(0, min(self.offset, total - visible))
+            start, stop = self.offset, min(total, self.offset + visible)
+        else:
+            start, stop = 0, total
+
+        window = self.keys[start:stop]
+        rows = [self.format_row(i) for i in range(start, stop)]
+        inserts, updates, removes = diff_rows(self.shown, window, rows)
+
+        if removes:
+            self.tree.delete(*removes)
+        for key, values in updates:
+            self.tree.item(key, values=values)
+        for index, key, values in inserts:
+            self.tree.insert('', index, iid=key, values=values)
+        if (inserts or removes) and list(self.tree.get_children()) != window:
+            self.tree.set_children('', *window)
+        self.shown = dict(zip(window, rows))
+
+        if self.virtual:
+            self.scrollbar.set(start / total, stop / total)
+
+    def on_tree_scroll(self, first, last):
+        if not self.virtual:
+            self.scrollbar.set(first, last)
+
+    def yview(self, *args):
+        if not self.virtual:
+            return self.tree.yview(*args)
+        total = len(self.keys)
+        if args[0] == 'moveto':
+            self.offset = int(float(args[1]) * total)
+        elif args[0] == 'scroll':
+            amount = int(args[1])
+            if args[2] == 'pages':
+                amount *= self.visible_rows()
+            self.offset += amount
+        self.schedule()
+
+    def on_wheel(self, event):
+        if not self.virtual:
+            return None
+        direction = -1 if event.num == 4 or getattr(event, 'delta', 0) > 0 else 1
+        self.yview('scroll', direction * 3, 'units')
+        return 'break'
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Background workers for the Stock Portfolio Tracker
+
+Tk widgets and sqlite3 connections must only be used from the thread that
+created them. Background threads therefore never touch either directly:
+they post callbacks to a UiQueue, which the Tk main loop drains, and send
+writes to a DbWriter, which owns its own connection.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+import storage
+
+
+class UiQueue:
+    """Runs callbacks posted from any thread on the Tk main loop, in batches via after()"""
+
+    def __init__(self, root, interval=50, batch_size=200):
+        self.root = root
+        self.interval = interval
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.root.after(self.interval, self.drain)
+
+    def post(self, callback, *args):
+        self.queue.put((callback, args))
+
+    def drain(self):
+        start = time.perf_counter()
+        handled = 0
+        for _ in range(self.batch_size):
+            try:
+                callback, args = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            handled += 1
+            try:
+                callback(*args)
+            except Exception as e:
+                metrics.log('error', 'ui_callback', f"Error in UI callback: {e}",
+                            callback=getattr(callback, '__name__', repr(callback)))
+        if handled:
+            metrics.observe('span_seconds', time.perf_counter() - start, span='ui_batch')
+            metrics.count('ui_callbacks_total', handled)
+        self.root.after(self.interval, self.drain)
+
+
+class DbWriter:
+    """Serializes writes through one connection on a dedicated thread.
+
+    Statements queued while a transaction is being written are committed
+    together in the next one. Each runs in its own savepoint, so one that
+    fails is rolled back and reported on its own.
+    """
+
+    def __init__(self, path, on_error=None):
+        self.path = path
+        self.on_error = on_error
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def execute(self, sql, params=()):
+        self.queue.put((sql, [params]))
+
+    def executemany(self, sql, rows):
+        self.queue.put((sql, list(rows)))
+
+    def call(self, function, *args):
+        """Run function(conn, *args) on the writer thread, inside the next transaction"""
+        self.queue.put((function, args))
+
+    def run(self):
+        conn = storage.connect(self.path)
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            statements = [item for item in batch if item is not None]
+            running = len(statements) == len(batch)
+            with metrics.span('db_transaction'):
+                for sql, rows in statements:
+                    # Each job gets a savepoint, so a failing one is undone without losing the rest of the batch
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        if callable(sql):
+                            sql(conn, *rows)
+                        else:
+                            conn.executemany(sql, rows)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO job")
+                        self.report(e)
+                    conn.execute("RELEASE job")
+                try:
+                    conn.commit()
+                except sqlite3.Error as e:
+                    conn.rollback()
+                    self.report(e)
+            for _ in batch:
+                self.queue.task_done()
+        conn.close()
+
+    def report(self, error):
+        if self.on_error:
+            self.on_error(error)
+        else:
+            print(f"Database write failed: {error}")
+
+    def flush(self):
+        """Block until every queued write has been committed"""
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+
+class RefreshController:
+    """Runs job(cancelled) on a background thread, one run at a time.
+
+    Requests made while a run is in flight are coalesced into a single
+    follow-up run. cancel() sets the running job's event and drops any
+    queued follow-up; jobs should check the event between units of work.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.lock = threading.Lock()
+        self.running = False
+        self.rerun = False
+        self.cancelled = None
+
+    def request(self):
+        """Start a run, or queue one if a run is in flight. Returns True if a new run started."""
+        with self.lock:
+            if self.running:
+                self.rerun = True
+                return False
+            self.running = True
+            self.cancelled = threading.Event()
+            cancelled = self.cancelled
+
+        thread = threading.Thread(target=self.run, args=(cancelled,))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def cancel(self):
+        with self.lock:
+            self.rerun = False
+            if self.cancelled is not None:
+                self.cancelled.set()
+
+    def is_running(self):
+        with self.lock:
+            return self.running
+
+    def run(self, cancelled):
+        while True:
+            try:
+                self.job(cancelled)
+            except Exception as e:
+                metrics.log('error', 'background_job', f"Background job failed: {e}")
+            with self.lock:
+                if self.rerun and not cancelled.is_set():
+                    self.rerun = False
+                    cancelled = self.cancelled = threading.Event()
+                    continue
+                self.running = False
+                return